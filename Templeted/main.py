@@ -1,16 +1,30 @@
-from fastapi import FastAPI, Form, Request
-from fastapi.templating import Jinja2Templates
+from fastapi import APIRouter, FastAPI, Form, Request
 from fastapi.responses import HTMLResponse
+import os
 
-app = FastAPI()
+router = APIRouter()
+
+# Las plantillas (Jinja2) se cargan en la primera petición, no al importar el módulo.
+# El directorio es relativo a este fichero para que funcione desde cualquier cwd.
+DIRECTORIO_PLANTILLAS = os.path.dirname(os.path.abspath(__file__))
+_templates = None
 
-templates = Jinja2Templates(directory="templates")
+def obtener_templates():
+    global _templates
+    if _templates is None:
+        from fastapi.templating import Jinja2Templates
+        _templates = Jinja2Templates(directory=DIRECTORIO_PLANTILLAS)
+    return _templates
 
-@app.get("/", response_class=HTMLResponse)
+@router.get("/", response_class=HTMLResponse)
 async def home(request: Request):
-    return templates.TemplateResponse("index.html", {"request": request})
+    return obtener_templates().TemplateResponse(request, "index.html")
 
-@app.post("/ask", response_class=HTMLResponse)
+@router.post("/ask", response_class=HTMLResponse)
 async def ask(request: Request, question: str = Form(...)):
     response = f"Respuesta generada por el LLM para: {question}"
-    return templates.TemplateResponse("index.html", {"request": request, "response": response})
+    return obtener_templates().TemplateResponse(request, "index.html", {"response": response})
+
+# App independiente (uvicorn main:app); el servidor unificado (backend/servidor.py) monta el router bajo /plantilla
+app = FastAPI()
+app.include_router(router)
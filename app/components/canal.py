@@ -0,0 +1,384 @@
+"""Canal WebSocket para el análisis guiado: un mensaje por paso en vez de un POST.
+
+En las tablets de planta (Wi-Fi pobre) cada POST paga preflight CORS,
+conexión y cabeceras; por el canal viaja todo el análisis sobre una sola
+conexión. Los mensajes reutilizan los endpoints HTTP existentes: el modelo
+pydantic de cada endpoint es el esquema de su mensaje.
+
+Cliente -> servidor (JSON):
+
+    {"id": "c1", "tipo": "paso", "datos": {"numero": 1, "respuesta": "..."}, "sugerir": true, "ack": 7}
+    {"id": "c2", "tipo": "sugerir", "datos": {"metodo": "ishikawa"}}
+    {"id": "c3", "tipo": "sesion", "datos": {"sesion_id": "..."}}
+    {"tipo": "pong", "ack": 9}
+
+``tipo`` es una de las operaciones del router (``iniciar``, ``paso``,
+``fmea``...), ``sugerir`` (paso con LLM en streaming) o ``sesion`` (retomar
+una sesión existente). ``ack`` confirma todos los mensajes hasta ese ``seq``
+y puede ir en cualquier mensaje. Tras ``iniciar`` el canal recuerda la
+sesión y la añade a los pasos que no traen ``sesion_id``.
+
+Servidor -> cliente:
+
+    {"seq": 8, "ref": "c1", "tipo": "resultado", "datos": {...}}   respuesta del endpoint
+    {"seq": 9, "ref": "c1", "tipo": "error", "datos": {"codigo": 422, "detail": [...]}}
+    {"seq": 10, "ref": "c2", "tipo": "delta", "datos": {"delta": "..."}}
+    {"seq": 11, "ref": "c2", "tipo": "fin", "datos": {"analisis": "..."}}
+    {"tipo": "ping", "seq": 11}                                    latido, sin numerar
+
+Reanudación: ``/ws/analisis?canal=<id>&ultimo=<seq>`` reenvía lo publicado
+después de ``ultimo``. Los canales viven en memoria del worker durante
+WS_RESUME_TTL segundos tras caer la conexión (con varios workers hace falta
+afinidad de sesión en el balanceador; si no, el cliente recibe 410 y abre un
+canal nuevo retomando su ``sesion_id``, que sí está en SQLite).
+
+Contrapresión: como mucho WS_WINDOW mensajes enviados sin confirmar; el
+resto espera en el canal. Los productores de resultados esperan a que haya
+hueco y los fragmentos del LLM se agrupan en el último ``delta`` pendiente,
+así un cliente lento no retiene el turno del LLM ni hace crecer la memoria.
+Los errores de entrada (mensaje no válido, cola llena) no esperan; si llegan
+con la ventana ya llena el cliente envía sin leer ni confirmar y el canal se
+cierra con 1008.
+"""
+import asyncio
+import inspect
+import json
+import math
+import os
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+from uuid import uuid4
+
+from fastapi import APIRouter, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.encoders import jsonable_encoder
+from fastapi.routing import APIRoute
+from pydantic import BaseModel, ValidationError
+
+WS_HEARTBEAT = float(os.getenv("WS_HEARTBEAT", "15"))
+# Sin ningún mensaje del cliente (pong, ack...) en este tiempo se cierra la conexión
+WS_TIMEOUT = float(os.getenv("WS_TIMEOUT", str(3 * WS_HEARTBEAT)))
+WS_WINDOW = int(os.getenv("WS_WINDOW", "32"))
+WS_RESUME_TTL = float(os.getenv("WS_RESUME_TTL", "120"))
+WS_QUEUE_MAX = int(os.getenv("WS_QUEUE_MAX", "32"))
+
+# Método de la sugerencia automática ("sugerir": true) según la operación
+METODO_SUGERENCIA = {
+    "paso": "5 porques",
+    "fivewhys": "5 porques",
+    "ishikawa": "ishikawa",
+    "fmea": "fmea",
+    "causa_raiz": "conclusion",
+    "conclusion": "conclusion",
+}
+
+
+class Operacion:
+    """Endpoint HTTP reutilizado como manejador de un tipo de mensaje."""
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.modelo = None
+        self.param_modelo = None
+        self.param_request = None
+        for nombre, parametro in inspect.signature(endpoint).parameters.items():
+            if inspect.isclass(parametro.annotation) and issubclass(parametro.annotation, BaseModel):
+                self.modelo, self.param_modelo = parametro.annotation, nombre
+            elif parametro.annotation is Request:
+                self.param_request = nombre
+
+    def validar(self, datos: Any, sesion_id: Optional[str]) -> BaseModel:
+        if sesion_id and isinstance(datos, dict) and "sesion_id" in self.modelo.model_fields:
+            datos = {"sesion_id": sesion_id, **datos}
+        return self.modelo.model_validate(datos)
+
+    def ejecutar(self, modelo: BaseModel, conexion: WebSocket):
+        argumentos = {self.param_modelo: modelo}
+        if self.param_request:
+            # Los endpoints solo usan request.app.state, que el WebSocket también tiene
+            argumentos[self.param_request] = conexion
+        return self.endpoint(**argumentos)
+
+
+def operaciones_de(router: APIRouter, tipos: Dict[str, str]) -> Dict[str, Operacion]:
+    """{tipo de mensaje: ruta POST del router} -> operaciones del canal."""
+    rutas = {r.path: r.endpoint for r in router.routes if isinstance(r, APIRoute) and "POST" in r.methods}
+    return {tipo: Operacion(rutas[ruta]) for tipo, ruta in tipos.items()}
+
+
+class VentanaLlena(Exception):
+    """El cliente sigue enviando con la ventana llena de mensajes sin confirmar."""
+
+
+class Canal:
+    """Estado de un análisis que sobrevive a las reconexiones."""
+
+    def __init__(self, operaciones: Dict[str, Operacion], conexion: WebSocket, ventana: int = WS_WINDOW):
+        self.id = uuid4().hex
+        self.operaciones = operaciones
+        self.ventana = ventana
+        self.conexion = conexion
+        self.sesion_id: Optional[str] = None
+        self.seq = 0
+        # Mensajes publicados y aún sin confirmar; "enviado" es el último escrito en la conexión actual
+        self.pendientes: Deque[Dict[str, Any]] = deque()
+        self.enviado = 0
+        self.latido = False
+        self.cambios = asyncio.Condition()
+        self.entrada: asyncio.Queue = asyncio.Queue()
+        self.expira = math.inf
+        self.tareas_conexion = []
+        self.sugerencia: Optional[asyncio.Task] = None
+        self.procesador = asyncio.create_task(self._procesar())
+
+    # --- Salida ---
+
+    async def publicar(self, tipo: str, datos: Dict[str, Any], ref: Optional[str] = None, esperar: bool = True) -> None:
+        async with self.cambios:
+            if tipo == "delta":
+                # Los fragmentos nunca esperan: se agrupan en el último delta aún sin enviar
+                ultimo = self.pendientes[-1] if self.pendientes else None
+                if ultimo and ultimo["tipo"] == "delta" and ultimo["ref"] == ref and ultimo["seq"] > self.enviado:
+                    ultimo["datos"]["delta"] += datos["delta"]
+                    return
+            elif esperar:
+                await self.cambios.wait_for(lambda: len(self.pendientes) < self.ventana)
+            elif len(self.pendientes) >= self.ventana:
+                raise VentanaLlena()
+            self.seq += 1
+            self.pendientes.append({"seq": self.seq, "ref": ref, "tipo": tipo, "datos": datos})
+            self.cambios.notify_all()
+
+    def _siguiente(self) -> Optional[Dict[str, Any]]:
+        if not self.pendientes or self.enviado >= self.pendientes[-1]["seq"]:
+            return None
+        indice = self.enviado + 1 - self.pendientes[0]["seq"]
+        return self.pendientes[indice] if indice < self.ventana else None
+
+    async def escribir(self, websocket: WebSocket) -> None:
+        """Único escritor de la conexión: mensajes dentro de la ventana y latidos."""
+        while True:
+            async with self.cambios:
+                await self.cambios.wait_for(lambda: self.latido or self._siguiente() is not None)
+                if self.latido:
+                    self.latido = False
+                    texto = json.dumps({"tipo": "ping", "seq": self.seq})
+                else:
+                    mensaje = self._siguiente()
+                    # Se serializa bajo el candado: a partir de aquí el delta ya no admite agrupar más
+                    texto = json.dumps(mensaje, ensure_ascii=False)
+                    self.enviado = mensaje["seq"]
+            await websocket.send_text(texto)
+
+    async def latir(self) -> None:
+        while True:
+            await asyncio.sleep(WS_HEARTBEAT)
+            async with self.cambios:
+                self.latido = True
+                self.cambios.notify_all()
+
+    async def confirmar(self, seq: int) -> None:
+        async with self.cambios:
+            seq = min(seq, self.enviado)
+            while self.pendientes and self.pendientes[0]["seq"] <= seq:
+                self.pendientes.popleft()
+            self.cambios.notify_all()
+
+    async def reanudar(self, ultimo: int) -> bool:
+        """Prepara el reenvío desde ``ultimo + 1``; False si esos mensajes ya no están."""
+        async with self.cambios:
+            primero = self.pendientes[0]["seq"] if self.pendientes else self.seq + 1
+            if not primero - 1 <= ultimo <= self.seq:
+                return False
+            while self.pendientes and self.pendientes[0]["seq"] <= ultimo:
+                self.pendientes.popleft()
+            self.enviado = ultimo
+            self.latido = False
+            self.cambios.notify_all()
+            return True
+
+    # --- Entrada ---
+
+    async def recibir(self, texto: str) -> None:
+        try:
+            mensaje = json.loads(texto)
+            if not isinstance(mensaje, dict):
+                raise ValueError("se esperaba un objeto JSON")
+            if "ack" in mensaje:
+                await self.confirmar(int(mensaje["ack"]))
+        except (ValueError, TypeError) as e:
+            await self.publicar("error", {"codigo": 400, "detail": f"Mensaje no válido: {e}"}, esperar=False)
+            return
+        if mensaje.get("tipo") in (None, "ack", "pong", "ping"):
+            return
+        if self.entrada.qsize() >= WS_QUEUE_MAX:
+            await self.publicar(
+                "error", {"codigo": 429, "detail": "Demasiados mensajes sin procesar"}, mensaje.get("id"), esperar=False
+            )
+            return
+        self.entrada.put_nowait(mensaje)
+
+    async def _procesar(self) -> None:
+        # Los pasos se procesan en orden de llegada; las sugerencias corren aparte
+        while True:
+            mensaje = await self.entrada.get()
+            ref = mensaje.get("id")
+            tipo = mensaje.get("tipo")
+            datos = mensaje.get("datos") or {}
+            try:
+                if tipo == "sugerir":
+                    self._lanzar_sugerencia(ref, datos.get("metodo", "5 porques"), datos.get("tarea"))
+                elif tipo == "sesion":
+                    await self._retomar_sesion(ref, datos.get("sesion_id"))
+                elif tipo in self.operaciones:
+                    operacion = self.operaciones[tipo]
+                    modelo = operacion.validar(datos, self.sesion_id)
+                    resultado = await asyncio.to_thread(operacion.ejecutar, modelo, self.conexion)
+                    if isinstance(resultado, dict) and resultado.get("sesion_id"):
+                        self.sesion_id = resultado["sesion_id"]
+                    await self.publicar("resultado", jsonable_encoder(resultado), ref)
+                    if mensaje.get("sugerir"):
+                        self._lanzar_sugerencia(ref, METODO_SUGERENCIA.get(tipo, "5 porques"), None)
+                else:
+                    await self.publicar("error", {"codigo": 400, "detail": f"Tipo de mensaje desconocido: {tipo}"}, ref)
+            except ValidationError as e:
+                await self.publicar("error", {"codigo": 422, "detail": jsonable_encoder(e.errors())}, ref)
+            except HTTPException as e:
+                await self.publicar("error", {"codigo": e.status_code, "detail": e.detail}, ref)
+            except Exception as e:
+                # Un fallo en un paso no debe tumbar el canal
+                await self.publicar("error", {"codigo": 500, "detail": f"Error al procesar el mensaje: {e}"}, ref)
+
+    async def _retomar_sesion(self, ref: Optional[str], sesion_id: Optional[str]) -> None:
+        obtener = getattr(self.conexion.app.state, "sesiones", None)
+        if obtener is None:
+            raise HTTPException(status_code=501, detail="Las sesiones solo están disponibles en el servidor unificado")
+        sesion = await asyncio.to_thread(obtener().obtener, sesion_id) if sesion_id else None
+        if sesion is None:
+            raise HTTPException(status_code=404, detail="Sesión no encontrada o expirada")
+        self.sesion_id = sesion_id
+        await self.publicar("resultado", {"sesion_id": sesion_id, "pasos": sesion["pasos"]}, ref)
+
+    def _lanzar_sugerencia(self, ref: Optional[str], metodo: str, tarea: Optional[str]) -> None:
+        sugerencias = getattr(self.conexion.app.state, "sugerencias", None)
+        if sugerencias is None:
+            raise HTTPException(status_code=501, detail="Las sugerencias solo están disponibles en el servidor unificado")
+        if not self.sesion_id:
+            raise HTTPException(status_code=409, detail="Abre primero una sesión (iniciar o sesion)")
+        if self.sugerencia is not None and not self.sugerencia.done():
+            raise HTTPException(status_code=409, detail="Ya hay una sugerencia en curso en este canal")
+        self.sugerencia = asyncio.create_task(self._sugerir(sugerencias, ref, metodo, tarea))
+
+    async def _sugerir(self, sugerencias, ref: Optional[str], metodo: str, tarea: Optional[str]) -> None:
+        fragmentos = []
+        try:
+            async for delta in sugerencias(self.sesion_id, metodo, tarea, self.conexion):
+                fragmentos.append(delta)
+                await self.publicar("delta", {"delta": delta}, ref)
+        except LookupError:
+            await self.publicar("error", {"codigo": 404, "detail": "Sesión no encontrada o expirada"}, ref)
+        except ValueError as e:
+            # Datos del mensaje no válidos (p. ej. una tarea demasiado larga), como el 422 del endpoint
+            await self.publicar("error", {"codigo": 422, "detail": str(e)}, ref)
+        except Exception as e:
+            # Rechazo del control de admisión (trae retry_after) o fallo del LLM
+            retry_after = getattr(e, "retry_after", None)
+            if retry_after is not None:
+                datos = {"codigo": 429, "detail": f"Demasiadas peticiones ({e}). Reintenta más tarde.", "retry_after": retry_after}
+            else:
+                datos = {"codigo": 500, "detail": f"Error al generar el análisis: {e}"}
+            await self.publicar("error", datos, ref)
+        else:
+            await self.publicar("fin", {"metodo": metodo, "analisis": "".join(fragmentos)}, ref)
+
+    # --- Ciclo de vida ---
+
+    def cerrar(self) -> None:
+        for tarea in [self.procesador, self.sugerencia, *self.tareas_conexion]:
+            if tarea is not None:
+                tarea.cancel()
+
+
+# Canales de este worker, por id
+CANALES: Dict[str, Canal] = {}
+
+
+def _purgar_canales() -> None:
+    ahora = time.monotonic()
+    for canal_id in [c.id for c in CANALES.values() if c.expira < ahora]:
+        CANALES.pop(canal_id).cerrar()
+
+
+async def atender(websocket: WebSocket, operaciones: Dict[str, Operacion], canal_id: Optional[str] = None, ultimo: int = 0) -> None:
+    """Sirve una conexión: canal nuevo o reanudación de ``canal_id`` desde ``ultimo``."""
+    await websocket.accept()
+    _purgar_canales()
+    if canal_id:
+        canal = CANALES.get(canal_id)
+        if canal is None or not await canal.reanudar(ultimo):
+            await websocket.send_json({"tipo": "error", "datos": {"codigo": 410, "detail": "No se puede reanudar el canal"}})
+            await websocket.close(code=4410)
+            return
+        # Si la conexión anterior sigue abierta (el cliente reconectó sin notar el corte) se sustituye
+        anterior = canal.conexion
+        for tarea in canal.tareas_conexion:
+            tarea.cancel()
+        if anterior is not websocket:
+            try:
+                await anterior.close(code=4409)
+            except Exception:
+                pass
+        canal.conexion = websocket
+    else:
+        canal = Canal(operaciones, websocket)
+        CANALES[canal.id] = canal
+    canal.expira = math.inf
+
+    await websocket.send_json({
+        "tipo": "bienvenida",
+        "datos": {
+            "canal": canal.id,
+            "seq": canal.seq,
+            "sesion_id": canal.sesion_id,
+            "ventana": canal.ventana,
+            "latido": WS_HEARTBEAT,
+        },
+    })
+    canal.tareas_conexion = [asyncio.create_task(canal.escribir(websocket)), asyncio.create_task(canal.latir())]
+    cierre_limpio = False
+    try:
+        while True:
+            texto = await asyncio.wait_for(websocket.receive_text(), WS_TIMEOUT)
+            await canal.recibir(texto)
+    except asyncio.TimeoutError:
+        # El cliente no responde a los latidos: se corta y queda pendiente de reanudar
+        for tarea in canal.tareas_conexion:
+            tarea.cancel()
+        try:
+            await websocket.close(code=1001)
+        except Exception:
+            pass
+    except WebSocketDisconnect as e:
+        # 1000: el cliente terminó el análisis a propósito, no va a reanudar
+        cierre_limpio = e.code == 1000
+    except VentanaLlena:
+        # No lee ni confirma pero sigue enviando: se descarta el canal en vez de acumular errores
+        for tarea in canal.tareas_conexion:
+            tarea.cancel()
+        cierre_limpio = True
+        try:
+            await websocket.close(code=1008)
+        except Exception:
+            pass
+    except RuntimeError:
+        # Conexión sustituida por una reanudación: el socket ya está cerrado
+        pass
+    finally:
+        if canal.conexion is websocket:
+            for tarea in canal.tareas_conexion:
+                tarea.cancel()
+            if cierre_limpio:
+                CANALES.pop(canal.id, None)
+                canal.cerrar()
+            else:
+                canal.expira = time.monotonic() + WS_RESUME_TTL
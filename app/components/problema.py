@@ -1,24 +1,52 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, HTTPException, Request
 from pydantic import BaseModel
+from typing import Optional
 
 router = APIRouter()
 
+def almacen_sesiones(request: Request):
+    # El servidor unificado publica el almacén de sesiones en app.state;
+    # si esta app corre sola no hay sesiones y los endpoints siguen sin estado
+    obtener = getattr(request.app.state, "sesiones", None)
+    return obtener() if obtener else None
+
+def registrar_paso(request: Request, sesion_id: Optional[str], metodo: str, contenido: str):
+    """Añade el paso a la sesión indicada (si la hay) y devuelve su número."""
+    if not sesion_id:
+        return None
+    sesiones = almacen_sesiones(request)
+    if sesiones is None:
+        raise HTTPException(status_code=501, detail="Las sesiones solo están disponibles en el servidor unificado")
+    sesion = sesiones.agregar_paso(sesion_id, metodo, contenido)
+    if sesion is None:
+        raise HTTPException(status_code=404, detail="Sesión no encontrada o expirada")
+    return sesion["pasos"]
+
 # Definir el modelo de datos para el problema
 class Problema(BaseModel):
     descripcion: str
     observaciones: str
 
-# Endpoint para iniciar el análisis
+# Endpoint para iniciar el análisis (abre una sesión: el problema ya no se reenvía en cada paso)
 @router.post("/iniciar")
-def iniciar_analisis(problema: Problema):
-    return {"mensaje": "Análisis iniciado", "problema": problema}
+def iniciar_analisis(problema: Problema, request: Request):
+    resultado = {"mensaje": "Análisis iniciado", "problema": problema}
+    sesiones = almacen_sesiones(request)
+    if sesiones is not None:
+        resultado["sesion_id"] = sesiones.crear(problema.model_dump())["id"]
+    return resultado
 
 # Modelo para los pasos de 5 Porqués
 class Paso(BaseModel):
     numero: int
     respuesta: str
+    sesion_id: Optional[str] = None
 
 # Endpoint para registrar cada paso
 @router.post("/paso")
-def siguiente_paso(paso: Paso):
-    return {"mensaje": f"Respuesta registrada para el paso {paso.numero}", "respuesta": paso.respuesta}
+def siguiente_paso(paso: Paso, request: Request):
+    resultado = {"mensaje": f"Respuesta registrada para el paso {paso.numero}", "respuesta": paso.respuesta}
+    paso_sesion = registrar_paso(request, paso.sesion_id, "5 porques", f"Porqué {paso.numero}: {paso.respuesta}")
+    if paso_sesion is not None:
+        resultado["paso_sesion"] = paso_sesion
+    return resultado
@@ -1,17 +1,21 @@
-from fastapi import FastAPI
+from fastapi import APIRouter, FastAPI, HTTPException, Request, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
+from typing import Any, Dict, List, Optional
+import asyncio
+import csv
 
-app = FastAPI()
+from .components import canal as canal_ws
+from .components import problema as flujo
+from .components.problema import registrar_paso
 
-# Habilitar CORS para permitir el acceso desde el frontend
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # Permite cualquier origen (ajústalo en producción)
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+def motor():
+    # motor_analisis arrastra numpy: se importa en la primera petición que lo usa,
+    # no al arrancar el proceso
+    from . import motor_analisis
+    return motor_analisis
+
+router = APIRouter()
 
 class problema(BaseModel):
     Problem: str
@@ -24,65 +28,178 @@ class expertopinions(BaseModel):
 class fivewhysanalysis(BaseModel):
     metodo: str
     respuesta: str
+    sesion_id: Optional[str] = None
 
+# Los campos de datos opcionales siguen la forma que usa el frontend (app/utils/ai-engine.ts)
 class fmeaanalysis(BaseModel):
     metodo: str
     respuesta: str
+    failureModes: Optional[List[Dict[str, Any]]] = None
+    sesion_id: Optional[str] = None
 
 class ishikawadiagram(BaseModel):
     metodo: str
     respuesta: str
+    categories: Optional[List[Dict[str, Any]]] = None
+    causes: Optional[Dict[str, List[Dict[str, Any]]]] = None
+    sesion_id: Optional[str] = None
 
 class paretoanalysis(BaseModel):
     metodo: str
     respuesta: str
+    causes: Optional[List[Dict[str, Any]]] = None
+    sesion_id: Optional[str] = None
 
 class rootcauseconclusionsal(BaseModel):
     respuesta: str
+    rootCauses: Optional[Dict[str, str]] = None
+    problem: Optional[Dict[str, Any]] = None
+    sesion_id: Optional[str] = None
 
 class conclusion(BaseModel):
     respuesta: str
+    sesion_id: Optional[str] = None
 
 class solutionproposal(BaseModel):
     propuesta: str
 
-@app.post("/problema/")
+@router.post("/problema/")
 def recibir_problema(problema: problema):
     return {"mensaje": "Problema recibido", "descripcion": problema.descripcion}
 
-@app.post("/expertopinions/")
+@router.post("/expertopinions/")
 def aplicar_metodologia(metodologia: expertopinions):
     return {"mensaje": f"Metodología {metodologia.metodo} aplicada", "respuesta": metodologia.respuesta}
 
-@app.post("/fivewhysanalysis/")
-def aplicar_metodologia(metodologia: fivewhysanalysis):
-    return {"mensaje": f"Metodología {metodologia.metodo} aplicada", "respuesta": metodologia.respuesta}
-
-@app.post("/fmeaanalysis/")
-def aplicar_metodologia(metodologia: fmeaanalysis):
-    return {"mensaje": f"Metodología {metodologia.metodo} aplicada", "respuesta": metodologia.respuesta}
-
-@app.post("/ishikawadiagram/")
-def aplicar_metodologia(metodologia: ishikawadiagram):
-    return {"mensaje": f"Metodología {metodologia.metodo} aplicada", "respuesta": metodologia.respuesta}
-
-@app.post("/paretoanalysis/")
-def aplicar_metodologia(metodologia: paretoanalysis):
-    return {"mensaje": f"Metodología {metodologia.metodo} aplicada", "respuesta": metodologia.respuesta}
-
-@app.post("/rootcauseconclusionsal/")
-def aplicar_metodologia(metodologia:  rootcauseconclusionsal):
-    return {"mensaje": f"Metodología {metodologia.metodo} aplicada", "respuesta": metodologia.respuesta}
-
-@app.post("/conclusion/")
-def recibir_conclusion(respuesta: conclusion):
-    return {"mensaje": "Conclusion recibida", "respuesta": conclusion}
-
-@app.post("/solutionproposal/")
+def anotar_en_sesion(request: Request, metodologia, metodo: str, resultado: Dict[str, Any]) -> Dict[str, Any]:
+    # Con sesion_id el paso (respuesta + conclusión del análisis) se acumula en la sesión
+    contenido = metodologia.respuesta
+    conclusion_analisis = resultado.get("analisis", {}).get("conclusion") or resultado.get("conclusion")
+    if conclusion_analisis:
+        contenido += "\n" + conclusion_analisis
+    paso = registrar_paso(request, metodologia.sesion_id, metodo, contenido)
+    if paso is not None:
+        resultado["paso_sesion"] = paso
+    return resultado
+
+@router.post("/fivewhysanalysis/")
+def aplicar_metodologia(metodologia: fivewhysanalysis, request: Request):
+    resultado = {"mensaje": f"Metodología {metodologia.metodo} aplicada", "respuesta": metodologia.respuesta}
+    return anotar_en_sesion(request, metodologia, "5 porques", resultado)
+
+# Los endpoints con datos son "def": FastAPI los ejecuta en el threadpool y el
+# cálculo vectorizado no bloquea el event loop
+@router.post("/fmeaanalysis/")
+def aplicar_metodologia(metodologia: fmeaanalysis, request: Request):
+    resultado = {"mensaje": f"Metodología {metodologia.metodo} aplicada", "respuesta": metodologia.respuesta}
+    if metodologia.failureModes:
+        acumulador = motor().AcumuladorFMEA()
+        acumulador.agregar(metodologia.failureModes)
+        resultado["analisis"] = acumulador.resultado()
+    return anotar_en_sesion(request, metodologia, "fmea", resultado)
+
+@router.post("/ishikawadiagram/")
+def aplicar_metodologia(metodologia: ishikawadiagram, request: Request):
+    resultado = {"mensaje": f"Metodología {metodologia.metodo} aplicada", "respuesta": metodologia.respuesta}
+    if metodologia.causes:
+        # Del formato del frontend ({categoryId: [{text}]}) a filas {category, text}
+        nombres = {str(c.get("id")): c.get("name", str(c.get("id"))) for c in metodologia.categories or []}
+        filas = [
+            {"category": nombres.get(categoria, categoria), "text": causa.get("text", "")}
+            for categoria, causas in metodologia.causes.items()
+            for causa in causas
+        ]
+        acumulador = motor().AcumuladorIshikawa()
+        acumulador.agregar(filas)
+        resultado["analisis"] = acumulador.resultado()
+    return anotar_en_sesion(request, metodologia, "ishikawa", resultado)
+
+@router.post("/paretoanalysis/")
+def aplicar_metodologia(metodologia: paretoanalysis, request: Request):
+    resultado = {"mensaje": f"Metodología {metodologia.metodo} aplicada", "respuesta": metodologia.respuesta}
+    if metodologia.causes:
+        acumulador = motor().AcumuladorPareto()
+        acumulador.agregar(metodologia.causes)
+        resultado["analisis"] = acumulador.resultado()
+    return anotar_en_sesion(request, metodologia, "pareto", resultado)
+
+async def analizar_subida(metodo: str, request: Request) -> Dict[str, Any]:
+    """Procesa una subida grande (CSV, NDJSON o array JSON) por lotes según llega."""
+    acumulador = motor().ACUMULADORES[metodo]()
+    formato = motor().formato_de(request.headers.get("content-type", ""))
+    filas = 0
+    try:
+        async for lote in motor().filas_en_lotes(request.stream(), formato):
+            filas += len(lote)
+            await asyncio.to_thread(acumulador.agregar, lote)
+    except (ValueError, UnicodeDecodeError, csv.Error) as e:
+        raise HTTPException(status_code=400, detail=f"No se pudo leer el archivo ({formato}): {e}")
+    return {"mensaje": f"Metodología {metodo} aplicada", "filas": filas, "analisis": acumulador.resultado()}
+
+@router.post("/fmeaanalysis/upload")
+async def subir_fmea(request: Request):
+    return await analizar_subida("fmea", request)
+
+@router.post("/ishikawadiagram/upload")
+async def subir_ishikawa(request: Request):
+    return await analizar_subida("ishikawa", request)
+
+@router.post("/paretoanalysis/upload")
+async def subir_pareto(request: Request):
+    return await analizar_subida("pareto", request)
+
+@router.post("/rootcauseconclusionsal/")
+def aplicar_metodologia(metodologia:  rootcauseconclusionsal, request: Request):
+    resultado = {"mensaje": "Conclusión de causa raíz recibida", "respuesta": metodologia.respuesta}
+    if metodologia.rootCauses:
+        resultado["conclusion"] = motor().conclusion_integrada(metodologia.rootCauses, metodologia.problem or {})
+    return anotar_en_sesion(request, metodologia, "causa raiz", resultado)
+
+@router.post("/conclusion/")
+def recibir_conclusion(respuesta: conclusion, request: Request):
+    resultado = {"mensaje": "Conclusion recibida", "respuesta": respuesta.respuesta}
+    return anotar_en_sesion(request, respuesta, "conclusion", resultado)
+
+@router.post("/solutionproposal/")
 def recibir_solucion(solucion: solutionproposal):
     return {"mensaje": "Solución propuesta recibida", "propuesta": solucion.propuesta}
 
-@app.get("/")
+# /iniciar y /paso del análisis guiado (app/components/problema.py)
+router.include_router(flujo.router)
+
+# Canal WebSocket con todo el análisis (app/components/canal.py): cada tipo de
+# mensaje se atiende con el endpoint POST equivalente y usa su modelo como esquema
+OPERACIONES_CANAL = canal_ws.operaciones_de(router, {
+    "iniciar": "/iniciar",
+    "paso": "/paso",
+    "problema": "/problema/",
+    "expertos": "/expertopinions/",
+    "fivewhys": "/fivewhysanalysis/",
+    "fmea": "/fmeaanalysis/",
+    "ishikawa": "/ishikawadiagram/",
+    "pareto": "/paretoanalysis/",
+    "causa_raiz": "/rootcauseconclusionsal/",
+    "conclusion": "/conclusion/",
+    "solucion": "/solutionproposal/",
+})
+
+@router.websocket("/ws/analisis")
+async def canal_analisis(websocket: WebSocket, canal: Optional[str] = None, ultimo: int = 0):
+    await canal_ws.atender(websocket, OPERACIONES_CANAL, canal, ultimo)
+
+@router.get("/")
 def home():
     return {"mensaje": "Bienvenido a la aplicación para su solucion"}
-    
\ No newline at end of file
+
+# App independiente (uvicorn app.main:app); el servidor unificado (backend/servidor.py) monta solo el router
+app = FastAPI()
+
+# Habilitar CORS para permitir el acceso desde el frontend
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],  # Permite cualquier origen (ajústalo en producción)
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+app.include_router(router)
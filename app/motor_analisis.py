@@ -0,0 +1,532 @@
+"""Motor de análisis de causa raíz en el servidor (Pareto, FMEA, Ishikawa, conclusión integrada).
+
+Reproduce la lógica de ``app/utils/ai-engine.ts`` pero con operaciones
+vectorizadas de NumPy, para poder procesar decenas de miles de registros de
+fallas que el navegador no soporta. Cada metodología tiene un acumulador que
+recibe los registros por lotes (``agregar``), de modo que una subida grande
+se procesa en trozos sin cargarla entera en memoria, y un ``resultado()``
+con el ranking y el texto de conclusión.
+"""
+import codecs
+import csv
+import json
+import re
+from collections import Counter, deque
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional
+
+import numpy as np
+
+UMBRAL_PARETO = 80.0
+RPN_CRITICO = 200
+UMBRAL_ISHIKAWA = 20.0
+LIMITE_RANKING = 50
+TAM_LOTE = 5000
+
+
+def _campo(fila: Dict[str, Any], *nombres: str, defecto: Any = None) -> Any:
+    for nombre in nombres:
+        if nombre in fila and fila[nombre] not in (None, ""):
+            return fila[nombre]
+    return defecto
+
+
+def _a_float(valor: Any) -> float:
+    try:
+        return float(valor)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _numeros(valores: List[Any]) -> np.ndarray:
+    """Convierte una columna a float; vacíos y no numéricos quedan como NaN."""
+    try:
+        return np.array([np.nan if v is None or v == "" else v for v in valores], dtype=float)
+    except (TypeError, ValueError):
+        return np.array([_a_float(v) for v in valores], dtype=float)
+
+
+# --- Pareto ---
+
+class AcumuladorPareto:
+    """Suma frecuencias por causa; cada fila es una causa (``frequency`` por defecto 1)."""
+
+    def __init__(self):
+        self._nombres: Dict[str, int] = {}
+        self._totales = np.zeros(0)
+
+    def agregar(self, filas: List[Dict[str, Any]]) -> None:
+        nombres = np.array([str(_campo(f, "name", "causa", "cause", defecto="")) for f in filas])
+        frecuencias = _numeros([_campo(f, "frequency", "frecuencia", defecto=1) for f in filas])
+        validos = (nombres != "") & np.isfinite(frecuencias) & (frecuencias > 0)
+        if not validos.any():
+            return
+        unicos, inverso = np.unique(nombres[validos], return_inverse=True)
+        sumas = np.bincount(inverso, weights=frecuencias[validos])
+
+        indices = np.empty(len(unicos), dtype=np.int64)
+        for i, nombre in enumerate(unicos.tolist()):
+            indice = self._nombres.get(nombre)
+            if indice is None:
+                indice = self._nombres[nombre] = len(self._nombres)
+            indices[i] = indice
+        if len(self._nombres) > len(self._totales):
+            self._totales = np.concatenate([self._totales, np.zeros(len(self._nombres) - len(self._totales))])
+        np.add.at(self._totales, indices, sumas)
+
+    def resultado(self, umbral: float = UMBRAL_PARETO, limite: int = LIMITE_RANKING) -> Dict[str, Any]:
+        if not self._nombres:
+            return {"total": 0, "causas": [], "vital_few": [], "conclusion": ""}
+        nombres = list(self._nombres.keys())
+        orden = np.argsort(-self._totales, kind="stable")
+        frecuencias = self._totales[orden]
+        total = frecuencias.sum()
+        porcentajes = frecuencias / total * 100
+        acumulado = np.cumsum(porcentajes)
+        # Pocas vitales: hasta la primera causa que alcanza el umbral (incluida)
+        n_vitales = int(np.searchsorted(acumulado, umbral - 1e-9)) + 1
+        n_vitales = min(n_vitales, len(orden))
+
+        causas = [
+            {
+                "name": nombres[orden[i]],
+                "frequency": float(frecuencias[i]),
+                "percentage": round(float(porcentajes[i]), 1),
+                "cumulative": round(float(acumulado[i]), 1),
+            }
+            for i in range(min(limite, len(orden)))
+        ]
+        vitales = [nombres[orden[i]] for i in range(n_vitales)]
+        return {
+            "total": float(total),
+            "n_causas": len(orden),
+            "causas": causas,
+            "vital_few": vitales,
+            "conclusion": self._conclusion(vitales, porcentajes, float(acumulado[n_vitales - 1]), len(orden)),
+        }
+
+    @staticmethod
+    def _conclusion(vitales: List[str], porcentajes: np.ndarray, acumulado: float, n_causas: int) -> str:
+        lista = "\n".join(f"{i + 1}. {n} ({porcentajes[i]:.1f}% del total)" for i, n in enumerate(vitales))
+        return (
+            f"El análisis de Pareto ha identificado {n_causas} causas potenciales del problema. "
+            f"Siguiendo el principio de Pareto (regla 80/20), se han identificado {len(vitales)} causas principales "
+            f"que representan aproximadamente el {acumulado:.1f}% del problema:\n\n{lista}\n\n"
+            f"La causa principal \"{vitales[0]}\" representa por sí sola el {porcentajes[0]:.1f}% del problema, "
+            "lo que la convierte en el factor más crítico a abordar.\n\n"
+            "Se recomienda priorizar acciones correctivas enfocadas en estas \"pocas vitales\", especialmente en "
+            f"\"{vitales[0]}\", para obtener la mayor mejora con el menor esfuerzo."
+        )
+
+
+# --- FMEA ---
+
+class AcumuladorFMEA:
+    """Calcula RPN = severidad × ocurrencia × detección y conserva el top por RPN."""
+
+    def __init__(self, limite: int = LIMITE_RANKING):
+        self.limite = limite
+        self.total = 0
+        self.criticos = 0
+        self._suma_rpn = 0.0
+        self._top: List[Dict[str, Any]] = []
+
+    def agregar(self, filas: List[Dict[str, Any]]) -> None:
+        if not filas:
+            return
+        s = _numeros([_campo(f, "severity", "severidad") for f in filas])
+        o = _numeros([_campo(f, "occurrence", "ocurrencia") for f in filas])
+        d = _numeros([_campo(f, "detection", "deteccion", "detección") for f in filas])
+        rpn = s * o * d
+        validos = np.isfinite(rpn)
+        if not validos.any():
+            return
+        rpn_validos = rpn[validos]
+        self.total += int(validos.sum())
+        self.criticos += int((rpn_validos >= RPN_CRITICO).sum())
+        self._suma_rpn += float(rpn_validos.sum())
+
+        # Candidatos del lote: solo los que pueden entrar en el top (argpartition, O(n))
+        indices = np.flatnonzero(validos)
+        if len(indices) > self.limite:
+            parte = np.argpartition(-rpn[indices], self.limite - 1)[: self.limite]
+            indices = indices[parte]
+        candidatos = self._top + [
+            {**filas[i], "severity": float(s[i]), "occurrence": float(o[i]), "detection": float(d[i]), "rpn": float(rpn[i])}
+            for i in indices
+        ]
+        rpns = np.array([c["rpn"] for c in candidatos])
+        orden = np.argsort(-rpns, kind="stable")[: self.limite]
+        self._top = [candidatos[i] for i in orden]
+
+    def resultado(self) -> Dict[str, Any]:
+        if not self._top:
+            return {"total": 0, "criticos": 0, "ranking": [], "conclusion": ""}
+        criticos = [m for m in self._top if m["rpn"] >= RPN_CRITICO]
+        principales = criticos if criticos else self._top[:3]
+        return {
+            "total": self.total,
+            "criticos": self.criticos,
+            "rpn_medio": round(self._suma_rpn / self.total, 2),
+            "ranking": self._top,
+            "conclusion": self._conclusion(principales),
+        }
+
+    def _conclusion(self, modos: List[Dict[str, Any]]) -> str:
+        detalle = "\n\n".join(
+            f"{i + 1}. Modo de falla: \"{m.get('failureMode', '')}\" en el proceso \"{m.get('process', '')}\"\n"
+            f"   - Severidad: {m['severity']:g}, Ocurrencia: {m['occurrence']:g}, Detección: {m['detection']:g}\n"
+            f"   - RPN: {m['rpn']:g}\n"
+            f"   - Causa: \"{m.get('cause', '')}\"\n"
+            f"   - Efecto: \"{m.get('effect', '')}\"\n"
+            f"   - Acciones recomendadas: {m.get('actions') or 'No especificadas'}"
+            for i, m in enumerate(modos)
+        )
+        texto = (
+            f"El análisis FMEA ha evaluado {self.total} modos de falla potenciales. "
+            f"Se han identificado {len(modos)} modos de falla críticos con los mayores valores de RPN:\n\n{detalle}\n\n"
+        )
+        causas = list(dict.fromkeys(m.get("cause", "") for m in modos))
+        if len(causas) == 1:
+            texto += f"El análisis revela una causa raíz común en los modos de falla críticos: \"{causas[0]}\". Esta debe ser la prioridad para las acciones correctivas."
+        else:
+            texto += (
+                f"El análisis revela múltiples causas en los modos de falla críticos: {'; '.join(causas)}.\n\n"
+                f"La causa más crítica está asociada con el modo de falla de mayor RPN: \"{modos[0].get('cause', '')}\"."
+            )
+        texto += (
+            f"\n\nSe recomienda implementar acciones correctivas inmediatas para el modo de falla "
+            f"\"{modos[0].get('failureMode', '')}\" (RPN = {modos[0]['rpn']:g}), enfocándose en su causa raíz: \"{modos[0].get('cause', '')}\"."
+        )
+        return texto
+
+
+# --- Ishikawa ---
+
+class AcumuladorIshikawa:
+    """Cuenta causas por categoría (6M) y las causas más repetidas de cada una."""
+
+    def __init__(self, causas_por_categoria: int = 5):
+        self.causas_por_categoria = causas_por_categoria
+        self._conteos: Counter = Counter()
+        self._causas: Dict[str, Counter] = {}
+
+    def agregar(self, filas: List[Dict[str, Any]]) -> None:
+        categorias = np.array([str(_campo(f, "category", "categoria", defecto="")) for f in filas])
+        textos = [str(_campo(f, "text", "causa", "cause", defecto="")) for f in filas]
+        validos = categorias != ""
+        if not validos.any():
+            return
+        unicas, inverso, conteos = np.unique(categorias[validos], return_inverse=True, return_counts=True)
+        self._conteos.update(dict(zip(unicas.tolist(), conteos.tolist())))
+        for idx, texto in zip(inverso.tolist(), (t for t, v in zip(textos, validos) if v)):
+            if texto:
+                self._causas.setdefault(str(unicas[idx]), Counter())[texto] += 1
+
+    def resultado(self, umbral: float = UMBRAL_ISHIKAWA) -> Dict[str, Any]:
+        if not self._conteos:
+            return {"total": 0, "categorias": [], "significativas": [], "conclusion": ""}
+        nombres = list(self._conteos.keys())
+        conteos = np.array(list(self._conteos.values()), dtype=float)
+        total = conteos.sum()
+        porcentajes = conteos / total * 100
+        orden = np.argsort(-conteos, kind="stable")
+        significativas = [nombres[i] for i in orden if porcentajes[i] >= umbral] or [nombres[orden[0]]]
+        categorias = [
+            {
+                "category": nombres[i],
+                "count": int(conteos[i]),
+                "percentage": round(float(porcentajes[i]), 1),
+                "top_causes": [t for t, _ in self._causas.get(nombres[i], Counter()).most_common(self.causas_por_categoria)],
+            }
+            for i in orden
+        ]
+        return {
+            "total": int(total),
+            "categorias": categorias,
+            "significativas": significativas,
+            "conclusion": self._conclusion(int(total), significativas, {c["category"]: c["top_causes"] for c in categorias}),
+        }
+
+    @staticmethod
+    def _conclusion(total: int, significativas: List[str], causas: Dict[str, List[str]]) -> str:
+        texto = (
+            f"Basado en el análisis de Ishikawa, se han identificado {total} posibles causas distribuidas en "
+            f"diferentes categorías. Las categorías más significativas son: {', '.join(significativas)}. "
+        )
+        for categoria in significativas:
+            if causas.get(categoria):
+                texto += f"\n\nEn la categoría \"{categoria}\", las causas principales identificadas son: {'; '.join(causas[categoria])}. "
+        texto += f"\n\nSe recomienda priorizar acciones correctivas enfocadas en la categoría \"{significativas[0]}\" para abordar la causa raíz del problema."
+        return texto
+
+
+ACUMULADORES = {
+    "pareto": AcumuladorPareto,
+    "fmea": AcumuladorFMEA,
+    "ishikawa": AcumuladorIshikawa,
+}
+
+
+# --- Conclusión integrada ---
+
+STOPWORDS = {
+    "el", "la", "los", "las", "un", "una", "unos", "unas", "y", "o", "a", "ante", "bajo", "con", "de",
+    "desde", "en", "entre", "hacia", "hasta", "para", "por", "según", "sin", "sobre", "tras", "que",
+    "es", "son", "está", "están", "ha", "han", "se", "del",
+}
+
+PATRONES_INDUSTRIALES = [
+    "Falta de procedimientos estandarizados y documentación adecuada",
+    "Deficiencias en la capacitación y formación del personal",
+    "Problemas de comunicación entre departamentos",
+    "Mantenimiento inadecuado o insuficiente de equipos",
+    "Falta de controles de calidad efectivos",
+    "Diseño deficiente de procesos o productos",
+    "Gestión ineficiente de recursos",
+    "Falta de sistemas de monitoreo y alerta temprana",
+    "Problemas en la cadena de suministro",
+    "Falta de análisis de datos para toma de decisiones",
+]
+
+NOMBRES_METODO = {
+    "ishikawa": "Diagrama de Ishikawa (Causa-Efecto)",
+    "fiveWhys": "Análisis de los 5 Por qué",
+    "pareto": "Análisis de Pareto",
+    "fmea": "Análisis de Modos y Efectos de Falla (FMEA)",
+}
+
+RECOMENDACIONES_GENERALES = [
+    "Implementar un sistema de gestión visual para monitorear indicadores clave",
+    "Establecer reuniones diarias breves para mejorar la comunicación entre departamentos",
+    "Desarrollar un programa de mejora continua con equipos multidisciplinarios",
+]
+
+RECOMENDACIONES_POR_CAUSA = {
+    "procedimientos": [
+        "Desarrollar y documentar procedimientos operativos estándar (SOPs) para procesos críticos",
+        "Implementar un sistema de gestión documental para mantener actualizados los procedimientos",
+        "Realizar auditorías periódicas para verificar el cumplimiento de los procedimientos",
+    ],
+    "capacitación": [
+        "Diseñar un programa de capacitación técnica específica para el personal",
+        "Implementar un sistema de certificación de competencias para operadores",
+        "Desarrollar materiales de formación visual y práctica para reforzar el aprendizaje",
+    ],
+    "comunicación": [
+        "Implementar un sistema de comunicación estructurado entre departamentos",
+        "Establecer roles y responsabilidades claras para la comunicación de problemas",
+        "Desarrollar tableros de información compartida entre áreas relacionadas",
+    ],
+    "mantenimiento": [
+        "Implementar un sistema de mantenimiento preventivo basado en condiciones",
+        "Desarrollar un programa de mantenimiento autónomo por parte de los operadores",
+        "Establecer indicadores de efectividad del mantenimiento (OEE)",
+    ],
+    "calidad": [
+        "Implementar controles de calidad en puntos críticos del proceso",
+        "Desarrollar sistemas a prueba de errores (Poka-Yoke)",
+        "Establecer un programa de auditorías de calidad internas",
+    ],
+}
+
+RECOMENDACIONES_POR_AREA = {
+    "Producción": [
+        "Implementar metodología SMED para reducir tiempos de cambio",
+        "Establecer un sistema de gestión de cuellos de botella",
+        "Desarrollar un programa de TPM (Mantenimiento Productivo Total)",
+    ],
+    "Calidad": [
+        "Implementar control estadístico de procesos (SPC)",
+        "Desarrollar un sistema de trazabilidad de productos",
+        "Establecer un programa de calibración de equipos de medición",
+    ],
+    "Logística": [
+        "Implementar un sistema de gestión de inventario basado en demanda",
+        "Optimizar rutas y flujos de materiales",
+        "Desarrollar KPIs específicos para la cadena de suministro",
+    ],
+    "Mantenimiento": [
+        "Implementar un sistema CMMS para gestión del mantenimiento",
+        "Desarrollar un programa de análisis de fallas",
+        "Establecer un inventario optimizado de repuestos críticos",
+    ],
+    "Seguridad": [
+        "Implementar un programa de observación preventiva de seguridad",
+        "Desarrollar análisis de riesgos por puesto de trabajo",
+        "Establecer un sistema de reporte de incidentes y casi-accidentes",
+    ],
+}
+
+
+def _frases(texto: str) -> List[str]:
+    return [f for f in re.split(r"[.!?]+", texto) if f.strip()]
+
+
+def encontrar_patrones_comunes(frases: List[str]) -> List[str]:
+    if not frases:
+        return []
+    palabras = [
+        p
+        for frase in frases
+        for p in re.sub(r"[.,/#!$%^&*;:{}=\-_`~()]", "", frase.lower()).split()
+        if len(p) > 3 and p not in STOPWORDS
+    ]
+    claves = {p for p, _ in Counter(palabras).most_common(10)}
+    puntuaciones = [sum(p in claves for p in patron.lower().split()) for patron in PATRONES_INDUSTRIALES]
+    orden = np.argsort(-np.array(puntuaciones), kind="stable")[:3]
+    return [PATRONES_INDUSTRIALES[i] for i in orden]
+
+
+def generar_recomendaciones(causa_raiz: str, area: Optional[str]) -> List[str]:
+    recomendaciones = list(RECOMENDACIONES_GENERALES)
+    for clave, recs in RECOMENDACIONES_POR_CAUSA.items():
+        if clave in causa_raiz.lower():
+            recomendaciones = recs + recomendaciones
+    if area and area in RECOMENDACIONES_POR_AREA:
+        recomendaciones = RECOMENDACIONES_POR_AREA[area] + recomendaciones
+    return recomendaciones[:5]
+
+
+def conclusion_integrada(causas_raiz: Dict[str, str], problema: Dict[str, Any]) -> str:
+    """Integra las causas raíz de cada metodología en una conclusión única (Markdown)."""
+    validas = [(m, c) for m, c in causas_raiz.items() if c and c.strip()]
+    if not validas:
+        return ""
+    claves = ("causa", "recomend", "prioriz", "crítico")
+    frases_clave = [f for _, c in validas for f in _frases(c) if any(k in f.lower() for k in claves)]
+    patrones = encontrar_patrones_comunes(frases_clave)
+
+    texto = "# Análisis Integrado de Causa Raíz\n\n## Resumen del Problema\n"
+    texto += f"**Problema:** {problema.get('title', '')}\n"
+    texto += f"**Descripción:** {problema.get('description', '')}\n"
+    texto += f"**Área:** {problema.get('area', '')}\n"
+    texto += f"**Impacto:** {problema.get('impact', '')}\n\n"
+    texto += f"## Metodologías Aplicadas\nSe han aplicado {len(validas)} metodologías de análisis de causa raíz:\n"
+    texto += "".join(f"- {NOMBRES_METODO.get(m, m)}\n" for m, _ in validas) + "\n"
+    texto += "## Hallazgos Principales por Metodología\n"
+    for m, c in validas:
+        texto += f"### {NOMBRES_METODO.get(m, m)}\n{_frases(c)[0]}.\n\n"
+
+    texto += "## Patrones Comunes Identificados\n"
+    texto += "".join(f"{i + 1}. {p}\n" for i, p in enumerate(patrones)) or (
+        "No se identificaron patrones comunes claros entre las diferentes metodologías.\n"
+    )
+    texto += "\n## Conclusión de Causa Raíz\n"
+    if patrones:
+        texto += (
+            "Basado en el análisis integrado de las diferentes metodologías, se concluye que la causa raíz "
+            f"principal del problema es:\n\n**{patrones[0]}**\n\n"
+        )
+        if len(patrones) > 1:
+            texto += "Factores contribuyentes adicionales incluyen:\n" + "".join(f"- {p}\n" for p in patrones[1:])
+    else:
+        prioridad = ["fmea", "fiveWhys", "pareto", "ishikawa"]
+        mejor = next(((m, c) for p in prioridad for m, c in validas if m == p), validas[0])
+        frases = _frases(mejor[1])
+        relevante = next((f for f in frases if "causa raíz" in f.lower() or "principal" in f.lower()), frases[0])
+        texto += (
+            f"Basado principalmente en el análisis de {NOMBRES_METODO.get(mejor[0], mejor[0])}, se concluye que "
+            f"la causa raíz principal del problema es:\n\n**{relevante}**\n"
+        )
+
+    texto += "\n## Recomendaciones\nBasado en la causa raíz identificada, se recomienda:\n\n"
+    recomendaciones = generar_recomendaciones(patrones[0] if patrones else "", problema.get("area"))
+    texto += "".join(f"{i + 1}. {r}\n" for i, r in enumerate(recomendaciones))
+    return texto
+
+
+# --- Lectura de subidas grandes por trozos ---
+
+def _fila(valor: Any) -> Dict[str, Any]:
+    # Cada fila debe ser un objeto JSON; ValueError se responde como 400
+    if not isinstance(valor, dict):
+        raise ValueError(f"cada fila debe ser un objeto JSON, no {type(valor).__name__}")
+    return valor
+
+
+class _Lineas:
+    """Iterador sobre las líneas ya recibidas; se agota y se vuelve a llenar con cada trozo.
+
+    Un único ``csv.reader`` lo recorre durante toda la subida, así un campo
+    entre comillas con saltos de línea no se parte entre trozos.
+    """
+
+    def __init__(self):
+        self.cola: Deque[str] = deque()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> str:
+        if not self.cola:
+            raise StopIteration
+        return self.cola.popleft()
+
+
+async def filas_en_lotes(
+    trozos: AsyncIterator[bytes], formato: str, tam_lote: int = TAM_LOTE
+) -> AsyncIterator[List[Dict[str, Any]]]:
+    """Convierte un cuerpo en streaming (CSV, NDJSON o array JSON) en lotes de filas.
+
+    CSV y NDJSON se procesan línea a línea según llegan los trozos; un array
+    JSON no se puede partir sin un parser incremental y se lee completo.
+    """
+    if formato == "json":
+        cuerpo = b"".join([t async for t in trozos])
+        filas = json.loads(cuerpo or b"[]")
+        if not isinstance(filas, list):
+            raise ValueError("se esperaba un array JSON de filas")
+        for i in range(0, len(filas), tam_lote):
+            yield [_fila(f) for f in filas[i:i + tam_lote]]
+        return
+
+    decodificador = codecs.getincrementaldecoder("utf-8-sig")()
+    pendiente = ""
+    cabecera: Optional[List[str]] = None
+    lote: List[Dict[str, Any]] = []
+    lineas_csv = _Lineas()
+    lector = csv.reader(lineas_csv)
+    # Registro CSV con comillas sin cerrar: sus líneas esperan en la cola hasta completarlo
+    abierto = False
+    tam_abierto = 0
+
+    def procesar(lineas: List[str], final: bool = False) -> None:
+        nonlocal cabecera, abierto, tam_abierto
+        if formato != "csv":
+            lote.extend(_fila(json.loads(linea)) for linea in lineas if linea.strip())
+            return
+        for linea in lineas:
+            lineas_csv.cola.append(linea)
+            abierto ^= linea.count('"') % 2 == 1
+            tam_abierto = tam_abierto + len(linea) if abierto else 0
+            if tam_abierto > csv.field_size_limit():
+                raise csv.Error(f"campo mayor que el límite ({csv.field_size_limit()} caracteres)")
+        if abierto and not final:
+            return
+        for valores in lector:
+            if not valores:
+                continue
+            if cabecera is None:
+                cabecera = [v.strip() for v in valores]
+            else:
+                lote.append(dict(zip(cabecera, valores)))
+
+    async for trozo in trozos:
+        pendiente += decodificador.decode(trozo)
+        *lineas, pendiente = pendiente.split("\n")
+        procesar([linea + "\n" for linea in lineas])
+        while len(lote) >= tam_lote:
+            yield lote[:tam_lote]
+            del lote[:tam_lote]
+    pendiente += decodificador.decode(b"", final=True)
+    procesar([pendiente] if pendiente.strip() else [], final=True)
+    if lote:
+        yield lote
+
+
+def formato_de(content_type: str) -> str:
+    if "csv" in content_type:
+        return "csv"
+    if "ndjson" in content_type or "jsonl" in content_type:
+        return "ndjson"
+    return "json"
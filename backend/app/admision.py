@@ -0,0 +1,359 @@
+"""Control de admisión y planificación justa delante de las llamadas al LLM.
+
+Cada petición que va a llamar al proveedor pide un turno al ``Planificador``:
+
+1. Cubo de tokens por cliente (API key válida o IP): si el cliente supera
+   su ritmo se rechaza al momento con 429 y ``Retry-After``.
+2. Si hay hueco (menos de ``max_concurrencia`` turnos en uso) pasa directo.
+3. Si no, espera en una cola global acotada ordenada por
+   (clase de prioridad, ronda del cliente, llegada): la UI interactiva va
+   antes que las importaciones por lotes y, dentro de una clase, los clientes
+   se turnan en vez de que uno solo acapare la cola.
+4. Con la cola llena, una petición interactiva desplaza a la última de lotes;
+   si no hay a quién desplazar se rechaza con 429.
+
+Mientras espera se comprueba si el cliente HTTP sigue conectado; si no, la
+petición sale de la cola sin llegar a gastar cuota.
+"""
+import asyncio
+import hashlib
+import heapq
+import ipaddress
+import itertools
+import math
+import os
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from .llm import LLM_MAX_CONCURRENCY
+from .metricas import (
+    ADMISION_COLA,
+    ADMISION_DESCONECTADAS,
+    ADMISION_EN_CURSO,
+    ADMISION_ESPERA,
+    ADMISION_RECHAZOS,
+)
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "1") == "1"
+ADMISSION_MAX_CONCURRENCY = int(os.getenv("ADMISSION_MAX_CONCURRENCY", str(LLM_MAX_CONCURRENCY)))
+ADMISSION_QUEUE_MAX = int(os.getenv("ADMISSION_QUEUE_MAX", "64"))
+ADMISSION_MAX_WAIT = float(os.getenv("ADMISSION_MAX_WAIT", "30"))
+# Cubo por cliente: ráfaga de ADMISSION_BURST peticiones y ADMISSION_RATE por segundo sostenidas
+ADMISSION_RATE = float(os.getenv("ADMISSION_RATE", "1.0"))
+ADMISSION_BURST = float(os.getenv("ADMISSION_BURST", "10"))
+ADMISSION_MAX_CLIENTS = int(os.getenv("ADMISSION_MAX_CLIENTS", "10000"))
+# API keys (separadas por comas) con cubo propio; cualquier otra cuenta como su IP
+ADMISSION_API_KEYS = os.getenv("ADMISSION_API_KEYS", "")
+# Cada cuánto se comprueba si el cliente de una petición en cola se ha desconectado
+INTERVALO_SONDEO = 0.25
+
+PRIORIDADES = {"interactive": 0, "batch": 1}
+
+
+class Rechazado(Exception):
+    """La petición no se admite; ``retry_after`` es una estimación en segundos."""
+
+    def __init__(self, motivo: str, retry_after: float):
+        super().__init__(motivo)
+        self.motivo = motivo
+        self.retry_after = retry_after
+
+    @property
+    def cabecera_retry_after(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class ClienteDesconectado(Exception):
+    """El cliente se fue mientras la petición esperaba turno."""
+
+
+class CuboTokens:
+    __slots__ = ("capacidad", "ritmo", "tokens", "ultimo")
+
+    def __init__(self, capacidad: float, ritmo: float, ahora: float):
+        self.capacidad = capacidad
+        self.ritmo = ritmo
+        self.tokens = capacidad
+        self.ultimo = ahora
+
+    def consumir(self, ahora: float) -> float:
+        """Gasta un token; devuelve 0 si lo había o los segundos hasta el siguiente."""
+        self.tokens = min(self.capacidad, self.tokens + (ahora - self.ultimo) * self.ritmo)
+        self.ultimo = ahora
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.ritmo if self.ritmo > 0 else ADMISSION_MAX_WAIT
+
+
+class _Entrada:
+    __slots__ = ("clave", "cliente", "prioridad", "futuro", "activa")
+
+    def __init__(self, clave: Tuple[int, int, int], cliente: str, prioridad: str, futuro: asyncio.Future):
+        self.clave = clave
+        self.cliente = cliente
+        self.prioridad = prioridad
+        self.futuro = futuro
+        self.activa = True
+
+    def __lt__(self, otra: "_Entrada") -> bool:
+        return self.clave < otra.clave
+
+
+class Turno:
+    """Hueco concedido; se devuelve con ``liberar()`` (idempotente) o con ``async with``."""
+
+    def __init__(self, planificador: "Planificador"):
+        self._planificador = planificador
+        self._inicio = time.monotonic()
+        self._liberado = False
+
+    def liberar(self) -> None:
+        if not self._liberado:
+            self._liberado = True
+            self._planificador._liberar(time.monotonic() - self._inicio)
+
+    async def __aenter__(self) -> "Turno":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self.liberar()
+
+
+class Planificador:
+    def __init__(
+        self,
+        max_concurrencia: int = ADMISSION_MAX_CONCURRENCY,
+        max_cola: int = ADMISSION_QUEUE_MAX,
+        espera_max: float = ADMISSION_MAX_WAIT,
+        ritmo: float = ADMISSION_RATE,
+        rafaga: float = ADMISSION_BURST,
+        max_clientes: int = ADMISSION_MAX_CLIENTS,
+    ):
+        self.max_concurrencia = max_concurrencia
+        self.max_cola = max_cola
+        self.espera_max = espera_max
+        self.ritmo = ritmo
+        self.rafaga = rafaga
+        self.max_clientes = max_clientes
+        self._en_curso = 0
+        self._cola: List[_Entrada] = []
+        self._en_cola = 0
+        self._pendientes: Dict[str, int] = {}
+        self._cubos: "OrderedDict[str, CuboTokens]" = OrderedDict()
+        self._llegadas = itertools.count()
+        # Media móvil del tiempo con turno, para estimar Retry-After
+        self._servicio_medio = 1.0
+
+    # --- Cuotas ---
+
+    def _cubo(self, cliente: str, ahora: float) -> CuboTokens:
+        cubo = self._cubos.get(cliente)
+        if cubo is None:
+            cubo = self._cubos[cliente] = CuboTokens(self.rafaga, self.ritmo, ahora)
+            # Olvidar un cliente inactivo equivale a devolverle el cubo lleno
+            if len(self._cubos) > self.max_clientes:
+                self._cubos.popitem(last=False)
+        else:
+            self._cubos.move_to_end(cliente)
+        return cubo
+
+    def _estimar_espera(self) -> float:
+        return self._servicio_medio * (self._en_cola + 1) / self.max_concurrencia
+
+    def _rechazar(self, motivo: str, prioridad: str, retry_after: float) -> Rechazado:
+        ADMISION_RECHAZOS.inc(motivo=motivo, prioridad=prioridad)
+        return Rechazado(motivo, retry_after)
+
+    # --- Cola ---
+
+    def _encolar(self, cliente: str, prioridad: str) -> _Entrada:
+        ronda = self._pendientes.get(cliente, 0)
+        self._pendientes[cliente] = ronda + 1
+        clave = (PRIORIDADES[prioridad], ronda, next(self._llegadas))
+        entrada = _Entrada(clave, cliente, prioridad, asyncio.get_running_loop().create_future())
+        heapq.heappush(self._cola, entrada)
+        self._en_cola += 1
+        ADMISION_COLA.set(self._en_cola)
+        return entrada
+
+    def _quitar(self, entrada: _Entrada) -> None:
+        # Borrado perezoso: la entrada sigue en el heap pero ya no cuenta
+        entrada.activa = False
+        self._en_cola -= 1
+        restantes = self._pendientes[entrada.cliente] - 1
+        if restantes:
+            self._pendientes[entrada.cliente] = restantes
+        else:
+            del self._pendientes[entrada.cliente]
+        ADMISION_COLA.set(self._en_cola)
+
+    def _liberar(self, duracion: Optional[float] = None) -> None:
+        if duracion is not None:
+            self._servicio_medio = 0.8 * self._servicio_medio + 0.2 * duracion
+        while self._cola:
+            entrada = heapq.heappop(self._cola)
+            if not entrada.activa:
+                continue
+            self._quitar(entrada)
+            if not entrada.futuro.done():
+                # El hueco pasa directamente al siguiente: _en_curso no cambia
+                entrada.futuro.set_result(None)
+                return
+        self._en_curso -= 1
+        ADMISION_EN_CURSO.set(self._en_curso)
+
+    async def adquirir(
+        self,
+        cliente: str,
+        prioridad: str = "interactive",
+        desconectado: Optional[Callable[[], Awaitable[bool]]] = None,
+    ) -> Turno:
+        """Espera un turno o lanza ``Rechazado`` / ``ClienteDesconectado``."""
+        if prioridad not in PRIORIDADES:
+            prioridad = "interactive"
+        llegada = time.monotonic()
+
+        espera = self._cubo(cliente, llegada).consumir(llegada)
+        if espera:
+            raise self._rechazar("cuota", prioridad, espera)
+
+        if self._en_curso < self.max_concurrencia and not self._en_cola:
+            self._en_curso += 1
+            ADMISION_EN_CURSO.set(self._en_curso)
+            ADMISION_ESPERA.observar(0.0, prioridad=prioridad)
+            return Turno(self)
+
+        if self._en_cola >= self.max_cola:
+            activas = [e for e in self._cola if e.activa]
+            peor = max(activas, key=lambda e: e.clave) if activas else None
+            if peor is None or peor.clave[0] <= PRIORIDADES[prioridad]:
+                raise self._rechazar("cola_llena", prioridad, self._estimar_espera())
+            self._quitar(peor)
+            ADMISION_RECHAZOS.inc(motivo="desplazada", prioridad=peor.prioridad)
+            peor.futuro.set_exception(Rechazado("desplazada", self._estimar_espera()))
+
+        entrada = self._encolar(cliente, prioridad)
+        try:
+            await self._esperar(entrada, llegada, desconectado)
+        except BaseException:
+            if entrada.activa:
+                self._quitar(entrada)
+            elif entrada.futuro.done() and not entrada.futuro.cancelled() and entrada.futuro.exception() is None:
+                # Se le concedió el hueco justo al salir: se pasa al siguiente
+                self._liberar()
+            raise
+        ADMISION_ESPERA.observar(time.monotonic() - llegada, prioridad=prioridad)
+        return Turno(self)
+
+    async def _esperar(self, entrada: _Entrada, llegada: float, desconectado) -> None:
+        limite = llegada + self.espera_max
+        while True:
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                raise self._rechazar("espera_max", entrada.prioridad, self._estimar_espera())
+            hechos, _ = await asyncio.wait({entrada.futuro}, timeout=min(INTERVALO_SONDEO, restante))
+            if hechos:
+                entrada.futuro.result()
+                return
+            if desconectado is not None and await desconectado():
+                ADMISION_DESCONECTADAS.inc()
+                raise ClienteDesconectado()
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "en_curso": self._en_curso,
+            "en_cola": self._en_cola,
+            "clientes": len(self._cubos),
+            "servicio_medio": round(self._servicio_medio, 3),
+        }
+
+
+def _huella(clave: str) -> str:
+    return hashlib.sha256(clave.encode()).hexdigest()[:16]
+
+
+_CLAVES_VALIDAS = {_huella(c.strip()) for c in ADMISSION_API_KEYS.split(",") if c.strip()}
+
+
+def _red_cliente(host: str) -> str:
+    # Una IPv6 por cliente no limita nada (cada uno tiene un /64 entero): se agrupa por /64
+    try:
+        ip = ipaddress.ip_address(host)
+    except ValueError:
+        return host
+    if ip.version == 6:
+        if ip.ipv4_mapped is not None:
+            return str(ip.ipv4_mapped)
+        return str(ipaddress.ip_network(f"{ip}/64", strict=False))
+    return str(ip)
+
+
+def identificar_cliente(request) -> str:
+    """Huella de la API key si es una de ADMISSION_API_KEYS; si no, la IP.
+
+    Una clave sin validar no puede ser la identidad: rotándola se tendría un
+    cubo nuevo en cada petición y se expulsaría a los clientes reales del LRU
+    de ADMISSION_MAX_CLIENTS. uvicorn ya aplica X-Forwarded-For (solo desde
+    FORWARDED_ALLOW_IPS, ver lanzador.py).
+    """
+    clave = request.headers.get("x-api-key")
+    autorizacion = request.headers.get("authorization", "")
+    if not clave and autorizacion.lower().startswith("bearer "):
+        clave = autorizacion[7:].strip()
+    if clave and _CLAVES_VALIDAS:
+        huella = _huella(clave)
+        if huella in _CLAVES_VALIDAS:
+            return f"key:{huella}"
+    return f"ip:{_red_cliente(request.client.host) if request.client else 'desconocida'}"
+
+
+def prioridad_de(request) -> str:
+    # Las importaciones por lotes se marcan con "X-Priority: batch"; la UI no envía nada
+    return request.headers.get("x-priority", "interactive").strip().lower()
+
+
+class _SinAdmision:
+    """Sustituto cuando ADMISSION_ENABLED=0: concede siempre."""
+
+    class _TurnoLibre:
+        def liberar(self) -> None:
+            pass
+
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc) -> None:
+            pass
+
+    async def adquirir(self, cliente: str, prioridad: str = "interactive", desconectado=None):
+        return self._TurnoLibre()
+
+    def stats(self) -> Dict[str, float]:
+        return {"deshabilitado": True}
+
+
+_planificador = None
+
+
+def obtener_planificador():
+    global _planificador
+    if _planificador is None:
+        _planificador = Planificador() if ADMISSION_ENABLED else _SinAdmision()
+    return _planificador
+
+
+async def esperar_turno(cliente: str, prioridad: str = "batch", al_esperar: Optional[Callable[[Rechazado], Awaitable[None]]] = None):
+    """Turno para trabajos en segundo plano: ante un rechazo espera ``retry_after`` y reintenta.
+
+    Nadie espera la respuesta HTTP, así que un 429 no tiene sentido; el
+    trabajo sigue en marcha (y ``al_esperar`` puede anotar el motivo).
+    """
+    while True:
+        try:
+            return await obtener_planificador().adquirir(cliente, prioridad)
+        except Rechazado as e:
+            if al_esperar is not None:
+                await al_esperar(e)
+            await asyncio.sleep(e.retry_after)
@@ -0,0 +1,152 @@
+"""Almacenamiento persistente de problemas y soluciones (SQLite en modo WAL).
+
+Sustituye a las listas/diccionarios en memoria: los datos sobreviven a
+reinicios y se comparten entre workers. ``problems`` se pagina por cursor
+(``created_at`` + ``id``) usando su índice, sin recorrer todo el historial.
+"""
+import base64
+import json
+import os
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from .metricas import ALMACEN_DURACION
+
+DB_PATH = os.getenv("SOLVER_DB_PATH", os.path.join("data", "solver.db"))
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS problems (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    title TEXT NOT NULL,
+    status TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_problems_created_at ON problems (created_at, id);
+CREATE TABLE IF NOT EXISTS solutions (
+    id TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+"""
+
+
+class CursorInvalido(ValueError):
+    """El cursor de paginación no se puede decodificar."""
+
+
+def codificar_cursor(created_at: str, id_: str) -> str:
+    return base64.urlsafe_b64encode(f"{created_at}|{id_}".encode()).decode().rstrip("=")
+
+
+def decodificar_cursor(cursor: str) -> Tuple[str, str]:
+    try:
+        relleno = "=" * (-len(cursor) % 4)
+        created_at, id_ = base64.urlsafe_b64decode(cursor + relleno).decode().split("|", 1)
+        return created_at, id_
+    except Exception as e:
+        raise CursorInvalido(cursor) from e
+
+
+class Almacen:
+    """Acceso a SQLite con una conexión por hilo (las llamadas van por asyncio.to_thread)."""
+
+    def __init__(self, ruta: str = DB_PATH):
+        self.ruta = ruta
+        directorio = os.path.dirname(ruta)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        self._local = threading.local()
+        conn = self._conn()
+        conn.executescript(ESQUEMA)
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.ruta, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def guardar_solucion(self, problema: Dict[str, Any], solucion: Dict[str, Any]) -> None:
+        conn = self._conn()
+        with ALMACEN_DURACION.medir(operacion="guardar_solucion"), conn:
+            conn.execute(
+                "INSERT INTO solutions (id, data) VALUES (?, ?)",
+                (solucion["id"], json.dumps(solucion, ensure_ascii=False)),
+            )
+            conn.execute(
+                "INSERT INTO problems (id, title, status, created_at) VALUES (?, ?, ?, ?)",
+                (problema["id"], problema["title"], problema["status"], problema["created_at"]),
+            )
+
+    def obtener_solucion(self, solution_id: str) -> Optional[Dict[str, Any]]:
+        with ALMACEN_DURACION.medir(operacion="obtener_solucion"):
+            fila = self._conn().execute("SELECT data FROM solutions WHERE id = ?", (solution_id,)).fetchone()
+        return json.loads(fila["data"]) if fila else None
+
+    def version(self) -> int:
+        # Las filas solo se añaden: el último seq identifica el estado de la tabla
+        fila = self._conn().execute("SELECT COALESCE(MAX(seq), 0) FROM problems").fetchone()
+        return fila[0]
+
+    def listar_problemas(
+        self, limit: int, before: Optional[str] = None, after: Optional[str] = None
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Devuelve una página (más recientes primero) y el cursor de la siguiente.
+
+        ``before`` pide problemas más antiguos que el cursor; ``after`` los más
+        recientes que él (útil para sondear novedades).
+        """
+        with ALMACEN_DURACION.medir(operacion="listar_problemas"):
+            return self._listar_problemas(limit, before, after)
+
+    def _listar_problemas(
+        self, limit: int, before: Optional[str], after: Optional[str]
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        columnas = "id, title, status, created_at"
+        if after:
+            created_at, id_ = decodificar_cursor(after)
+            filas = self._conn().execute(
+                f"SELECT {columnas} FROM problems WHERE (created_at, id) > (?, ?) "
+                "ORDER BY created_at ASC, id ASC LIMIT ?",
+                (created_at, id_, limit + 1),
+            ).fetchall()
+            hay_mas = len(filas) > limit
+            filas = list(reversed(filas[:limit]))
+        else:
+            if before:
+                created_at, id_ = decodificar_cursor(before)
+                filas = self._conn().execute(
+                    f"SELECT {columnas} FROM problems WHERE (created_at, id) < (?, ?) "
+                    "ORDER BY created_at DESC, id DESC LIMIT ?",
+                    (created_at, id_, limit + 1),
+                ).fetchall()
+            else:
+                filas = self._conn().execute(
+                    f"SELECT {columnas} FROM problems ORDER BY created_at DESC, id DESC LIMIT ?",
+                    (limit + 1,),
+                ).fetchall()
+            hay_mas = len(filas) > limit
+            filas = filas[:limit]
+
+        problemas = [dict(f) for f in filas]
+        siguiente = None
+        if hay_mas and problemas:
+            # Con "after" la siguiente página son los aún más recientes; si no, los más antiguos
+            ref = problemas[0] if after else problemas[-1]
+            siguiente = codificar_cursor(ref["created_at"], ref["id"])
+        return problemas, siguiente
+
+
+_almacen: Optional[Almacen] = None
+
+
+def obtener_almacen() -> Almacen:
+    global _almacen
+    if _almacen is None:
+        _almacen = Almacen()
+    return _almacen
@@ -0,0 +1,363 @@
+"""Pipeline de auditoría en segundo plano.
+
+Los endpoints encolan registros en memoria (sin tocar disco) y una tarea de
+fondo los agrupa en lotes que se escriben como JSONL, por tamaño de lote o
+por intervalo de tiempo, en un hilo aparte. El fichero activo se rota por
+tamaño o antigüedad; los segmentos rotados se llaman
+``<nombre>.<inicio>_<fin>[.<n>].jsonl[.gz]`` para que el lector pueda
+descartar los que quedan fuera de un rango de fechas sin abrirlos.
+
+Varios procesos (workers de uvicorn, trabajador.py) comparten el fichero
+activo: cada lote se escribe y la rotación se decide con un cerrojo de
+fichero (``.<nombre>.lock``), y quien rota usa un nombre de segmento libre.
+Un error de escritura pierde ese lote (se cuenta en
+``audit_records_dropped_total``) pero el escritor sigue; la cola está acotada
+a AUDIT_QUEUE_MAX registros.
+
+Consulta por línea de comandos (desde backend/):
+    python -m app.auditoria --desde 2025-01-01T00:00 --hasta 2025-01-02T00:00
+"""
+import argparse
+import asyncio
+import glob
+import gzip
+import json
+import logging
+import os
+import shutil
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+
+from .metricas import AUDITORIA_DESCARTADOS, AUDITORIA_ESCRITURA, AUDITORIA_REGISTROS
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin cerrojo (un solo proceso escritor)
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+AUDIT_DIR = os.getenv("AUDIT_DIR", "logs")
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "100"))
+AUDIT_FLUSH_INTERVAL = float(os.getenv("AUDIT_FLUSH_INTERVAL", "1.0"))
+AUDIT_MAX_BYTES = int(os.getenv("AUDIT_MAX_BYTES", str(50 * 1024 * 1024)))
+AUDIT_ROTATE_SECONDS = float(os.getenv("AUDIT_ROTATE_SECONDS", "86400"))
+AUDIT_COMPRESS = os.getenv("AUDIT_COMPRESS", "1") == "1"
+AUDIT_FSYNC = os.getenv("AUDIT_FSYNC", "0") == "1"
+AUDIT_QUEUE_MAX = int(os.getenv("AUDIT_QUEUE_MAX", "10000"))
+
+FORMATO_SEGMENTO = "%Y%m%dT%H%M%S"
+_FIN = object()
+
+
+def _marca(ts: datetime) -> str:
+    return ts.strftime(FORMATO_SEGMENTO)
+
+
+class EscritorAuditoria:
+    """Cola en memoria + escritura por lotes en JSONL con rotación."""
+
+    def __init__(
+        self,
+        directorio: str = AUDIT_DIR,
+        nombre: str = "analisis_log",
+        tam_lote: int = AUDIT_BATCH_SIZE,
+        intervalo: float = AUDIT_FLUSH_INTERVAL,
+        max_bytes: int = AUDIT_MAX_BYTES,
+        rotar_cada: float = AUDIT_ROTATE_SECONDS,
+        comprimir: bool = AUDIT_COMPRESS,
+        max_cola: int = AUDIT_QUEUE_MAX,
+    ):
+        self.directorio = directorio
+        self.nombre = nombre
+        self.tam_lote = tam_lote
+        self.intervalo = intervalo
+        self.max_bytes = max_bytes
+        self.rotar_cada = rotar_cada
+        self.comprimir = comprimir
+        self.max_cola = max_cola
+        self.ruta_activa = os.path.join(directorio, f"{nombre}.jsonl")
+        self.ruta_cerrojo = os.path.join(directorio, f".{nombre}.lock")
+        self._cola: Optional[asyncio.Queue] = None
+        self._tarea: Optional[asyncio.Task] = None
+        self._fichero = None
+        self._cerrojo = None
+        self._inicio_segmento: Optional[datetime] = None
+        self._ultimo_registro: Optional[datetime] = None
+
+    # --- API usada desde el event loop ---
+
+    def iniciar(self) -> None:
+        if self._tarea is None:
+            self._cola = asyncio.Queue(self.max_cola)
+            self._tarea = asyncio.get_running_loop().create_task(self._bucle())
+
+    def registrar(self, registro: Dict[str, Any]) -> None:
+        """Encola un registro; no bloquea ni hace E/S."""
+        self.iniciar()
+        registro.setdefault("ts", datetime.now().isoformat(timespec="milliseconds"))
+        try:
+            self._cola.put_nowait(registro)
+        except asyncio.QueueFull:
+            # Disco atascado: se pierde el registro antes que crecer sin límite en memoria
+            AUDITORIA_DESCARTADOS.inc(motivo="cola_llena")
+
+    async def detener(self) -> None:
+        """Vacía la cola, escribe lo pendiente y cierra el fichero."""
+        if self._tarea is None:
+            return
+        await self._cola.put(_FIN)
+        await self._tarea
+        self._tarea = None
+        self._cola = None
+        await asyncio.to_thread(self._cerrar)
+        if self._cerrojo is not None:
+            self._cerrojo.close()
+            self._cerrojo = None
+
+    async def _bucle(self) -> None:
+        loop = asyncio.get_running_loop()
+        terminar = False
+        while not terminar:
+            primero = await self._cola.get()
+            if primero is _FIN:
+                break
+            lote = [primero]
+            limite = loop.time() + self.intervalo
+            while len(lote) < self.tam_lote:
+                try:
+                    # Si ya hay registros esperando los tomamos sin esperar
+                    siguiente = self._cola.get_nowait()
+                except asyncio.QueueEmpty:
+                    restante = limite - loop.time()
+                    if restante <= 0:
+                        break
+                    try:
+                        siguiente = await asyncio.wait_for(self._cola.get(), restante)
+                    except asyncio.TimeoutError:
+                        break
+                if siguiente is _FIN:
+                    terminar = True
+                    break
+                lote.append(siguiente)
+            try:
+                await asyncio.to_thread(self._escribir_lote, lote)
+            except Exception:
+                # Disco lleno, permisos...: se pierde este lote, no el escritor
+                AUDITORIA_DESCARTADOS.inc(len(lote), motivo="error_escritura")
+                logger.exception("No se pudo escribir un lote de auditoría (%d registros)", len(lote))
+                await asyncio.to_thread(self._descartar_fichero)
+
+    # --- E/S (se ejecuta en un hilo) ---
+
+    @contextmanager
+    def _bloqueo(self):
+        """Cerrojo entre procesos para escribir un lote y rotar."""
+        os.makedirs(self.directorio, exist_ok=True)
+        if fcntl is None:
+            yield
+            return
+        if self._cerrojo is None:
+            self._cerrojo = open(self.ruta_cerrojo, "a")
+        fcntl.flock(self._cerrojo.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._cerrojo.fileno(), fcntl.LOCK_UN)
+
+    def _abrir(self) -> None:
+        self._fichero = open(self.ruta_activa, "a", encoding="utf-8")
+        # El segmento activo puede haberlo empezado otro proceso (o una ejecución
+        # anterior): su inicio es su primer registro
+        self._inicio_segmento = self._leer_inicio_existente()
+
+    def _reabrir_si_rotado(self) -> None:
+        # Otro proceso pudo rotar el fichero: si la ruta ya no es el que tenemos abierto, se reabre
+        if self._fichero is not None:
+            try:
+                if os.stat(self.ruta_activa).st_ino == os.fstat(self._fichero.fileno()).st_ino:
+                    return
+            except FileNotFoundError:
+                pass
+            self._cerrar()
+        self._abrir()
+
+    def _leer_inicio_existente(self) -> Optional[datetime]:
+        try:
+            with open(self.ruta_activa, encoding="utf-8") as f:
+                return datetime.fromisoformat(json.loads(f.readline())["ts"])
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _leer_fin_existente(self) -> Optional[datetime]:
+        # Último registro del fichero activo (puede ser de otro proceso)
+        try:
+            with open(self.ruta_activa, "rb") as f:
+                f.seek(max(0, os.fstat(f.fileno()).st_size - 65536))
+                ultima = f.read().rstrip(b"\n").rsplit(b"\n", 1)[-1]
+            return datetime.fromisoformat(json.loads(ultima)["ts"])
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _cerrar(self) -> None:
+        if self._fichero is not None:
+            self._fichero.close()
+            self._fichero = None
+
+    def _descartar_fichero(self) -> None:
+        # Tras un error el fichero puede haber quedado inservible: se reabre en el siguiente lote
+        try:
+            self._cerrar()
+        except OSError:
+            self._fichero = None
+
+    def _tamano(self) -> int:
+        self._fichero.flush()
+        return os.fstat(self._fichero.fileno()).st_size
+
+    def _debe_rotar(self, tamano: int, ahora: datetime) -> bool:
+        if tamano >= self.max_bytes:
+            return True
+        inicio = self._inicio_segmento or ahora
+        return (ahora - inicio).total_seconds() >= self.rotar_cada
+
+    def _rotar(self) -> str:
+        """Mueve el activo a un segmento con nombre libre y abre uno nuevo (con el cerrojo tomado)."""
+        self._cerrar()
+        fin = self._leer_fin_existente() or self._ultimo_registro or datetime.now()
+        inicio = self._inicio_segmento or fin
+        base = os.path.join(self.directorio, f"{self.nombre}.{_marca(inicio)}_{_marca(fin)}")
+        # Resolución de segundos: si el nombre ya existe se añade un contador
+        destino, n = base + ".jsonl", 1
+        while os.path.exists(destino) or os.path.exists(destino + ".gz"):
+            destino, n = f"{base}.{n}.jsonl", n + 1
+        os.replace(self.ruta_activa, destino)
+        self._abrir()
+        return destino
+
+    def _comprimir(self, ruta: str) -> None:
+        try:
+            with open(ruta, "rb") as origen, gzip.open(ruta + ".gz", "wb") as comprimido:
+                shutil.copyfileobj(origen, comprimido)
+        except Exception:
+            # Sin un .gz a medias el lector sigue viendo el segmento sin comprimir
+            if os.path.exists(ruta + ".gz"):
+                os.remove(ruta + ".gz")
+            raise
+        os.remove(ruta)
+
+    def _escribir_lote(self, lote: List[Dict[str, Any]]) -> None:
+        with AUDITORIA_ESCRITURA.medir():
+            rotados = self._escribir(lote)
+        AUDITORIA_REGISTROS.inc(len(lote))
+        # La compresión (lenta) va fuera del cerrojo: el segmento ya tiene un nombre propio.
+        # Si falla, los registros ya están escritos y el segmento queda sin comprimir
+        for ruta in rotados if self.comprimir else []:
+            try:
+                self._comprimir(ruta)
+            except Exception:
+                logger.exception("No se pudo comprimir el segmento de auditoría %s", ruta)
+
+    def _escribir(self, lote: List[Dict[str, Any]]) -> List[str]:
+        rotados = []
+        with self._bloqueo():
+            self._reabrir_si_rotado()
+            # Con el cerrojo tomado nadie más escribe: basta medir el fichero una vez por lote
+            tamano = self._tamano()
+            for registro in lote:
+                ts = datetime.fromisoformat(registro["ts"])
+                if tamano == 0:
+                    # Segmento vacío: empieza con este registro
+                    self._inicio_segmento = ts
+                elif self._debe_rotar(tamano, ts):
+                    rotados.append(self._rotar())
+                    self._inicio_segmento = ts
+                    tamano = 0
+                linea = json.dumps(registro, ensure_ascii=False) + "\n"
+                self._fichero.write(linea)
+                tamano += len(linea.encode("utf-8"))
+                self._ultimo_registro = ts
+            self._fichero.flush()
+            if AUDIT_FSYNC:
+                os.fsync(self._fichero.fileno())
+        return rotados
+
+
+# --- Lectura / consulta ---
+
+def _rango_segmento(ruta: str, nombre: str) -> Optional[tuple]:
+    base = os.path.basename(ruta)[len(nombre) + 1:].split(".")[0]
+    try:
+        inicio, fin = base.split("_")
+        return datetime.strptime(inicio, FORMATO_SEGMENTO), datetime.strptime(fin, FORMATO_SEGMENTO)
+    except ValueError:
+        return None
+
+
+def _abrir_segmento(ruta: str):
+    if ruta.endswith(".gz"):
+        return gzip.open(ruta, "rt", encoding="utf-8")
+    return open(ruta, encoding="utf-8")
+
+
+def leer_registros(
+    desde: Optional[datetime] = None,
+    hasta: Optional[datetime] = None,
+    directorio: str = AUDIT_DIR,
+    nombre: str = "analisis_log",
+) -> Iterator[Dict[str, Any]]:
+    """Recorre los registros en [desde, hasta] leyendo línea a línea.
+
+    Los segmentos rotados cuyo rango (codificado en el nombre) no se solapa con
+    el pedido se descartan sin abrirlos.
+    """
+    segmentos = []
+    for ruta in glob.glob(os.path.join(directorio, f"{nombre}.*_*.jsonl*")):
+        rango = _rango_segmento(ruta, nombre)
+        if rango is None:
+            continue
+        inicio, fin = rango
+        # El nombre tiene resolución de segundos: se amplía un segundo el final
+        if (desde and fin.timestamp() + 1 < desde.timestamp()) or (hasta and inicio > hasta):
+            continue
+        segmentos.append((inicio, ruta))
+    rutas = [ruta for _, ruta in sorted(segmentos)]
+    activa = os.path.join(directorio, f"{nombre}.jsonl")
+    if os.path.exists(activa):
+        rutas.append(activa)
+
+    for ruta in rutas:
+        with _abrir_segmento(ruta) as f:
+            for linea in f:
+                try:
+                    registro = json.loads(linea)
+                    ts = datetime.fromisoformat(registro["ts"])
+                except (ValueError, KeyError):
+                    continue
+                if desde and ts < desde:
+                    continue
+                if hasta and ts > hasta:
+                    # Varios procesos escriben en el mismo segmento: los registros pueden no ir en orden
+                    continue
+                yield registro
+
+
+_escritor: Optional[EscritorAuditoria] = None
+
+
+def obtener_escritor() -> EscritorAuditoria:
+    global _escritor
+    if _escritor is None:
+        _escritor = EscritorAuditoria()
+    return _escritor
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Consulta el log de auditoría por rango de fechas.")
+    parser.add_argument("--desde", type=datetime.fromisoformat)
+    parser.add_argument("--hasta", type=datetime.fromisoformat)
+    parser.add_argument("--directorio", default=AUDIT_DIR)
+    args = parser.parse_args()
+    for registro in leer_registros(args.desde, args.hasta, args.directorio):
+        print(json.dumps(registro, ensure_ascii=False))
@@ -0,0 +1,169 @@
+"""Caché de respuestas LLM con desduplicación "single-flight".
+
+La clave es el prompt normalizado (espacios colapsados y minúsculas) más el
+nombre del modelo. En memoria se guarda un LRU con TTL; opcionalmente las
+entradas se respaldan en un fichero SQLite que sobrevive a reinicios (las
+caducadas se borran cada INTERVALO_PURGA segundos).
+Si llegan N peticiones idénticas a la vez, solo la primera llama al
+proveedor y las demás esperan su resultado.
+"""
+import asyncio
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1024"))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "86400"))
+# Ruta del respaldo en disco; vacía para desactivarlo
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "")
+INTERVALO_PURGA = 300.0
+
+
+def normalizar_prompt(prompt: str) -> str:
+    return re.sub(r"\s+", " ", prompt).strip().lower()
+
+
+def clave_cache(prompt: str, modelo: str) -> str:
+    texto = f"{modelo}\n{normalizar_prompt(prompt)}"
+    return hashlib.sha256(texto.encode("utf-8")).hexdigest()
+
+
+class AlmacenDisco:
+    """Respaldo persistente (SQLite) de la caché, con una conexión por hilo."""
+
+    def __init__(self, ruta: str):
+        self.ruta = ruta
+        directorio = os.path.dirname(ruta)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        self._local = threading.local()
+        self._conn().executescript(
+            "CREATE TABLE IF NOT EXISTS cache (clave TEXT PRIMARY KEY, valor TEXT NOT NULL, creado REAL NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS idx_cache_creado ON cache (creado);"
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.ruta, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def leer(self, clave: str) -> Optional[Tuple[str, float]]:
+        fila = self._conn().execute("SELECT valor, creado FROM cache WHERE clave = ?", (clave,)).fetchone()
+        return (fila[0], fila[1]) if fila else None
+
+    def escribir(self, clave: str, valor: str, creado: float) -> None:
+        self._conn().execute(
+            "INSERT OR REPLACE INTO cache (clave, valor, creado) VALUES (?, ?, ?)", (clave, valor, creado)
+        )
+
+    def purgar(self, limite: float) -> int:
+        """Borra las entradas creadas antes de ``limite``."""
+        return self._conn().execute("DELETE FROM cache WHERE creado < ?", (limite,)).rowcount
+
+
+class CacheRespuestas:
+    """LRU + TTL en memoria, respaldo en disco opcional y coalescencia de llamadas."""
+
+    def __init__(self, max_entradas: int = LLM_CACHE_MAX_ENTRIES, ttl: float = LLM_CACHE_TTL, ruta_disco: str = LLM_CACHE_PATH):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self._entradas: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._en_curso: Dict[str, asyncio.Task] = {}
+        self._disco = AlmacenDisco(ruta_disco) if ruta_disco else None
+        self._ultima_purga = 0.0
+        self.estadisticas = {"hits": 0, "disk_hits": 0, "misses": 0, "coalesced": 0, "evictions": 0}
+
+    def _vigente(self, creado: float) -> bool:
+        return time.time() - creado < self.ttl
+
+    def _guardar_memoria(self, clave: str, valor: str, creado: float) -> None:
+        self._entradas[clave] = (valor, creado)
+        self._entradas.move_to_end(clave)
+        while len(self._entradas) > self.max_entradas:
+            self._entradas.popitem(last=False)
+            self.estadisticas["evictions"] += 1
+
+    async def obtener(self, clave: str, disco: bool = True) -> Optional[str]:
+        """Valor vigente de ``clave``; con ``disco=False`` solo se mira la memoria
+        (quien llama ya consultó el disco para esta misma petición)."""
+        entrada = self._entradas.get(clave)
+        if entrada is not None:
+            if self._vigente(entrada[1]):
+                self._entradas.move_to_end(clave)
+                self.estadisticas["hits"] += 1
+                return entrada[0]
+            del self._entradas[clave]
+
+        if disco and self._disco is not None:
+            fila = await asyncio.to_thread(self._disco.leer, clave)
+            if fila is not None and self._vigente(fila[1]):
+                self._guardar_memoria(clave, fila[0], fila[1])
+                self.estadisticas["disk_hits"] += 1
+                return fila[0]
+        return None
+
+    async def guardar(self, clave: str, valor: str) -> None:
+        creado = time.time()
+        self._guardar_memoria(clave, valor, creado)
+        if self._disco is not None:
+            await asyncio.to_thread(self._disco.escribir, clave, valor, creado)
+            if creado - self._ultima_purga >= INTERVALO_PURGA:
+                self._ultima_purga = creado
+                await asyncio.to_thread(self._disco.purgar, creado - self.ttl)
+
+    async def obtener_o_calcular(
+        self, clave: str, calcular: Callable[[], Awaitable[str]], disco: bool = True
+    ) -> str:
+        valor = await self.obtener(clave, disco)
+        if valor is not None:
+            return valor
+
+        # Single-flight: si ya hay una llamada idéntica en curso, esperamos su resultado.
+        # La llamada corre en su propia tarea: si el cliente que la originó se
+        # desconecta, los demás que esperan no pierden la respuesta.
+        tarea = self._en_curso.get(clave)
+        if tarea is not None:
+            self.estadisticas["coalesced"] += 1
+        else:
+            self.estadisticas["misses"] += 1
+            tarea = asyncio.ensure_future(self._calcular_y_guardar(clave, calcular))
+            self._en_curso[clave] = tarea
+            tarea.add_done_callback(lambda _: self._en_curso.pop(clave, None))
+        return await asyncio.shield(tarea)
+
+    async def _calcular_y_guardar(self, clave: str, calcular: Callable[[], Awaitable[str]]) -> str:
+        # Los fallos no se cachean: todos los que esperaban reciben el mismo error.
+        # Tampoco las respuestas de otro modelo que el de la clave (``Respuesta.reutilizable``)
+        valor = await calcular()
+        if getattr(valor, "reutilizable", True):
+            await self.guardar(clave, valor)
+        return valor
+
+    def stats(self) -> Dict[str, int]:
+        consultas = self.estadisticas["hits"] + self.estadisticas["disk_hits"] + self.estadisticas["misses"] + self.estadisticas["coalesced"]
+        ahorradas = consultas - self.estadisticas["misses"]
+        return {
+            **self.estadisticas,
+            "entries": len(self._entradas),
+            "in_flight": len(self._en_curso),
+            "hit_ratio": round(ahorradas / consultas, 4) if consultas else 0.0,
+        }
+
+
+_cache: Optional[CacheRespuestas] = None
+
+
+def obtener_cache() -> CacheRespuestas:
+    global _cache
+    if _cache is None:
+        _cache = CacheRespuestas()
+    return _cache
@@ -0,0 +1,416 @@
+"""Enrutador LLM sobre varios backends: peticiones de cobertura y circuit breakers.
+
+Con LLM_BACKENDS (lista JSON) ``obtener_cliente()`` devuelve un
+``EnrutadorLLM`` con la misma interfaz que ``ClienteLLM``:
+
+    LLM_BACKENDS='[
+        {"nombre": "openai", "modelo": "gpt-4"},
+        {"nombre": "respaldo", "modelo": "gpt-4o-mini", "base_url": "https://...", "api_key_env": "RESPALDO_KEY"},
+        {"nombre": "local", "modelo": "llama3", "base_url": "http://127.0.0.1:11434/v1", "api_key": "local"},
+        {"nombre": "mock", "tipo": "mock"}
+    ]'
+
+- Cada petición va al primer backend disponible: el orden de la lista es la
+  preferencia (calidad, coste).
+- Si no ha respondido al superar su p95 observado (respuesta completa, o
+  primer fragmento en streaming) se lanza la misma petición al backend
+  disponible con menor EWMA; gana el primero que responde y el otro se
+  cancela (se cierra su conexión). Las coberturas se limitan a
+  LLM_HEDGE_BUDGET de las peticiones para no duplicar la carga cuando todo
+  va lento a la vez.
+- Un error pasa la petición al siguiente backend sin esperar (con varios
+  backends cada cliente no reintenta por su cuenta).
+- Circuit breaker por backend: tras LLM_BREAKER_FAILURES errores seguidos
+  deja de recibir tráfico durante LLM_BREAKER_COOLDOWN segundos; después una
+  sola petición de prueba decide si vuelve a cerrarse.
+
+``GET /llm/stats`` muestra el estado de cada backend.
+"""
+import asyncio
+import json
+import math
+import os
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from .llm import LLM_MAX_RETRIES, LLM_MODEL, LLM_TIMEOUT, ClienteLLM, ClienteMock, LLMError, Respuesta
+from .metricas import LLM_BACKEND_RESULTADOS, LLM_CIRCUITO_ABIERTO, LLM_COBERTURAS
+
+# Espera antes de cubrir mientras un backend no tiene muestras suficientes para
+# su p95: LLM_HEDGE_EWMA_FACTOR veces su EWMA, o LLM_HEDGE_DELAY sin ninguna muestra
+LLM_HEDGE_DELAY = float(os.getenv("LLM_HEDGE_DELAY", "5"))
+LLM_HEDGE_EWMA_FACTOR = float(os.getenv("LLM_HEDGE_EWMA_FACTOR", "3"))
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "0.05"))
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "0.95"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+# Fracción de peticiones que pueden cubrirse (y ráfaga máxima acumulable)
+LLM_HEDGE_BUDGET = float(os.getenv("LLM_HEDGE_BUDGET", "0.1"))
+LLM_HEDGE_BURST = float(os.getenv("LLM_HEDGE_BURST", "5"))
+LLM_LATENCY_WINDOW = int(os.getenv("LLM_LATENCY_WINDOW", "200"))
+LLM_EWMA_ALPHA = float(os.getenv("LLM_EWMA_ALPHA", "0.2"))
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+
+MODOS = ("completo", "stream")
+
+
+class Latencias:
+    """EWMA y percentiles sobre las últimas LLM_LATENCY_WINDOW muestras."""
+
+    def __init__(self, ventana: int = LLM_LATENCY_WINDOW, alfa: float = LLM_EWMA_ALPHA):
+        self.alfa = alfa
+        self.ewma: Optional[float] = None
+        self.muestras: deque = deque(maxlen=ventana)
+        self._ordenadas: Optional[List[float]] = None
+
+    def observar(self, segundos: float) -> None:
+        self.ewma = segundos if self.ewma is None else self.alfa * segundos + (1 - self.alfa) * self.ewma
+        self.muestras.append(segundos)
+        self._ordenadas = None
+
+    def percentil(self, p: float) -> Optional[float]:
+        if len(self.muestras) < LLM_HEDGE_MIN_SAMPLES:
+            return None
+        if self._ordenadas is None:
+            self._ordenadas = sorted(self.muestras)
+        return self._ordenadas[min(len(self._ordenadas) - 1, int(len(self._ordenadas) * p))]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "muestras": len(self.muestras),
+            "ewma": self.ewma,
+            "p50": self.percentil(0.5),
+            "p95": self.percentil(0.95),
+        }
+
+
+class Circuito:
+    """Circuit breaker: cerrado -> abierto (tras N fallos seguidos) -> semiabierto (una prueba)."""
+
+    def __init__(self, nombre: str, fallos: int = LLM_BREAKER_FAILURES, espera: float = LLM_BREAKER_COOLDOWN):
+        self.nombre = nombre
+        self.umbral = fallos
+        self.espera = espera
+        self.estado = "cerrado"
+        self.fallos_seguidos = 0
+        self.abierto_hasta = 0.0
+        self._probando = False
+
+    def disponible(self) -> bool:
+        if self.estado == "abierto" and time.monotonic() >= self.abierto_hasta:
+            self.estado = "semiabierto"
+            self._probando = False
+        if self.estado == "semiabierto":
+            return not self._probando
+        return self.estado == "cerrado"
+
+    def reservar(self) -> bool:
+        """Reserva la petición de prueba si está semiabierto; devuelve si esta lo es."""
+        if self.estado == "semiabierto" and not self._probando:
+            self._probando = True
+            return True
+        return False
+
+    def liberar(self) -> None:
+        # La prueba se canceló (perdió la carrera o el cliente se fue): no decide nada
+        self._probando = False
+
+    def exito(self) -> None:
+        self.fallos_seguidos = 0
+        if self.estado != "cerrado":
+            self.estado = "cerrado"
+            LLM_CIRCUITO_ABIERTO.set(0, backend=self.nombre)
+
+    def fallo(self) -> None:
+        self.fallos_seguidos += 1
+        if self.estado == "semiabierto" or self.fallos_seguidos >= self.umbral:
+            self.estado = "abierto"
+            self.abierto_hasta = time.monotonic() + self.espera
+            self._probando = False
+            LLM_CIRCUITO_ABIERTO.set(1, backend=self.nombre)
+
+
+class BackendLLM:
+    def __init__(self, nombre: str, cliente):
+        self.nombre = nombre
+        self.cliente = cliente
+        self.latencia = {modo: Latencias() for modo in MODOS}
+        self.circuito = Circuito(nombre)
+
+    def retraso_cobertura(self, modo: str) -> float:
+        """Tiempo tras el que conviene cubrir una petición a este backend (su p95)."""
+        latencias = self.latencia[modo]
+        retraso = latencias.percentil(LLM_HEDGE_PERCENTILE)
+        if retraso is None:
+            retraso = LLM_HEDGE_DELAY if latencias.ewma is None else min(LLM_HEDGE_DELAY, LLM_HEDGE_EWMA_FACTOR * latencias.ewma)
+        return max(LLM_HEDGE_MIN_DELAY, retraso)
+
+    def ewma(self, modo: str) -> float:
+        valor = self.latencia[modo].ewma
+        return math.inf if valor is None else valor
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "nombre": self.nombre,
+            "modelo": self.cliente.modelo,
+            "circuito": self.circuito.estado,
+            "fallos_seguidos": self.circuito.fallos_seguidos,
+            **{modo: self.latencia[modo].stats() for modo in MODOS},
+        }
+
+
+class EnrutadorLLM:
+    """Reparte las llamadas entre backends con la interfaz de ``ClienteLLM``.
+
+    ``modelo`` (usado en la clave de caché) es el del backend preferido; el
+    argumento ``modelo`` de las llamadas se ignora: cada backend usa el suyo.
+    Las respuestas son ``Respuesta`` (``str``) con el modelo que respondió:
+    las de otro modelo o de un backend mock no son reutilizables (ni se
+    cachean ni se indexan con la clave del preferido).
+    """
+
+    def __init__(self, backends: List[BackendLLM]):
+        if not backends:
+            raise ValueError("El enrutador LLM necesita al menos un backend")
+        self.backends = backends
+        self.modelo = backends[0].cliente.modelo
+        self._credito = LLM_HEDGE_BURST
+        self.coberturas = 0
+
+    def _elegir(self, excluidos: List[BackendLLM], modo: str, preferido: bool) -> Optional[BackendLLM]:
+        candidatos = [b for b in self.backends if b not in excluidos and b.circuito.disponible()]
+        if not candidatos:
+            return None
+        if preferido:
+            return candidatos[0]
+        # Cobertura o reparto tras un error: el más rápido (sin muestras, por orden de la lista)
+        return min(candidatos, key=lambda b: b.ewma(modo))
+
+    def _gastar_credito(self) -> bool:
+        if self._credito < 1:
+            return False
+        self._credito -= 1
+        return True
+
+    async def _carrera(
+        self,
+        modo: str,
+        llamar: Callable[[BackendLLM], Awaitable[Any]],
+        descartar: Optional[Callable[[Any], Awaitable[None]]] = None,
+    ) -> Tuple[BackendLLM, Any]:
+        """Ejecuta ``llamar(backend)`` con cobertura y reparto ante errores.
+
+        Devuelve el primer resultado correcto; las demás llamadas en curso se
+        cancelan. ``descartar`` libera un resultado que llegó a la vez que el ganador.
+        """
+        self._credito = min(LLM_HEDGE_BURST, self._credito + LLM_HEDGE_BUDGET)
+        lanzados: List[BackendLLM] = []
+        tareas: Dict[asyncio.Task, Tuple[BackendLLM, float]] = {}
+        cubierta = False
+        ultimo_error: Optional[LLMError] = None
+
+        def lanzar(backend: BackendLLM) -> None:
+            # La prueba del semiabierto se reserva aquí, en el mismo paso que _elegir:
+            # si se reservara al arrancar la tarea, todas las peticiones del mismo
+            # ciclo del loop verían el circuito disponible y todas serían "la prueba"
+            prueba = backend.circuito.reservar()
+            lanzados.append(backend)
+            tarea = asyncio.ensure_future(llamar(backend))
+            if prueba:
+                # Cancelada (incluso antes de arrancar): la prueba no decide nada
+                tarea.add_done_callback(lambda t: t.cancelled() and backend.circuito.liberar())
+            tareas[tarea] = (backend, time.monotonic())
+
+        try:
+            while True:
+                if not tareas:
+                    backend = self._elegir(lanzados, modo, preferido=not lanzados)
+                    if backend is None:
+                        raise ultimo_error or LLMError("Ningún backend LLM disponible (circuitos abiertos)")
+                    lanzar(backend)
+                espera = None
+                if not cubierta and len(tareas) == 1:
+                    ((backend, inicio),) = tareas.values()
+                    espera = max(0.0, backend.retraso_cobertura(modo) - (time.monotonic() - inicio))
+                hechas, _ = await asyncio.wait(tareas, timeout=espera, return_when=asyncio.FIRST_COMPLETED)
+                if not hechas:
+                    # Supera su p95: se duplica la petición en otro backend (una vez por petición)
+                    cubierta = True
+                    otro = self._elegir(lanzados, modo, preferido=False)
+                    if otro is not None and self._gastar_credito():
+                        self.coberturas += 1
+                        LLM_COBERTURAS.inc(backend=otro.nombre)
+                        lanzar(otro)
+                    continue
+                ganador = None
+                for tarea in hechas:
+                    backend, _ = tareas.pop(tarea)
+                    try:
+                        resultado = tarea.result()
+                    except LLMError as e:
+                        ultimo_error = e
+                        continue
+                    if ganador is None:
+                        ganador = (backend, resultado)
+                    elif descartar is not None:
+                        await descartar(resultado)
+                if ganador is not None:
+                    return ganador
+        finally:
+            for tarea in tareas:
+                tarea.cancel()
+            if tareas:
+                await asyncio.gather(*tareas, return_exceptions=True)
+
+    async def _completar_en(self, backend: BackendLLM, mensajes, timeout) -> str:
+        inicio = time.perf_counter()
+        try:
+            texto = await backend.cliente.completar(mensajes, timeout=timeout)
+        except asyncio.CancelledError:
+            self._cancelada(backend, "completo", inicio)
+            raise
+        except LLMError:
+            self._fallida(backend)
+            raise
+        except Exception as e:
+            # Cualquier otro fallo del cliente también libera la prueba del circuito
+            # y cuenta como error del backend: la carrera pasa al siguiente
+            self._fallida(backend)
+            raise LLMError(f"{backend.nombre}: {e}") from e
+        self._correcta(backend, "completo", inicio)
+        return texto
+
+    async def completar(
+        self,
+        mensajes: List[Dict[str, str]],
+        modelo: Optional[str] = None,
+        timeout: Optional[float] = None,
+    ) -> str:
+        backend, texto = await self._carrera("completo", lambda b: self._completar_en(b, mensajes, timeout))
+        return self._respuesta(backend, texto)
+
+    async def _abrir_stream_en(self, backend: BackendLLM, mensajes, timeout):
+        """Abre el stream en ``backend`` y espera su primer fragmento."""
+        inicio = time.perf_counter()
+        fragmentos = backend.cliente.completar_stream(mensajes, timeout=timeout)
+        try:
+            primero = await fragmentos.__anext__()
+        except StopAsyncIteration:
+            primero = None
+        except asyncio.CancelledError:
+            self._cancelada(backend, "stream", inicio)
+            await fragmentos.aclose()
+            raise
+        except LLMError:
+            self._fallida(backend)
+            await fragmentos.aclose()
+            raise
+        except Exception as e:
+            self._fallida(backend)
+            await fragmentos.aclose()
+            raise LLMError(f"{backend.nombre}: {e}") from e
+        self._correcta(backend, "stream", inicio)
+        return fragmentos, primero
+
+    async def completar_stream(
+        self,
+        mensajes: List[Dict[str, str]],
+        modelo: Optional[str] = None,
+        timeout: Optional[float] = None,
+    ):
+        """Como ``ClienteLLM.completar_stream``: la carrera se decide con el primer
+        fragmento y a partir de ahí el stream sigue en el backend ganador."""
+
+        async def descartar(abierto):
+            await abierto[0].aclose()
+
+        backend, (fragmentos, primero) = await self._carrera(
+            "stream", lambda b: self._abrir_stream_en(b, mensajes, timeout), descartar
+        )
+        try:
+            if primero is None:
+                return
+            yield self._respuesta(backend, primero)
+            async for delta in fragmentos:
+                yield self._respuesta(backend, delta)
+        except LLMError:
+            # Ya se emitió texto: no se puede pasar a otro backend, pero cuenta para su circuito
+            backend.circuito.fallo()
+            raise
+        except Exception as e:
+            backend.circuito.fallo()
+            raise LLMError(f"{backend.nombre}: {e}") from e
+        finally:
+            await fragmentos.aclose()
+
+    def _respuesta(self, backend: BackendLLM, texto: str) -> Respuesta:
+        reutilizable = backend.cliente.modelo == self.modelo and not isinstance(backend.cliente, ClienteMock)
+        return Respuesta(texto, backend.cliente.modelo, reutilizable)
+
+    def _correcta(self, backend: BackendLLM, modo: str, inicio: float) -> None:
+        backend.latencia[modo].observar(time.perf_counter() - inicio)
+        backend.circuito.exito()
+        LLM_BACKEND_RESULTADOS.inc(backend=backend.nombre, resultado="ok")
+
+    def _fallida(self, backend: BackendLLM) -> None:
+        backend.circuito.fallo()
+        LLM_BACKEND_RESULTADOS.inc(backend=backend.nombre, resultado="error")
+
+    def _cancelada(self, backend: BackendLLM, modo: str, inicio: float) -> None:
+        # Perdió la carrera: lo que llevaba esperando es una cota inferior de su
+        # latencia y se cuenta, o un backend lento nunca vería subir su p95
+        # (la prueba del semiabierto la libera el callback de lanzar)
+        backend.latencia[modo].observar(time.perf_counter() - inicio)
+        LLM_BACKEND_RESULTADOS.inc(backend=backend.nombre, resultado="cancelada")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "coberturas": self.coberturas,
+            "credito_coberturas": round(self._credito, 2),
+            "backends": [b.stats() for b in self.backends],
+        }
+
+    async def cerrar(self) -> None:
+        await asyncio.gather(*(b.cliente.cerrar() for b in self.backends), return_exceptions=True)
+
+
+def leer_backends(texto: str) -> List[Dict[str, Any]]:
+    """Valida LLM_BACKENDS (al arrancar: un error de configuración no debe aparecer en cada petición)."""
+    try:
+        configs = json.loads(texto)
+    except ValueError as e:
+        raise ValueError(f"LLM_BACKENDS no es JSON válido: {e}") from e
+    if not isinstance(configs, list) or not configs or not all(isinstance(c, dict) for c in configs):
+        raise ValueError("LLM_BACKENDS debe ser una lista JSON no vacía de objetos")
+    for config in configs:
+        if config.get("tipo", "openai") not in ("openai", "mock"):
+            raise ValueError(f"LLM_BACKENDS: tipo de backend desconocido {config['tipo']!r}")
+        if config.get("tipo") != "mock" and not (config.get("api_key") or os.getenv(config.get("api_key_env", "OPENAI_API_KEY"))):
+            nombre = config.get("nombre") or config.get("modelo") or LLM_MODEL
+            raise ValueError(f"Backend LLM '{nombre}' sin api_key (ni variable {config.get('api_key_env', 'OPENAI_API_KEY')})")
+    return configs
+
+
+def crear_backend(config: Dict[str, Any], reintentos: int) -> BackendLLM:
+    if config.get("tipo") == "mock":
+        # Sustituto local sin red (misma respuesta fija que /analizar-problema-mock)
+        return BackendLLM(config.get("nombre", "mock"), ClienteMock(latencia=float(config.get("latencia", 0))))
+    nombre = config.get("nombre") or config.get("modelo") or LLM_MODEL
+    api_key = config.get("api_key") or os.getenv(config.get("api_key_env", "OPENAI_API_KEY"))
+    if not api_key:
+        raise ValueError(f"Backend LLM '{nombre}' sin api_key (ni variable {config.get('api_key_env', 'OPENAI_API_KEY')})")
+    cliente = ClienteLLM(
+        api_key=api_key,
+        base_url=config.get("base_url", os.getenv("OPENAI_BASE_URL")),
+        modelo=config.get("modelo", LLM_MODEL),
+        timeout=float(config.get("timeout", LLM_TIMEOUT)),
+        max_reintentos=int(config.get("reintentos", reintentos)),
+    )
+    return BackendLLM(nombre, cliente)
+
+
+def crear_enrutador(configs: List[Dict[str, Any]]) -> EnrutadorLLM:
+    # Con un solo backend se conservan sus reintentos; con varios, reintentar es pasar al siguiente
+    reintentos = LLM_MAX_RETRIES if len(configs) == 1 else 0
+    return EnrutadorLLM([crear_backend(config, reintentos) for config in configs])
@@ -0,0 +1,307 @@
+"""Capa de cliente LLM asíncrona compartida por los endpoints de análisis.
+
+Un único ``AsyncOpenAI`` montado sobre un ``httpx.AsyncClient`` con pool de
+conexiones reutilizable, timeout por llamada, reintentos con jitter y un
+semáforo que limita cuántas llamadas concurrentes salen hacia el proveedor.
+Así una generación larga de GPT-4 ya no bloquea el event loop de uvicorn.
+"""
+import asyncio
+import importlib.util
+import os
+import random
+import time
+from typing import AsyncIterator, Dict, List, Optional
+
+from .metricas import LLM_DURACION, LLM_ERRORES, LLM_PRIMER_TOKEN, registrar_uso_llm
+
+# Configuración (todas sobreescribibles por variables de entorno)
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-4")
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", str(LLM_MAX_CONCURRENCY)))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "8"))
+LLM_MOCK_LATENCY = float(os.getenv("LLM_MOCK_LATENCY", "0"))
+# Pide el bloque "usage" al final del stream (desactivar si el proveedor no lo soporta)
+LLM_STREAM_USAGE = os.getenv("LLM_STREAM_USAGE", "1") == "1"
+
+SYSTEM_PROMPT = (
+    "Eres un experto en resolución de problemas, metodologías 5 Porqués, "
+    "Ishikawa, FMEA y mejora continua."
+)
+
+
+def openai_client_available() -> bool:
+    # Solo comprueba que openai>=1.0.0 está instalado; la importación (pesada)
+    # se hace al crear el primer cliente, no al arrancar el servidor
+    return importlib.util.find_spec("openai") is not None
+
+
+class LLMError(Exception):
+    """Error al obtener una respuesta del proveedor LLM."""
+
+
+def construir_mensajes(prompt: str) -> List[Dict[str, str]]:
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt},
+    ]
+
+
+def _extraer_texto(response) -> str:
+    # Extraer texto de la respuesta (compatibilidades con la estructura de retorno)
+    try:
+        return response.choices[0].message.content
+    except Exception:
+        # fallback a forma estilo diccionario si aplica
+        return response["choices"][0]["message"]["content"]
+
+
+def _espera_con_jitter(intento: int) -> float:
+    # Backoff exponencial con "full jitter": evita que los reintentos se sincronicen
+    return random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * (2 ** intento)))
+
+
+class ClienteLLM:
+    """Cliente OpenAI asíncrono con pool HTTP, reintentos y límite de concurrencia."""
+
+    def __init__(
+        self,
+        api_key: str,
+        base_url: Optional[str] = None,
+        modelo: str = LLM_MODEL,
+        timeout: float = LLM_TIMEOUT,
+        max_reintentos: int = LLM_MAX_RETRIES,
+        max_concurrencia: int = LLM_MAX_CONCURRENCY,
+        tam_pool: int = LLM_POOL_SIZE,
+    ):
+        import httpx
+        import openai
+
+        self.modelo = modelo
+        self.timeout = timeout
+        self.max_reintentos = max_reintentos
+        self._reintentables = (
+            openai.APITimeoutError,
+            openai.APIConnectionError,
+            openai.RateLimitError,
+            openai.InternalServerError,
+        )
+        # Errores de transporte que openai no envuelve (p.ej. al leer un stream ya abierto)
+        self._errores = (openai.OpenAIError, httpx.HTTPError)
+        self._semaforo = asyncio.Semaphore(max_concurrencia)
+        self._http = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=tam_pool, max_keepalive_connections=tam_pool),
+            timeout=timeout,
+        )
+        # Los reintentos los gestionamos nosotros (con jitter y fuera del semáforo)
+        self._client = openai.AsyncOpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            http_client=self._http,
+            max_retries=0,
+            timeout=timeout,
+        )
+
+    def _registrar_fallo(self, modelo: str, modo: str, inicio: float, error: Exception) -> None:
+        LLM_DURACION.observar(time.perf_counter() - inicio, modelo=modelo, modo=modo, resultado="error")
+        LLM_ERRORES.inc(modelo=modelo, tipo=type(error).__name__)
+
+    async def completar(
+        self,
+        mensajes: List[Dict[str, str]],
+        modelo: Optional[str] = None,
+        timeout: Optional[float] = None,
+    ) -> str:
+        modelo = modelo or self.modelo
+        intento = 0
+        while True:
+            try:
+                async with self._semaforo:
+                    inicio = time.perf_counter()
+                    try:
+                        response = await self._client.chat.completions.create(
+                            model=modelo,
+                            messages=mensajes,
+                            timeout=timeout or self.timeout,
+                        )
+                    except Exception as e:
+                        self._registrar_fallo(modelo, "completo", inicio, e)
+                        raise
+                LLM_DURACION.observar(time.perf_counter() - inicio, modelo=modelo, modo="completo", resultado="ok")
+                registrar_uso_llm(modelo, getattr(response, "usage", None))
+                return _extraer_texto(response)
+            except self._reintentables as e:
+                if intento >= self.max_reintentos:
+                    raise LLMError(str(e)) from e
+                await asyncio.sleep(_espera_con_jitter(intento))
+                intento += 1
+            except self._errores as e:
+                raise LLMError(str(e)) from e
+
+    async def completar_stream(
+        self,
+        mensajes: List[Dict[str, str]],
+        modelo: Optional[str] = None,
+        timeout: Optional[float] = None,
+    ) -> AsyncIterator[str]:
+        """Genera los fragmentos de texto a medida que llegan del proveedor.
+
+        Solo se reintenta mientras no se haya emitido ningún fragmento. Si el
+        consumidor cancela (p.ej. el cliente HTTP se desconecta) se cierra la
+        respuesta upstream y se libera el hueco del semáforo.
+        """
+        modelo = modelo or self.modelo
+        extra = {"stream_options": {"include_usage": True}} if LLM_STREAM_USAGE else {}
+        intento = 0
+        while True:
+            # Como en completar(): el hueco del semáforo se suelta antes de la espera del reintento
+            await self._semaforo.acquire()
+            inicio = time.perf_counter()
+            try:
+                stream = await self._client.chat.completions.create(
+                    model=modelo,
+                    messages=mensajes,
+                    timeout=timeout or self.timeout,
+                    stream=True,
+                    **extra,
+                )
+                break
+            except self._reintentables as e:
+                self._semaforo.release()
+                self._registrar_fallo(modelo, "stream", inicio, e)
+                if intento >= self.max_reintentos:
+                    raise LLMError(str(e)) from e
+                await asyncio.sleep(_espera_con_jitter(intento))
+                intento += 1
+            except self._errores as e:
+                self._semaforo.release()
+                self._registrar_fallo(modelo, "stream", inicio, e)
+                raise LLMError(str(e)) from e
+            except BaseException:
+                self._semaforo.release()
+                raise
+
+        resultado = "cancelado"
+        primero = True
+        try:
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    if primero:
+                        LLM_PRIMER_TOKEN.observar(time.perf_counter() - inicio, modelo=modelo)
+                        primero = False
+                    yield chunk.choices[0].delta.content
+                # Con include_usage el último chunk trae el uso y ninguna "choice"
+                registrar_uso_llm(modelo, getattr(chunk, "usage", None))
+            resultado = "ok"
+        except self._errores as e:
+            resultado = "error"
+            LLM_ERRORES.inc(modelo=modelo, tipo=type(e).__name__)
+            raise LLMError(str(e)) from e
+        finally:
+            LLM_DURACION.observar(time.perf_counter() - inicio, modelo=modelo, modo="stream", resultado=resultado)
+            try:
+                await stream.close()
+            finally:
+                self._semaforo.release()
+
+    async def cerrar(self) -> None:
+        await self._http.aclose()
+
+
+class Respuesta(str):
+    """Texto de una respuesta con el modelo que la generó.
+
+    ``reutilizable`` es falso si no puede guardarse con la clave del modelo
+    pedido (p.ej. la respondió un backend de respaldo del enrutador).
+    """
+
+    def __new__(cls, texto: str, modelo: str, reutilizable: bool = True):
+        respuesta = super().__new__(cls, texto)
+        respuesta.modelo = modelo
+        respuesta.reutilizable = reutilizable
+        return respuesta
+
+
+def es_reutilizable(texto: str) -> bool:
+    return getattr(texto, "reutilizable", True)
+
+
+class ClienteMock:
+    """Cliente simulado con la misma interfaz que ``ClienteLLM``."""
+
+    modelo = "mock"
+    TEXTO = (
+        "Respuesta mock: análisis simulado. Si quieres la respuesta real, "
+        "configura la variable de entorno OPENAI_API_KEY con tu clave."
+    )
+
+    def __init__(self, latencia: float = LLM_MOCK_LATENCY, max_concurrencia: int = LLM_MAX_CONCURRENCY):
+        self.latencia = latencia
+        self._semaforo = asyncio.Semaphore(max_concurrencia)
+
+    async def completar(self, mensajes: List[Dict[str, str]], modelo: Optional[str] = None, timeout: Optional[float] = None) -> str:
+        async with self._semaforo:
+            if self.latencia:
+                await asyncio.sleep(self.latencia)
+        return self.TEXTO
+
+    async def completar_stream(self, mensajes: List[Dict[str, str]], modelo: Optional[str] = None, timeout: Optional[float] = None) -> AsyncIterator[str]:
+        async with self._semaforo:
+            palabras = self.TEXTO.split(" ")
+            for i, palabra in enumerate(palabras):
+                if self.latencia:
+                    await asyncio.sleep(self.latencia / len(palabras))
+                yield palabra if i == 0 else " " + palabra
+
+    async def cerrar(self) -> None:
+        pass
+
+
+# Instancias compartidas por proceso (se crean en el primer uso)
+_cliente: Optional[ClienteLLM] = None
+_cliente_mock: Optional[ClienteMock] = None
+
+
+def obtener_cliente() -> Optional[ClienteLLM]:
+    """Devuelve el cliente compartido, o None si no hay clave o librería.
+
+    Con LLM_BACKENDS es un ``EnrutadorLLM`` (misma interfaz) que reparte las
+    llamadas entre varios backends, ver enrutador.py.
+    """
+    global _cliente
+    api_key = os.getenv("OPENAI_API_KEY")
+    backends = os.getenv("LLM_BACKENDS")
+    if _cliente is None and openai_client_available():
+        if backends:
+            from .enrutador import crear_enrutador, leer_backends
+
+            _cliente = crear_enrutador(leer_backends(backends))
+        elif api_key:
+            _cliente = ClienteLLM(api_key=api_key, base_url=os.getenv("OPENAI_BASE_URL"))
+    return _cliente
+
+
+def comprobar_configuracion() -> None:
+    """Falla al arrancar si LLM_BACKENDS está mal formado (sin crear clientes ni importar openai)."""
+    backends = os.getenv("LLM_BACKENDS")
+    if backends:
+        from .enrutador import leer_backends
+
+        leer_backends(backends)
+
+
+def obtener_cliente_mock() -> ClienteMock:
+    global _cliente_mock
+    if _cliente_mock is None:
+        _cliente_mock = ClienteMock()
+    return _cliente_mock
+
+
+async def cerrar_clientes() -> None:
+    global _cliente, _cliente_mock
+    if _cliente is not None:
+        await _cliente.cerrar()
+    _cliente = None
+    _cliente_mock = None
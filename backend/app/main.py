@@ -1,20 +1,23 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import APIRouter, FastAPI, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Dict, Any
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, ValidationError
+from typing import Any, AsyncIterator, Dict, List, Optional
 from uuid import uuid4
+import asyncio
 import datetime
+import hashlib
+import json
+import os
+import re
 
-app = FastAPI()
+from .almacen import CursorInvalido, obtener_almacen
+from .metricas import MiddlewareMetricas, router as router_metricas
+from .matematicas import ErrorSimbolico, TiempoAgotado, cerrar_motor, obtener_motor, sympy_disponible
+from .similares import indexar, obtener_indice, texto_de_pasos, vista_publica
+from .trabajos import encolar_trabajo, quiere_trabajo, registrar_tipo, router as router_trabajos
 
-# Habilitar CORS para permitir el acceso desde el frontend
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # Permite cualquier origen (ajústalo en producción)
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+router = APIRouter()
 
 # Modelos
 class ProblemCreate(BaseModel):
@@ -28,17 +31,27 @@ class Solution(BaseModel):
     content: List[str]
     created_at: str
 
-# Almacenamiento en memoria (sustituir por DB en producción)
-PROBLEMS: List[Dict[str, Any]] = []
-SOLUTIONS: Dict[str, Dict[str, Any]] = {}
+# Almacenamiento persistente (SQLite en modo WAL, ver almacen.py)
+PROBLEMS_PAGE_DEFAULT = 50
+PROBLEMS_PAGE_MAX = 200
+
+# Importación masiva (/solve/batch)
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "10000"))
+
+# Palabras completas: "sum" no debe coincidir dentro de "consumo"
+MATH_KEYWORDS = re.compile(r"\b(integral(es)?|deriv\w*|sqrt|sumatorias?|sum)\b|[\u222b^]")
+
+def is_math_problem(problem: ProblemCreate) -> bool:
+    text = problem.description.lower()
+    return problem.type.lower() in ("matematico", "mathematics") or MATH_KEYWORDS.search(text) is not None
 
 # Helper para generar una solución simple (mock) — reemplazar por pipeline IA en producción
 def generate_solution(problem: ProblemCreate) -> List[str]:
-    text = problem.description.lower()
     steps: List[str] = []
 
     # Caso sencillo para problemas matemáticos
-    if problem.type.lower() in ("matematico", "mathematics") or any(k in text for k in ["integral", "deriv", "\u222b", "^", "sqrt", "sumatoria", "sum"]):
+    if is_math_problem(problem):
         steps.append("<p>1) Interpretar la expresión y variables implicadas.</p>")
         steps.append("<p>2) Simplificar la expresión cuando sea posible.</p>")
         steps.append("<p>3) Aplicar el método adecuado (por ejemplo, integración por partes, sustitución, series, etc.).</p>")
@@ -54,22 +67,30 @@ def generate_solution(problem: ProblemCreate) -> List[str]:
 
     return steps
 
-@app.post("/solve")
-async def solve(problem: ProblemCreate):
-    """Recibe un problema y devuelve una solución generada (mock).
+async def solve_content(problem: ProblemCreate) -> List[str]:
+    """Pasos de la solución: motor simbólico para problemas matemáticos, plantilla en otro caso."""
+    if is_math_problem(problem) and sympy_disponible():
+        try:
+            # Corre en el pool de procesos (con timeout), nunca en el event loop
+            return await obtener_motor().resolver(problem.description)
+        except TiempoAgotado:
+            return generate_solution(problem) + ["<p>Nota: el cálculo simbólico superó el tiempo límite; se muestran los pasos generales.</p>"]
+        except ErrorSimbolico:
+            # No se pudo interpretar la expresión: se devuelven los pasos generales
+            pass
+    return generate_solution(problem)
 
-    Respuesta esperada por el frontend:
-    {
-      "id": "uuid",
-      "summary": "resumen breve",
-      "content": ["<p> paso 1 </p>", "<p> paso 2 </p>"],
-      "created_at": "iso timestamp"
-    }
-    """
+@router.on_event("shutdown")
+def stop_math_engine():
+    cerrar_motor()
+
+async def solve_problem(problem: ProblemCreate) -> Dict[str, Any]:
+    """Genera la solución de un problema y la persiste (compartido por /solve y /solve/batch)."""
     solution_id = str(uuid4())
-    created_at = datetime.datetime.utcnow().isoformat() + "Z"
+    # Siempre con microsegundos: el cursor de /problems compara created_at como texto
+    created_at = datetime.datetime.utcnow().isoformat(timespec="microseconds") + "Z"
 
-    content = generate_solution(problem)
+    content = await solve_content(problem)
     summary = f"Solución generada para '{problem.title}'"
 
     sol = {
@@ -79,21 +100,187 @@ async def solve(problem: ProblemCreate):
         "created_at": created_at,
     }
 
-    SOLUTIONS[solution_id] = sol
-    PROBLEMS.insert(0, {"id": solution_id, "title": problem.title, "status": "Resuelto", "created_at": created_at})
+    problema = {"id": solution_id, "title": problem.title, "status": "Resuelto", "created_at": created_at}
+    await asyncio.to_thread(obtener_almacen().guardar_solucion, problema, sol)
+    # Índice de similares: la solución queda disponible para /problems/similar
+    await indexar("solve", f"{problem.title}\n{problem.description}", texto_de_pasos(content), solution_id)
 
     return sol
 
-@app.get("/solve/{solution_id}")
+async def solve_job(entrada: Dict[str, Any], progreso) -> Dict[str, Any]:
+    await progreso(0.1, "Resolviendo el problema")
+    return await solve_problem(ProblemCreate.model_validate(entrada))
+
+registrar_tipo("solve", solve_job)
+
+@router.post("/solve")
+async def solve(problem: ProblemCreate, request: Request):
+    """Recibe un problema y devuelve una solución generada.
+
+    Respuesta esperada por el frontend:
+    {
+      "id": "uuid",
+      "summary": "resumen breve",
+      "content": ["<p> paso 1 </p>", "<p> paso 2 </p>"],
+      "created_at": "iso timestamp"
+    }
+
+    Con ``Prefer: respond-async`` (o ``?async=1``) responde 202 con un
+    ``job_id`` y la solución queda en ``GET /jobs/{id}`` (ver trabajos.py).
+    """
+    if quiere_trabajo(request):
+        return await encolar_trabajo("solve", problem.model_dump())
+    return await solve_problem(problem)
+
+def parse_batch(body: bytes, content_type: str) -> List[Any]:
+    """Devuelve los elementos crudos del lote: un array JSON o NDJSON (una línea por problema)."""
+    try:
+        texto = body.decode("utf-8")
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="El cuerpo no está codificado en UTF-8")
+    if "ndjson" not in content_type and texto.lstrip().startswith("["):
+        try:
+            items = json.loads(texto)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="El cuerpo no es un array JSON válido")
+        if not isinstance(items, list):
+            raise HTTPException(status_code=400, detail="Se esperaba un array JSON")
+        return items
+    # NDJSON: cada línea se valida por separado, así una línea rota no tumba el lote
+    return [linea for linea in texto.splitlines() if linea.strip()]
+
+async def solve_batch_item(index: int, raw: Any) -> Dict[str, Any]:
+    try:
+        if isinstance(raw, str):
+            problem = ProblemCreate.model_validate_json(raw)
+        else:
+            problem = ProblemCreate.model_validate(raw)
+    except ValidationError as e:
+        return {"index": index, "ok": False, "error": e.errors(include_url=False, include_context=False)}
+    try:
+        return {"index": index, "ok": True, "solution": await solve_problem(problem)}
+    except Exception as e:
+        return {"index": index, "ok": False, "error": str(e)}
+
+async def stream_batch(items: List[Any]) -> AsyncIterator[str]:
+    """Resuelve con concurrencia acotada y emite cada resultado (NDJSON) según termina."""
+    semaforo = asyncio.Semaphore(BATCH_CONCURRENCY)
+    resultados: asyncio.Queue = asyncio.Queue()
+
+    async def trabajar(index: int, raw: Any):
+        try:
+            await resultados.put(await solve_batch_item(index, raw))
+        finally:
+            semaforo.release()
+
+    async def lanzar():
+        tareas = []
+        for index, raw in enumerate(items):
+            await semaforo.acquire()
+            tareas.append(asyncio.create_task(trabajar(index, raw)))
+        await asyncio.gather(*tareas)
+        await resultados.put(None)
+
+    productor = asyncio.create_task(lanzar())
+    try:
+        while True:
+            resultado = await resultados.get()
+            if resultado is None:
+                break
+            yield json.dumps(resultado, ensure_ascii=False) + "\n"
+    finally:
+        # Si el cliente se desconecta no se lanzan más elementos
+        productor.cancel()
+
+@router.post("/solve/batch")
+async def solve_batch(request: Request):
+    """Importación masiva: acepta NDJSON o un array JSON de ``ProblemCreate``.
+
+    Responde en streaming NDJSON, una línea por elemento en orden de
+    finalización: ``{"index", "ok", "solution"}`` o ``{"index", "ok": false, "error"}``.
+    """
+    items = parse_batch(await request.body(), request.headers.get("content-type", ""))
+    if len(items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Máximo {BATCH_MAX_ITEMS} elementos por lote")
+    return StreamingResponse(stream_batch(items), media_type="application/x-ndjson")
+
+@router.get("/solve/{solution_id}")
 async def get_solution(solution_id: str):
-    if solution_id not in SOLUTIONS:
+    sol = await asyncio.to_thread(obtener_almacen().obtener_solucion, solution_id)
+    if sol is None:
         raise HTTPException(status_code=404, detail="Solution not found")
-    return SOLUTIONS[solution_id]
+    return sol
+
+def etag_coincide(etag: str, if_none_match: str) -> bool:
+    """Comparación débil de If-None-Match: lista de ETags separados por comas o ``*``."""
+    etiquetas = [e.strip() for e in if_none_match.split(",")]
+    return "*" in etiquetas or any(e.removeprefix("W/") == etag for e in etiquetas)
+
+@router.get("/problems")
+async def list_problems(
+    request: Request,
+    response: Response,
+    limit: int = Query(PROBLEMS_PAGE_DEFAULT, ge=1, le=PROBLEMS_PAGE_MAX),
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+):
+    """Lista problemas (más recientes primero) paginada por cursor.
+
+    El cursor de la siguiente página va en la cabecera ``X-Next-Cursor`` (y en
+    ``Link``). El ETag cambia solo cuando se añaden problemas, así que los
+    dashboards que sondean con ``If-None-Match`` reciben un 304 barato.
+    """
+    if before and after:
+        raise HTTPException(status_code=400, detail="Use before o after, no ambos")
 
-@app.get("/problems")
-async def list_problems():
-    return PROBLEMS
+    almacen = obtener_almacen()
+    version = await asyncio.to_thread(almacen.version)
+    etag = '"' + hashlib.sha1(f"{version}:{limit}:{before}:{after}".encode()).hexdigest() + '"'
+    if etag_coincide(etag, request.headers.get("if-none-match", "")):
+        return Response(status_code=304, headers={"ETag": etag})
 
-@app.get("/")
+    try:
+        problemas, siguiente = await asyncio.to_thread(almacen.listar_problemas, limit, before, after)
+    except CursorInvalido:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+    response.headers["ETag"] = etag
+    if siguiente:
+        direccion = "after" if after else "before"
+        response.headers["X-Next-Cursor"] = siguiente
+        response.headers["Link"] = f'<{request.url.path}?limit={limit}&{direccion}={siguiente}>; rel="next"'
+    return problemas
+
+@router.get("/problems/similar")
+async def similar_problems(
+    q: str = Query(..., min_length=1, max_length=5000),
+    limit: int = Query(5, ge=1, le=50),
+    origen: Optional[str] = Query(None, pattern="^(solve|analisis)$"),
+):
+    """Problemas ya resueltos parecidos a ``q`` (índice FTS5, ver similares.py).
+
+    Cada resultado trae su ``similitud`` (0-1) y, para los de ``/solve``, el
+    ``ref`` con el que se consulta la solución completa en ``GET /solve/{id}``.
+    """
+    resultados = await asyncio.to_thread(obtener_indice().buscar, q, limit, origen)
+    return [vista_publica(r) for r in resultados]
+
+@router.get("/")
 async def root():
     return {"mensaje": "Backend IA disponible. Use POST /solve para generar soluciones."}
+
+# App independiente (uvicorn app.main:app); el servidor unificado (servidor.py) monta solo el router
+app = FastAPI()
+
+# Habilitar CORS para permitir el acceso desde el frontend
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],  # Permite cualquier origen (ajústalo en producción)
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+app.add_middleware(MiddlewareMetricas)
+app.include_router(router)
+app.include_router(router_trabajos)
+app.include_router(router_metricas)
@@ -0,0 +1,380 @@
+"""Motor simbólico (SymPy) para los problemas matemáticos de ``/solve``.
+
+El cálculo simbólico es CPU intensivo y a veces patológico (p.ej. integrales
+sin forma cerrada), así que nunca corre en el event loop: se envía a un pool
+acotado de procesos trabajadores. Si un trabajo supera su timeout, o la
+petición se cancela, se mata el proceso que lo ejecutaba y se arranca otro.
+
+Los resultados se memorizan por forma canónica de la expresión (``srepr`` de
+SymPy tras parsear), de modo que ``x^2 + 2x`` y ``2*x + x**2`` comparten
+entrada y un problema repetido se responde sin tocar el pool.
+"""
+import asyncio
+import html
+import multiprocessing
+import os
+import re
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+MATH_WORKERS = int(os.getenv("MATH_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+MATH_TIMEOUT = float(os.getenv("MATH_TIMEOUT", "10"))
+MATH_MEMO_MAX = int(os.getenv("MATH_MEMO_MAX", "2048"))
+# Enunciados más largos no se interpretan (se devuelven los pasos generales):
+# la extracción y la validación corren en el event loop
+MATH_MAX_CHARS = int(os.getenv("MATH_MAX_CHARS", "1000"))
+
+
+class ErrorSimbolico(Exception):
+    """La expresión no se pudo interpretar o resolver."""
+
+
+class TiempoAgotado(ErrorSimbolico):
+    """El cálculo superó el tiempo máximo permitido."""
+
+
+# --- Interpretación del enunciado (proceso principal, solo texto) ---
+
+_INSTRUCCIONES = re.compile(
+    r"\b(calcula(r)?|resuelve|resolver|halla(r)?|encuentra|obt[eé]n|determina(r)?|eval[uú]a(r)?|"
+    r"simplifica(r)?|integra(r)?|integral(es)?|indefinida|deriva(r)?|derivada|primera|ecuaci[oó]n|"
+    r"expresi[oó]n|funci[oó]n|la|el|los|las|de|del|con|al|para|"
+    r"solve|integrate|integral|differentiate|derivative|simplify|equation|find|compute|"
+    r"of|the|with|to|for)\b",
+    re.IGNORECASE,
+)
+_PERMITIDOS = re.compile(r"^[0-9A-Za-z_+\-*/^().,=\s]+$")
+# Únicos nombres de más de una letra que admite una expresión; el resto (una
+# palabra que sobró del enunciado) hace que se devuelvan los pasos generales
+FUNCIONES = {
+    "sin": "sin", "sen": "sin", "cos": "cos", "tan": "tan", "cot": "cot", "sec": "sec", "csc": "csc",
+    "asin": "asin", "acos": "acos", "atan": "atan", "sinh": "sinh", "cosh": "cosh", "tanh": "tanh",
+    "exp": "exp", "log": "log", "ln": "log", "sqrt": "sqrt", "raiz": "sqrt", "abs": "Abs",
+}
+CONSTANTES = {"pi": "pi", "e": "E"}
+_IDENTIFICADOR = re.compile(r"[A-Za-z_]+")
+_TOKEN = re.compile(r"[A-Za-z_]+|[0-9.]+|\s+|.")
+
+
+def detectar_operacion(texto: str) -> str:
+    t = texto.lower()
+    if "deriv" in t or "d/d" in t:
+        return "derivar"
+    if "integr" in t or "∫" in t:
+        return "integrar"
+    if "=" in t:
+        return "resolver"
+    return "simplificar"
+
+
+def extraer_expresion(texto: str) -> Tuple[str, Optional[str]]:
+    """Separa la expresión matemática del enunciado y detecta la variable."""
+    t = texto.replace("∫", " ").replace("√", "sqrt").replace("π", "pi")
+    t = t.replace("²", "^2").replace("³", "^3")
+    variable = None
+    m = (
+        re.search(r"(?:respecto (?:a|de)|para|for) ([a-z])\b", t, re.IGNORECASE)
+        or re.search(r"d/d([a-z])\b", t)
+    )
+    if m:
+        variable = m.group(1)
+    t = re.sub(r"(?:respecto (?:a|de)|para|for) [a-z]\b", " ", t, flags=re.IGNORECASE)
+    t = re.sub(r"d/d[a-z]\b", " ", t)
+    m = re.search(r"\bd([a-z])\s*[.,;]?\s*$", t)
+    if m:
+        variable = variable or m.group(1)
+        t = t[: m.start()]
+    if ":" in t:
+        t = t.split(":", 1)[1]
+    t = _INSTRUCCIONES.sub(" ", t)
+    t = re.sub(r"\s+", " ", t).strip(" .,;")
+    return t, variable
+
+
+def validar_expresion(expresion: str) -> None:
+    """Rechaza lo que no es una expresión: palabras sueltas y nombres desconocidos.
+
+    Con multiplicación implícita "suma de 2 y 3" sería ``6*a*m*s*u*y``; solo se
+    admiten variables de una letra y las funciones/constantes de FUNCIONES y
+    CONSTANTES.
+    """
+    if not expresion or not _PERMITIDOS.match(expresion) or "__" in expresion:
+        raise ErrorSimbolico(f"Expresión no reconocida: {expresion!r}")
+    for nombre in _IDENTIFICADOR.findall(expresion):
+        if len(nombre) > 1 and nombre not in FUNCIONES and nombre not in CONSTANTES:
+            raise ErrorSimbolico(f"Expresión no reconocida: {nombre!r} no es una función ni una variable")
+    # Dos operandos separados solo por espacios ("2 y 3", "x^2 y") son texto, no un
+    # producto; salvo "sen x" (aplicación), "e^x sin(x)" o "(x+1) (x-1)"
+    tokens = _TOKEN.findall(expresion)
+    for i in range(1, len(tokens) - 1):
+        if not tokens[i].isspace():
+            continue
+        izquierda, derecha = tokens[i - 1], tokens[i + 1]
+        if not (izquierda == ")" or _operando(izquierda)) or not (derecha == "(" or _operando(derecha)):
+            continue
+        if izquierda in FUNCIONES or derecha in FUNCIONES or (izquierda == ")" and derecha == "("):
+            continue
+        raise ErrorSimbolico(f"Expresión no reconocida: {expresion!r}")
+
+
+def _operando(token: str) -> bool:
+    return token[0].isalnum() or token[0] in "_."
+
+
+def _clave_texto(operacion: str, expresion: str, variable: Optional[str]) -> str:
+    return f"{operacion}|{variable or ''}|{re.sub(r'[ ]+', '', expresion)}"
+
+
+# --- Código que corre en los procesos trabajadores ---
+
+def _parsear(expresion: str):
+    import sympy
+    from sympy.parsing.sympy_parser import (
+        convert_xor,
+        implicit_multiplication_application,
+        parse_expr,
+        standard_transformations,
+    )
+
+    # parse_expr evalúa Python: solo aceptamos caracteres y nombres de una expresión
+    validar_expresion(expresion)
+    transformaciones = standard_transformations + (implicit_multiplication_application, convert_xor)
+    # Espacio de nombres mínimo y sin builtins (parse_expr añade open, exec... y
+    # todo sympy por defecto): lo que generan las transformaciones y nada más
+    globales = {"__builtins__": {}}
+    globales.update({k: getattr(sympy, k) for k in ("Integer", "Float", "Rational", "Symbol", "Function")})
+    nombres = {k: getattr(sympy, v) for k, v in {**FUNCIONES, **CONSTANTES}.items()}
+    for letra in "abcdfghjklmnopqrstuvwxyz":
+        nombres.setdefault(letra, sympy.Symbol(letra))
+    try:
+        return parse_expr(expresion, local_dict=nombres, global_dict=globales, transformations=transformaciones)
+    except Exception as e:
+        raise ErrorSimbolico(f"Expresión no reconocida: {expresion!r}") from e
+
+
+def _canonicalizar(operacion: str, expresion: str, variable: Optional[str]) -> Tuple[str, str, str]:
+    from sympy import Symbol, srepr
+
+    if operacion == "resolver":
+        izquierda, derecha = expresion.split("=", 1)
+        expr = _parsear(izquierda) - _parsear(derecha)
+    else:
+        expr = _parsear(expresion)
+    if variable:
+        var = Symbol(variable)
+    else:
+        libres = sorted(expr.free_symbols, key=lambda s: (s.name != "x", s.name))
+        var = libres[0] if libres else Symbol("x")
+    return operacion, var.name, srepr(expr)
+
+
+def _codigo(expr) -> str:
+    from sympy import sstr
+
+    return f"<code>{html.escape(sstr(expr))}</code>"
+
+
+def _resolver(operacion: str, variable: str, forma: str) -> List[str]:
+    from sympy import Eq, Integral, Symbol, diff, integrate, simplify, solve, sympify
+
+    x = Symbol(variable)
+    expr = sympify(forma)
+    pasos = [f"<p>1) Expresión interpretada: {_codigo(expr)} (variable {variable}).</p>"]
+    simple = simplify(expr)
+    if simple != expr:
+        pasos.append(f"<p>{len(pasos) + 1}) Simplificación: {_codigo(simple)}.</p>")
+
+    if operacion == "integrar":
+        resultado = integrate(simple, x)
+        if resultado.has(Integral):
+            pasos.append(f"<p>{len(pasos) + 1}) La integral no tiene primitiva en términos de funciones elementales.</p>")
+            return pasos
+        pasos.append(f"<p>{len(pasos) + 1}) Integración respecto a {variable}: {_codigo(resultado)} + C.</p>")
+        ok = simplify(diff(resultado, x) - expr) == 0
+        pasos.append(f"<p>{len(pasos) + 1}) Verificación: d/d{variable} del resultado {'coincide' if ok else 'no coincide'} con el integrando.</p>")
+    elif operacion == "derivar":
+        resultado = diff(expr, x)
+        pasos.append(f"<p>{len(pasos) + 1}) Derivada respecto a {variable}: {_codigo(resultado)}.</p>")
+        final = simplify(resultado)
+        if final != resultado:
+            pasos.append(f"<p>{len(pasos) + 1}) Resultado simplificado: {_codigo(final)}.</p>")
+    elif operacion == "resolver":
+        soluciones = solve(Eq(expr, 0), x)
+        if not soluciones:
+            pasos.append(f"<p>{len(pasos) + 1}) La ecuación no tiene solución para {variable}.</p>")
+            return pasos
+        lista = ", ".join(f"{variable} = {_codigo(s)}" for s in soluciones)
+        pasos.append(f"<p>{len(pasos) + 1}) Soluciones: {lista}.</p>")
+        ok = all(simplify(expr.subs(x, s)) == 0 for s in soluciones)
+        pasos.append(f"<p>{len(pasos) + 1}) Verificación por sustitución: {'correcta' if ok else 'no concluyente'}.</p>")
+    else:
+        pasos.append(f"<p>{len(pasos) + 1}) Forma factorizada: {_codigo(simple.factor())}.</p>")
+        pasos.append(f"<p>{len(pasos) + 1}) Forma expandida: {_codigo(simple.expand())}.</p>")
+    return pasos
+
+
+_FUNCIONES = {"canonicalizar": _canonicalizar, "resolver": _resolver}
+
+
+def _bucle_trabajador(conn) -> None:
+    import sympy  # noqa: F401  (precarga: el primer trabajo no paga la importación)
+
+    while True:
+        try:
+            nombre, args = conn.recv()
+        except EOFError:
+            return
+        try:
+            conn.send((True, _FUNCIONES[nombre](*args)))
+        except Exception as e:
+            conn.send((False, str(e)))
+
+
+# --- Pool de procesos (proceso principal) ---
+
+class _Trabajador:
+    def __init__(self, ctx):
+        self.conn, hijo = ctx.Pipe()
+        self.proceso = ctx.Process(target=_bucle_trabajador, args=(hijo,), daemon=True)
+        self.proceso.start()
+        hijo.close()
+
+    def terminar(self) -> None:
+        self.proceso.kill()
+        self.proceso.join(1)
+        self.conn.close()
+
+
+class PoolSimbolico:
+    """Pool acotado de procesos con timeout y cancelación reales por trabajo."""
+
+    def __init__(self, procesos: int = MATH_WORKERS, timeout: float = MATH_TIMEOUT):
+        self.procesos = procesos
+        self.timeout = timeout
+        # "spawn": no hereda hilos ni sockets del servidor (y funciona igual en Windows)
+        self._ctx = multiprocessing.get_context("spawn")
+        self._libres: Optional[asyncio.Queue] = None
+        self._todos: List[_Trabajador] = []
+        self._reposiciones: set = set()
+
+    def _arrancar(self) -> _Trabajador:
+        trabajador = _Trabajador(self._ctx)
+        self._todos.append(trabajador)
+        return trabajador
+
+    async def ejecutar(self, nombre: str, *args, timeout: Optional[float] = None):
+        if self._libres is None:
+            self._libres = asyncio.Queue()
+            for _ in range(self.procesos):
+                self._libres.put_nowait(self._arrancar())
+
+        trabajador = await self._libres.get()
+        resultado = None
+        try:
+            try:
+                trabajador.conn.send((nombre, args))
+                listo = await asyncio.to_thread(trabajador.conn.poll, timeout or self.timeout)
+                if not listo:
+                    raise TiempoAgotado("El cálculo simbólico superó el tiempo límite")
+                resultado = trabajador.conn.recv()
+            except (EOFError, OSError) as e:
+                raise ErrorSimbolico("El proceso de cálculo terminó inesperadamente") from e
+        finally:
+            if resultado is None:
+                # Timeout, cancelación o proceso caído: se reemplaza el trabajador en
+                # segundo plano (matar y arrancar un proceso bloquea)
+                tarea = asyncio.get_running_loop().create_task(self._reponer(trabajador))
+                self._reposiciones.add(tarea)
+                tarea.add_done_callback(self._reposiciones.discard)
+            else:
+                self._libres.put_nowait(trabajador)
+
+        ok, valor = resultado
+        if not ok:
+            raise ErrorSimbolico(valor)
+        return valor
+
+    async def _reponer(self, trabajador: _Trabajador) -> None:
+        libres = self._libres
+        self._todos.remove(trabajador)
+        await asyncio.to_thread(trabajador.terminar)
+        nuevo = await asyncio.to_thread(_Trabajador, self._ctx)
+        if self._libres is not libres:
+            # El pool se cerró mientras tanto
+            await asyncio.to_thread(nuevo.terminar)
+            return
+        self._todos.append(nuevo)
+        libres.put_nowait(nuevo)
+
+    def cerrar(self) -> None:
+        for trabajador in self._todos:
+            trabajador.terminar()
+        self._todos = []
+        self._libres = None
+
+
+class MotorMatematico:
+    """Interpreta el enunciado, consulta la memoria y delega el cálculo al pool."""
+
+    def __init__(self, pool: Optional[PoolSimbolico] = None, max_memo: int = MATH_MEMO_MAX):
+        self.pool = pool or PoolSimbolico()
+        self.max_memo = max_memo
+        self._por_texto: "OrderedDict[str, Tuple[str, str, str]]" = OrderedDict()
+        self._por_forma: "OrderedDict[Tuple[str, str, str], List[str]]" = OrderedDict()
+
+    def _recordar(self, memo: OrderedDict, clave, valor) -> None:
+        memo[clave] = valor
+        memo.move_to_end(clave)
+        while len(memo) > self.max_memo:
+            memo.popitem(last=False)
+
+    async def resolver(self, enunciado: str) -> List[str]:
+        if len(enunciado) > MATH_MAX_CHARS:
+            raise ErrorSimbolico(f"Enunciado demasiado largo para el motor simbólico (máx. {MATH_MAX_CHARS} caracteres)")
+        operacion = detectar_operacion(enunciado)
+        expresion, variable = extraer_expresion(enunciado)
+        # Lo que no es una expresión se rechaza sin pasar por el pool
+        validar_expresion(expresion.replace("=", "+", 1) if operacion == "resolver" else expresion)
+        clave_texto = _clave_texto(operacion, expresion, variable)
+
+        forma = self._por_texto.get(clave_texto)
+        if forma is None:
+            forma = tuple(await self.pool.ejecutar("canonicalizar", operacion, expresion, variable))
+            self._recordar(self._por_texto, clave_texto, forma)
+
+        pasos = self._por_forma.get(forma)
+        if pasos is None:
+            pasos = await self.pool.ejecutar("resolver", *forma)
+            self._recordar(self._por_forma, forma, pasos)
+        else:
+            self._por_forma.move_to_end(forma)
+        return pasos
+
+    def cerrar(self) -> None:
+        self.pool.cerrar()
+
+
+_motor: Optional[MotorMatematico] = None
+
+
+def sympy_disponible() -> bool:
+    try:
+        import importlib.util
+
+        return importlib.util.find_spec("sympy") is not None
+    except Exception:
+        return False
+
+
+def obtener_motor() -> MotorMatematico:
+    global _motor
+    if _motor is None:
+        _motor = MotorMatematico()
+    return _motor
+
+
+def cerrar_motor() -> None:
+    global _motor
+    if _motor is not None:
+        _motor.cerrar()
+    _motor = None
@@ -0,0 +1,339 @@
+"""Métricas del servidor en formato de texto de Prometheus (``GET /metrics``).
+
+Registro propio y mínimo (contadores, indicadores e histogramas con
+etiquetas, seguros entre hilos) para no añadir dependencias. Las métricas
+son por proceso: con varios workers cada uno expone las suyas y Prometheus
+agrega por instancia.
+
+``MiddlewareMetricas`` (ASGI puro) mide cada petición HTTP por plantilla de
+ruta (``/solve/{solution_id}``, no la URL concreta) y, si se activa, perfila
+con cProfile las peticiones lentas:
+
+    PROFILE_SAMPLE_RATE   fracción de peticiones perfiladas (0 = nunca)
+    PROFILE_ALLOW_HEADER  "1" para aceptar la cabecera ``X-Profile: 1``
+    PROFILE_SLOW_SECONDS  solo se guarda el perfil si la petición tarda más
+
+Los perfiles se escriben en ``<AUDIT_DIR>/perfiles/``, junto al log de
+auditoría.
+"""
+import asyncio
+import cProfile
+import io
+import os
+import pstats
+import random
+import re
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_ALLOW_HEADER = os.getenv("PROFILE_ALLOW_HEADER", "0") == "1"
+PROFILE_SLOW_SECONDS = float(os.getenv("PROFILE_SLOW_SECONDS", "1.0"))
+PROFILE_TOP = int(os.getenv("PROFILE_TOP", "40"))
+
+BUCKETS_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Trabajos en segundo plano: precisamente los que pasan del minuto
+BUCKETS_TRABAJO = (0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 900, 3600)
+BUCKETS_ES = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+
+
+def _escapar(valor: str) -> str:
+    return valor.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _formatear_etiquetas(nombres: Sequence[str], valores: Sequence[str], extra: str = "") -> str:
+    partes = [f'{n}="{_escapar(v)}"' for n, v in zip(nombres, valores)]
+    if extra:
+        partes.append(extra)
+    return "{" + ",".join(partes) + "}" if partes else ""
+
+
+def _numero(valor: float) -> str:
+    if valor == float("inf"):
+        return "+Inf"
+    return repr(float(valor)) if not float(valor).is_integer() else str(int(valor))
+
+
+class _Metrica:
+    tipo = ""
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: Sequence[str] = ()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._lock = threading.Lock()
+        self._valores: Dict[Tuple[str, ...], object] = {}
+
+    def _clave(self, etiquetas: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(etiquetas.get(n, "")) for n in self.etiquetas)
+
+    def exponer(self) -> List[str]:
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} {self.tipo}"]
+        with self._lock:
+            valores = list(self._valores.items())
+        for clave, valor in sorted(valores):
+            lineas.extend(self._lineas(clave, valor))
+        return lineas
+
+    def _lineas(self, clave, valor) -> List[str]:
+        return [f"{self.nombre}{_formatear_etiquetas(self.etiquetas, clave)} {_numero(valor)}"]
+
+
+class Contador(_Metrica):
+    tipo = "counter"
+
+    def inc(self, valor: float = 1, **etiquetas: str) -> None:
+        clave = self._clave(etiquetas)
+        with self._lock:
+            self._valores[clave] = self._valores.get(clave, 0) + valor
+
+
+class Indicador(_Metrica):
+    tipo = "gauge"
+
+    def inc(self, valor: float = 1, **etiquetas: str) -> None:
+        clave = self._clave(etiquetas)
+        with self._lock:
+            self._valores[clave] = self._valores.get(clave, 0) + valor
+
+    def dec(self, valor: float = 1, **etiquetas: str) -> None:
+        self.inc(-valor, **etiquetas)
+
+    def set(self, valor: float, **etiquetas: str) -> None:
+        with self._lock:
+            self._valores[self._clave(etiquetas)] = valor
+
+
+class _Cronometro:
+    __slots__ = ("_histograma", "_etiquetas", "_inicio")
+
+    def __init__(self, histograma: "Histograma", etiquetas: Dict[str, str]):
+        self._histograma = histograma
+        self._etiquetas = etiquetas
+
+    def __enter__(self):
+        self._inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._histograma.observar(time.perf_counter() - self._inicio, **self._etiquetas)
+        return False
+
+
+class Histograma(_Metrica):
+    tipo = "histogram"
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: Sequence[str] = (), buckets: Sequence[float] = BUCKETS_LATENCIA):
+        super().__init__(nombre, ayuda, etiquetas)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observar(self, valor: float, **etiquetas: str) -> None:
+        clave = self._clave(etiquetas)
+        with self._lock:
+            estado = self._valores.get(clave)
+            if estado is None:
+                # [conteos por bucket (no acumulados), suma, total]
+                estado = self._valores[clave] = [[0] * len(self.buckets), 0.0, 0]
+            for i, limite in enumerate(self.buckets):
+                if valor <= limite:
+                    estado[0][i] += 1
+                    break
+            estado[1] += valor
+            estado[2] += 1
+
+    def medir(self, **etiquetas: str) -> _Cronometro:
+        """``with histograma.medir(op="x"):`` observa la duración del bloque."""
+        return _Cronometro(self, etiquetas)
+
+    def exponer(self) -> List[str]:
+        # Copia bajo el lock: los contadores internos son listas mutables
+        with self._lock:
+            copia = {clave: (list(e[0]), e[1], e[2]) for clave, e in self._valores.items()}
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} {self.tipo}"]
+        for clave, (conteos, suma, total) in sorted(copia.items()):
+            acumulado = 0
+            for limite, conteo in zip(self.buckets, conteos):
+                acumulado += conteo
+                etiquetas = _formatear_etiquetas(self.etiquetas, clave, f'le="{_numero(limite)}"')
+                lineas.append(f"{self.nombre}_bucket{etiquetas} {acumulado}")
+            etiquetas = _formatear_etiquetas(self.etiquetas, clave)
+            lineas.append(f"{self.nombre}_sum{etiquetas} {_numero(suma)}")
+            lineas.append(f"{self.nombre}_count{etiquetas} {total}")
+        return lineas
+
+
+class Registro:
+    def __init__(self):
+        self._metricas: List[_Metrica] = []
+
+    def registrar(self, metrica: _Metrica) -> _Metrica:
+        self._metricas.append(metrica)
+        return metrica
+
+    def exposicion(self) -> str:
+        lineas: List[str] = []
+        for metrica in self._metricas:
+            lineas.extend(metrica.exponer())
+        return "\n".join(lineas) + "\n"
+
+
+REGISTRO = Registro()
+
+# --- HTTP ---
+HTTP_PETICIONES = REGISTRO.registrar(Contador(
+    "http_requests_total", "Peticiones HTTP atendidas.", ("method", "route", "status")))
+HTTP_DURACION = REGISTRO.registrar(Histograma(
+    "http_request_duration_seconds", "Duración de las peticiones HTTP (hasta el último byte).", ("method", "route")))
+HTTP_EN_CURSO = REGISTRO.registrar(Indicador(
+    "http_requests_in_flight", "Peticiones HTTP en curso."))
+
+# --- LLM ---
+LLM_DURACION = REGISTRO.registrar(Histograma(
+    "llm_request_duration_seconds", "Latencia de las llamadas al proveedor LLM (por intento).",
+    ("modelo", "modo", "resultado")))
+LLM_PRIMER_TOKEN = REGISTRO.registrar(Histograma(
+    "llm_time_to_first_token_seconds", "Tiempo hasta el primer fragmento en llamadas en streaming.", ("modelo",)))
+LLM_TOKENS = REGISTRO.registrar(Contador(
+    "llm_tokens_total", "Tokens consumidos según el campo usage del proveedor.", ("modelo", "tipo")))
+LLM_ERRORES = REGISTRO.registrar(Contador(
+    "llm_errors_total", "Errores de llamadas al LLM por tipo de excepción.", ("modelo", "tipo")))
+LLM_COBERTURAS = REGISTRO.registrar(Contador(
+    "llm_hedged_requests_total", "Peticiones duplicadas (cobertura) lanzadas a un segundo backend.", ("backend",)))
+LLM_BACKEND_RESULTADOS = REGISTRO.registrar(Contador(
+    "llm_backend_calls_total", "Llamadas del enrutador por backend y resultado (ok, error, cancelada).", ("backend", "resultado")))
+LLM_CIRCUITO_ABIERTO = REGISTRO.registrar(Indicador(
+    "llm_circuit_open", "1 si el circuito del backend está abierto (no recibe tráfico).", ("backend",)))
+
+# --- Admisión (cola delante del LLM) ---
+ADMISION_ESPERA = REGISTRO.registrar(Histograma(
+    "llm_queue_wait_seconds", "Tiempo en cola antes de obtener turno para llamar al LLM.", ("prioridad",)))
+ADMISION_COLA = REGISTRO.registrar(Indicador(
+    "llm_queue_depth", "Peticiones esperando turno para el LLM."))
+ADMISION_EN_CURSO = REGISTRO.registrar(Indicador(
+    "llm_admitted_in_flight", "Peticiones con turno asignado llamando al LLM."))
+ADMISION_RECHAZOS = REGISTRO.registrar(Contador(
+    "admission_rejections_total", "Peticiones rechazadas con 429 por motivo.", ("motivo", "prioridad")))
+ADMISION_DESCONECTADAS = REGISTRO.registrar(Contador(
+    "admission_dropped_disconnected_total", "Peticiones retiradas de la cola porque el cliente se desconectó."))
+
+# --- Trabajos en segundo plano ---
+TRABAJOS_ESPERA = REGISTRO.registrar(Histograma(
+    "jobs_queue_wait_seconds", "Tiempo desde que se encola un trabajo hasta que un trabajador lo reclama.", ("tipo",), BUCKETS_TRABAJO))
+TRABAJOS_DURACION = REGISTRO.registrar(Histograma(
+    "jobs_duration_seconds", "Duración de la ejecución de los trabajos.", ("tipo", "estado"), BUCKETS_TRABAJO))
+TRABAJOS_TERMINADOS = REGISTRO.registrar(Contador(
+    "jobs_finished_total", "Trabajos terminados por tipo y estado final.", ("tipo", "estado")))
+TRABAJOS_EN_CURSO = REGISTRO.registrar(Indicador(
+    "jobs_running", "Trabajos ejecutándose en este proceso."))
+
+# --- E/S ---
+AUDITORIA_ESCRITURA = REGISTRO.registrar(Histograma(
+    "audit_write_duration_seconds", "Duración de cada escritura por lotes del log de auditoría.", (), BUCKETS_ES))
+AUDITORIA_REGISTROS = REGISTRO.registrar(Contador(
+    "audit_records_written_total", "Registros de auditoría escritos en disco."))
+AUDITORIA_DESCARTADOS = REGISTRO.registrar(Contador(
+    "audit_records_dropped_total", "Registros de auditoría perdidos (cola llena o error de escritura).", ("motivo",)))
+ALMACEN_DURACION = REGISTRO.registrar(Histograma(
+    "storage_operation_duration_seconds", "Duración de las operaciones del almacén SQLite.", ("operacion",), BUCKETS_ES))
+
+
+def registrar_uso_llm(modelo: str, usage) -> None:
+    if usage is None:
+        return
+    LLM_TOKENS.inc(getattr(usage, "prompt_tokens", 0) or 0, modelo=modelo, tipo="prompt")
+    LLM_TOKENS.inc(getattr(usage, "completion_tokens", 0) or 0, modelo=modelo, tipo="completion")
+
+
+# --- Middleware y perfilado ---
+
+_perfilando = threading.Lock()
+
+
+def _quiere_perfil(scope) -> bool:
+    if PROFILE_ALLOW_HEADER:
+        for nombre, valor in scope.get("headers", ()):
+            if nombre == b"x-profile" and valor in (b"1", b"true"):
+                return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def _ruta(scope) -> str:
+    # FastAPI deja la ruta resuelta en el scope; sin ella (404) se agrupa todo
+    # en una sola serie para no disparar la cardinalidad
+    ruta = scope.get("route")
+    return getattr(ruta, "path", None) or "sin_ruta"
+
+
+def _guardar_perfil(perfil: cProfile.Profile, metodo: str, ruta: str, duracion: float) -> str:
+    # Import diferido: auditoria importa este módulo para medir sus escrituras
+    from .auditoria import AUDIT_DIR
+
+    directorio = os.path.join(AUDIT_DIR, "perfiles")
+    os.makedirs(directorio, exist_ok=True)
+    slug = re.sub(r"[^A-Za-z0-9]+", "_", ruta).strip("_") or "raiz"
+    destino = os.path.join(directorio, f"{datetime.now().strftime('%Y%m%dT%H%M%S%f')}_{metodo}_{slug}.txt")
+    salida = io.StringIO()
+    salida.write(f"{metodo} {ruta}  {duracion * 1000:.1f} ms\n\n")
+    estadisticas = pstats.Stats(perfil, stream=salida)
+    estadisticas.sort_stats("cumulative").print_stats(PROFILE_TOP)
+    with open(destino, "w", encoding="utf-8") as f:
+        f.write(salida.getvalue())
+    return destino
+
+
+class MiddlewareMetricas:
+    """Latencia, estado y concurrencia por ruta; perfil cProfile opcional.
+
+    cProfile mide el hilo del event loop mientras dura la petición: el perfil
+    incluye las demás corrutinas que se ejecuten a la vez, pero no el trabajo
+    enviado al threadpool. Solo se perfila una petición a la vez.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        estado = {"status": 500}
+
+        async def enviar(mensaje):
+            if mensaje["type"] == "http.response.start":
+                estado["status"] = mensaje["status"]
+            await send(mensaje)
+
+        perfil: Optional[cProfile.Profile] = None
+        if _quiere_perfil(scope) and _perfilando.acquire(blocking=False):
+            perfil = cProfile.Profile()
+            perfil.enable()
+
+        HTTP_EN_CURSO.inc()
+        inicio = time.perf_counter()
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            duracion = time.perf_counter() - inicio
+            HTTP_EN_CURSO.dec()
+            metodo, ruta = scope["method"], _ruta(scope)
+            HTTP_DURACION.observar(duracion, method=metodo, route=ruta)
+            HTTP_PETICIONES.inc(method=metodo, route=ruta, status=str(estado["status"]))
+            if perfil is not None:
+                perfil.disable()
+                _perfilando.release()
+                if duracion >= PROFILE_SLOW_SECONDS:
+                    await asyncio.to_thread(_guardar_perfil, perfil, metodo, ruta, duracion)
+
+
+router = APIRouter()
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def metricas():
+    return PlainTextResponse(REGISTRO.exposicion(), media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,312 @@
+"""Sesiones de análisis guiado (5 Porqués → Ishikawa → FMEA → conclusión).
+
+El problema se guarda una sola vez al crear la sesión y cada paso se añade
+al estado en el servidor, así el cliente no reenvía el contexto completo en
+cada llamada. Para los pasos con LLM el prompt tiene tamaño acotado:
+
+    [system]  instrucciones fijas
+    [user]    contexto del problema         <- prefijo estable de la sesión
+    [user]    resumen condensado de los pasos antiguos
+              + los últimos SESSION_RECENT_STEPS pasos completos
+              + la tarea del paso actual
+
+Al salir de la ventana de recientes, un paso se condensa en una línea del
+resumen; si el resumen supera SESSION_SUMMARY_CHARS se conservan la primera
+línea (el arranque de la cadena) y las más recientes. El prefijo idéntico en
+todos los pasos de una sesión además aprovecha el prompt caching del proveedor.
+
+Las sesiones viven en SQLite (compartidas entre workers) y caducan tras
+SESSION_TTL segundos sin actividad.
+"""
+import asyncio
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional
+from uuid import uuid4
+
+from .admision import identificar_cliente, obtener_planificador
+from .llm import SYSTEM_PROMPT, LLMError, obtener_cliente
+
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", os.path.join("data", "sesiones.db"))
+SESSION_TTL = float(os.getenv("SESSION_TTL", str(2 * 3600)))
+SESSION_RECENT_STEPS = int(os.getenv("SESSION_RECENT_STEPS", "3"))
+SESSION_SUMMARY_CHARS = int(os.getenv("SESSION_SUMMARY_CHARS", "1500"))
+SESSION_STEP_CHARS = int(os.getenv("SESSION_STEP_CHARS", "1200"))
+SESSION_FIELD_CHARS = int(os.getenv("SESSION_FIELD_CHARS", "1000"))
+# La tarea la escribe el cliente y va entera en cada prompt
+SESSION_TASK_CHARS = int(os.getenv("SESSION_TASK_CHARS", "500"))
+# Longitud de cada línea del resumen condensado
+LINEA_RESUMEN = 160
+INTERVALO_PURGA = 60.0
+
+TAREAS_POR_DEFECTO = {
+    "5 porques": "Formula el siguiente '¿por qué?' de la cadena y propón una respuesta probable en una frase.",
+    "ishikawa": "Clasifica las causas identificadas en categorías de Ishikawa (método, máquina, mano de obra, material, medición, entorno).",
+    "fmea": "Propón modos de fallo con severidad, ocurrencia y detección (1-10) para las causas identificadas.",
+    "conclusion": "Resume la causa raíz más probable y las acciones correctivas prioritarias.",
+}
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS sesiones (
+    id TEXT PRIMARY KEY,
+    problema TEXT NOT NULL,
+    resumen TEXT NOT NULL,
+    recientes TEXT NOT NULL,
+    pasos INTEGER NOT NULL,
+    creada REAL NOT NULL,
+    expira REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_sesiones_expira ON sesiones (expira);
+CREATE TABLE IF NOT EXISTS pasos_sesion (
+    sesion_id TEXT NOT NULL,
+    numero INTEGER NOT NULL,
+    metodo TEXT NOT NULL,
+    contenido TEXT NOT NULL,
+    ts REAL NOT NULL,
+    PRIMARY KEY (sesion_id, numero)
+);
+"""
+
+
+class SesionNoEncontrada(LookupError):
+    """La sesión no existe o ha caducado."""
+
+
+def _recortar(texto: str, limite: int) -> str:
+    texto = " ".join(str(texto).split())
+    return texto if len(texto) <= limite else texto[: limite - 1].rstrip() + "…"
+
+
+def condensar_paso(paso: Dict[str, Any]) -> str:
+    """Una línea por paso: método y primera frase del contenido."""
+    primera = re.split(r"(?<=[.!?])\s", " ".join(paso["contenido"].split()), maxsplit=1)[0]
+    return _recortar(f"{paso['numero']}. [{paso['metodo']}] {primera}", LINEA_RESUMEN)
+
+
+def plegar_en_resumen(resumen: Dict[str, Any], paso: Dict[str, Any], limite: int = SESSION_SUMMARY_CHARS) -> Dict[str, Any]:
+    lineas = resumen["lineas"] + [condensar_paso(paso)]
+    omitidos = resumen["omitidos"]
+    # Se conserva la primera línea (origen de la cadena) y se descartan las siguientes más antiguas
+    while len(lineas) > 2 and sum(len(l) + 1 for l in lineas) > limite:
+        del lineas[1]
+        omitidos += 1
+    return {"lineas": lineas, "omitidos": omitidos}
+
+
+def texto_resumen(resumen: Dict[str, Any]) -> str:
+    lineas = list(resumen["lineas"])
+    if resumen["omitidos"]:
+        lineas.insert(1, f"(… {resumen['omitidos']} pasos intermedios condensados)")
+    return "\n".join(lineas)
+
+
+def contexto_problema(problema: Dict[str, Any]) -> str:
+    campos = "\n".join(f"- {clave}: {_recortar(valor, SESSION_FIELD_CHARS)}" for clave, valor in problema.items())
+    return f"Contexto del problema en análisis:\n{campos}"
+
+
+def construir_mensajes_sesion(sesion: Dict[str, Any], tarea: str) -> List[Dict[str, str]]:
+    partes = []
+    if sesion["resumen"]["lineas"]:
+        partes.append("Resumen de los pasos anteriores:\n" + texto_resumen(sesion["resumen"]))
+    if sesion["recientes"]:
+        recientes = "\n\n".join(
+            f"Paso {p['numero']} [{p['metodo']}]:\n{p['contenido']}" for p in sesion["recientes"]
+        )
+        partes.append("Pasos más recientes:\n" + recientes)
+    partes.append(f"Tarea: {tarea}")
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": contexto_problema(sesion["problema"])},
+        {"role": "user", "content": "\n\n".join(partes)},
+    ]
+
+
+class AlmacenSesiones:
+    """Sesiones en SQLite con una conexión por hilo (igual que ``almacen.Almacen``)."""
+
+    def __init__(
+        self,
+        ruta: str = SESSION_DB_PATH,
+        ttl: float = SESSION_TTL,
+        recientes: int = SESSION_RECENT_STEPS,
+        limite_resumen: int = SESSION_SUMMARY_CHARS,
+    ):
+        self.ruta = ruta
+        self.ttl = ttl
+        self.max_recientes = recientes
+        self.limite_resumen = limite_resumen
+        directorio = os.path.dirname(ruta)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        self._local = threading.local()
+        self._ultima_purga = 0.0
+        conn = self._conn()
+        conn.executescript(ESQUEMA)
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # isolation_level=None: las transacciones se abren explícitamente con BEGIN IMMEDIATE
+            conn = sqlite3.connect(self.ruta, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _a_dict(fila: sqlite3.Row) -> Dict[str, Any]:
+        return {
+            "id": fila["id"],
+            "problema": json.loads(fila["problema"]),
+            "resumen": json.loads(fila["resumen"]),
+            "recientes": json.loads(fila["recientes"]),
+            "pasos": fila["pasos"],
+            "creada": fila["creada"],
+            "expira": fila["expira"],
+        }
+
+    def purgar(self, ahora: Optional[float] = None) -> int:
+        ahora = ahora or time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            caducadas = [f[0] for f in conn.execute("SELECT id FROM sesiones WHERE expira < ?", (ahora,))]
+            conn.executemany("DELETE FROM pasos_sesion WHERE sesion_id = ?", [(i,) for i in caducadas])
+            conn.executemany("DELETE FROM sesiones WHERE id = ?", [(i,) for i in caducadas])
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self._ultima_purga = ahora
+        return len(caducadas)
+
+    def crear(self, problema: Dict[str, Any]) -> Dict[str, Any]:
+        ahora = time.time()
+        if ahora - self._ultima_purga > INTERVALO_PURGA:
+            self.purgar(ahora)
+        sesion = {
+            "id": uuid4().hex,
+            "problema": problema,
+            "resumen": {"lineas": [], "omitidos": 0},
+            "recientes": [],
+            "pasos": 0,
+            "creada": ahora,
+            "expira": ahora + self.ttl,
+        }
+        self._conn().execute(
+            "INSERT INTO sesiones (id, problema, resumen, recientes, pasos, creada, expira) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                sesion["id"],
+                json.dumps(problema, ensure_ascii=False),
+                json.dumps(sesion["resumen"]),
+                "[]",
+                0,
+                ahora,
+                sesion["expira"],
+            ),
+        )
+        return sesion
+
+    def obtener(self, sesion_id: str) -> Optional[Dict[str, Any]]:
+        """Devuelve la sesión (renovando su TTL) o None si no existe o ha caducado."""
+        ahora = time.time()
+        conn = self._conn()
+        conn.execute(
+            "UPDATE sesiones SET expira = ? WHERE id = ? AND expira >= ?", (ahora + self.ttl, sesion_id, ahora)
+        )
+        fila = conn.execute("SELECT * FROM sesiones WHERE id = ? AND expira >= ?", (sesion_id, ahora)).fetchone()
+        return self._a_dict(fila) if fila else None
+
+    def agregar_paso(self, sesion_id: str, metodo: str, contenido: str) -> Optional[Dict[str, Any]]:
+        """Añade un paso y pliega en el resumen los que salen de la ventana de recientes."""
+        ahora = time.time()
+        conn = self._conn()
+        # BEGIN IMMEDIATE: dos workers no pueden leer-modificar-escribir la misma sesión a la vez
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            fila = conn.execute("SELECT * FROM sesiones WHERE id = ? AND expira >= ?", (sesion_id, ahora)).fetchone()
+            if fila is None:
+                conn.execute("ROLLBACK")
+                return None
+            sesion = self._a_dict(fila)
+            paso = {"numero": sesion["pasos"] + 1, "metodo": metodo, "contenido": _recortar(contenido, SESSION_STEP_CHARS)}
+            recientes = sesion["recientes"] + [paso]
+            resumen = sesion["resumen"]
+            while len(recientes) > self.max_recientes:
+                resumen = plegar_en_resumen(resumen, recientes.pop(0), self.limite_resumen)
+            conn.execute(
+                "INSERT INTO pasos_sesion (sesion_id, numero, metodo, contenido, ts) VALUES (?, ?, ?, ?, ?)",
+                (sesion_id, paso["numero"], metodo, contenido, ahora),
+            )
+            conn.execute(
+                "UPDATE sesiones SET resumen = ?, recientes = ?, pasos = ?, expira = ? WHERE id = ?",
+                (
+                    json.dumps(resumen, ensure_ascii=False),
+                    json.dumps(recientes, ensure_ascii=False),
+                    paso["numero"],
+                    ahora + self.ttl,
+                    sesion_id,
+                ),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        sesion.update(resumen=resumen, recientes=recientes, pasos=paso["numero"], expira=ahora + self.ttl)
+        return sesion
+
+    def historial(self, sesion_id: str) -> List[Dict[str, Any]]:
+        filas = self._conn().execute(
+            "SELECT numero, metodo, contenido, ts FROM pasos_sesion WHERE sesion_id = ? ORDER BY numero", (sesion_id,)
+        ).fetchall()
+        return [dict(f) for f in filas]
+
+
+_sesiones: Optional[AlmacenSesiones] = None
+
+
+def obtener_sesiones() -> AlmacenSesiones:
+    global _sesiones
+    if _sesiones is None:
+        _sesiones = AlmacenSesiones()
+    return _sesiones
+
+
+async def sugerir_en_sesion(
+    sesion_id: str,
+    metodo: str = "5 porques",
+    tarea: Optional[str] = None,
+    conexion=None,
+) -> AsyncIterator[str]:
+    """Paso con LLM en streaming sobre una sesión; la respuesta se guarda como paso ``ia:<metodo>``.
+
+    Pasa por el planificador de admisión igual que los endpoints HTTP (puede
+    lanzar ``Rechazado``). ``conexion`` (Request o WebSocket) identifica al
+    cliente para las cuotas. Sin cliente LLM falla igual que
+    ``/sesiones/{id}/analizar`` y una ``tarea`` de más de SESSION_TASK_CHARS
+    caracteres lanza ValueError.
+    """
+    if tarea is not None and len(tarea) > SESSION_TASK_CHARS:
+        raise ValueError(f"La tarea admite como máximo {SESSION_TASK_CHARS} caracteres")
+    client = obtener_cliente()
+    if client is None:
+        raise LLMError("El cliente moderno de OpenAI no está disponible o no se encontró OPENAI_API_KEY.")
+    sesiones = obtener_sesiones()
+    sesion = await asyncio.to_thread(sesiones.obtener, sesion_id)
+    if sesion is None:
+        raise SesionNoEncontrada(sesion_id)
+    mensajes = construir_mensajes_sesion(sesion, tarea or TAREAS_POR_DEFECTO.get(metodo, TAREAS_POR_DEFECTO["5 porques"]))
+    cliente = identificar_cliente(conexion) if conexion is not None else "interno"
+    fragmentos = []
+    async with await obtener_planificador().adquirir(cliente):
+        async for delta in client.completar_stream(mensajes):
+            fragmentos.append(delta)
+            yield delta
+    await asyncio.to_thread(sesiones.agregar_paso, sesion_id, f"ia:{metodo}", "".join(fragmentos))
@@ -0,0 +1,417 @@
+"""Índice de problemas similares (SQLite FTS5, ranking BM25).
+
+Cada solución de /solve y cada análisis nuevo de /analizar-problema se añade
+al índice al terminar, así ``GET /problems/similar?q=`` encuentra problemas
+parecidos ya resueltos y el análisis puede devolver al instante una respuesta
+previa de alta confianza en lugar de llamar al LLM.
+
+El texto se normaliza antes de indexarlo (minúsculas, sin tildes, sin
+palabras vacías, plurales simples reducidos), con lo que el índice es más
+pequeño y la consulta no recorre las listas de términos sin contenido. El
+coste de una consulta FTS5 lo marca el BM25 de cada documento que casa, así
+que se buscan los términos más raros (hasta SIMILAR_MAX_POSTINGS documentos
+en total) o, si todos son frecuentes, la intersección de los menos
+frecuentes: la latencia no crece con el tamaño del índice.
+
+El ranking es el BM25 de FTS5; la ``similitud`` (Dice sobre los conjuntos de
+términos, 0-1) ordena los resultados. Para reutilizar una respuesta previa
+no basta con ella: los identificadores (números, códigos, letras sueltas
+como "Nave A") y las negaciones tienen que coincidir exactamente, y cada
+campo del problema (ubicación, síntoma...) debe alcanzar SIMILAR_THRESHOLD
+por separado. Las respuestas reutilizadas se auditan con ``previo`` y no se
+vuelven a indexar.
+
+Reindexar desde el log de auditoría y las soluciones guardadas:
+    python -m app.similares --reindexar
+"""
+import argparse
+import asyncio
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .metricas import ALMACEN_DURACION
+
+SIMILAR_DB_PATH = os.getenv("SIMILAR_DB_PATH", os.path.join("data", "similares.db"))
+# Similitud mínima para reutilizar una respuesta previa sin llamar al LLM
+SIMILAR_THRESHOLD = float(os.getenv("SIMILAR_THRESHOLD", "0.8"))
+# Reutilización por defecto en /analizar-problema (cada petición puede forzarla con ?reutilizar=0/1)
+SIMILAR_REUSE = os.getenv("SIMILAR_REUSE", "0") == "1"
+SIMILAR_MAX_TERMS = int(os.getenv("SIMILAR_MAX_TERMS", "12"))
+# Documentos (aprox.) que se puntúan con BM25 por consulta: acota la latencia
+SIMILAR_MAX_POSTINGS = int(os.getenv("SIMILAR_MAX_POSTINGS", "500"))
+# Términos distintos del texto de consulta que se tienen en cuenta
+MAX_TERMINOS_TEXTO = 200
+# Candidatos por BM25 sobre los que se calcula la similitud
+CANDIDATOS = 20
+# Texto de la respuesta devuelto por /problems/similar
+FRAGMENTO = 500
+
+PALABRAS_VACIAS = frozenset("""
+a al algo algun alguna algunas alguno algunos ante antes aqui asi aun cada como con
+contra cual cuando de del desde donde dos durante e el ella ellas ellos en entre era
+eran es esa esas ese eso esos esta estaba estaban estan estar este esto estos fue
+fueron ha habia han hasta hay la las le les lo los mas me mi mientras mismo muy nos
+o otra otras otro otros para pero poco por porque que quien se ser si sobre solo
+son su sus tambien tiene tienen todo todos tras tu un una unas uno unos ya y
+the of and or to in on for with is are was were be by at an it as from that this
+""".split())
+# Invierten el sentido del síntoma ("no arranca"): se indexan y deben coincidir para reutilizar
+NEGACIONES = frozenset("no ni nunca sin not never without".split())
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS documentos (
+    num INTEGER PRIMARY KEY,
+    clave TEXT NOT NULL UNIQUE,
+    origen TEXT NOT NULL,
+    ref TEXT,
+    problema TEXT NOT NULL,
+    respuesta TEXT NOT NULL,
+    terminos TEXT NOT NULL,
+    creado REAL NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS indice USING fts5(
+    terminos, content='documentos', content_rowid='num', tokenize='unicode61', detail='column'
+);
+-- Documentos que contienen cada término (lo que fts5vocab calcula recorriendo el índice)
+CREATE TABLE IF NOT EXISTS terminos (
+    termino TEXT PRIMARY KEY,
+    docs INTEGER NOT NULL
+) WITHOUT ROWID;
+"""
+
+
+def _sin_tildes(texto: str) -> str:
+    return "".join(c for c in unicodedata.normalize("NFKD", texto) if not unicodedata.combining(c))
+
+
+def _raiz(palabra: str) -> str:
+    # Plurales simples del español ("motores" -> "motor", "bombas" -> "bomba")
+    if len(palabra) > 4 and palabra.endswith("es"):
+        return palabra[:-2]
+    if len(palabra) > 3 and palabra.endswith("s"):
+        return palabra[:-1]
+    return palabra
+
+
+def normalizar(texto: str) -> List[str]:
+    """Términos del texto, en orden y con repeticiones (para el tf de BM25)."""
+    texto = _sin_tildes(texto)
+    terminos = []
+    for m in re.finditer(r"[A-Za-z0-9]+", texto):
+        palabra = m.group()
+        if len(palabra) == 1 and palabra.isalpha():
+            # Una mayúscula suelta detrás de otra palabra ("Nave A", "línea B") es un
+            # identificador; al principio de frase o en minúscula es "a", "y", "o"...
+            # Se mira hacia atrás desde la palabra: copiar el prefijo sería cuadrático
+            i = m.start() - 1
+            while i >= 0 and texto[i].isspace():
+                i -= 1
+            if palabra.isupper() and i >= 0 and texto[i].isalnum():
+                terminos.append(palabra.lower())
+            continue
+        palabra = palabra.lower()
+        if palabra not in PALABRAS_VACIAS:
+            terminos.append(_raiz(palabra))
+    return terminos
+
+
+def identificadores(terminos: Iterable[str]) -> frozenset:
+    """Términos que distinguen un problema de otro casi igual: números, códigos, letras y negaciones."""
+    return frozenset(t for t in terminos if len(t) == 1 or t in NEGACIONES or any(c.isdigit() for c in t))
+
+
+def similitud(a: Iterable[str], b: Iterable[str]) -> float:
+    """Coeficiente de Dice entre los conjuntos de términos (1.0 = mismos términos)."""
+    a, b = set(a), set(b)
+    if not a or not b:
+        return 0.0
+    return 2 * len(a & b) / (len(a) + len(b))
+
+
+def similitud_por_campos(a: str, b: str) -> float:
+    """La menor similitud campo a campo (una línea por campo, como texto_problema de main.py).
+
+    Con distinto número de líneas se compara el texto entero.
+    """
+    campos_a, campos_b = a.split("\n"), b.split("\n")
+    if len(campos_a) != len(campos_b):
+        return similitud(normalizar(a), normalizar(b))
+    minima = 1.0
+    for campo_a, campo_b in zip(campos_a, campos_b):
+        terminos_a, terminos_b = normalizar(campo_a), normalizar(campo_b)
+        if terminos_a or terminos_b:
+            minima = min(minima, similitud(terminos_a, terminos_b))
+    return minima
+
+
+def _recortar(texto: str, limite: int) -> str:
+    return texto if len(texto) <= limite else texto[: limite - 1].rstrip() + "…"
+
+
+class IndiceSimilares:
+    """Documentos + índice FTS5 (contenido externo) con una conexión por hilo."""
+
+    def __init__(self, ruta: str = SIMILAR_DB_PATH):
+        self.ruta = ruta
+        directorio = os.path.dirname(ruta)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        self._local = threading.local()
+        conn = self._conn()
+        conn.executescript(ESQUEMA)
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.ruta, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def agregar(self, origen: str, problema: str, respuesta: str, ref: Optional[str] = None) -> Optional[str]:
+        """Añade (o actualiza) un documento; el mismo problema normalizado no se duplica."""
+        terminos = normalizar(problema)
+        if not terminos:
+            return None
+        texto = " ".join(terminos)
+        clave = hashlib.sha1(f"{origen}\n{texto}".encode("utf-8")).hexdigest()
+        conn = self._conn()
+        with ALMACEN_DURACION.medir(operacion="similares_agregar"):
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                anterior = conn.execute("SELECT num, terminos FROM documentos WHERE clave = ?", (clave,)).fetchone()
+                if anterior is not None:
+                    # Contenido externo: la fila vieja se retira del índice con su texto original
+                    conn.execute(
+                        "INSERT INTO indice (indice, rowid, terminos) VALUES ('delete', ?, ?)",
+                        (anterior["num"], anterior["terminos"]),
+                    )
+                    conn.execute(
+                        "UPDATE documentos SET ref = ?, problema = ?, respuesta = ?, creado = ? WHERE num = ?",
+                        (ref, problema, respuesta, time.time(), anterior["num"]),
+                    )
+                    num = anterior["num"]
+                else:
+                    num = conn.execute(
+                        "INSERT INTO documentos (clave, origen, ref, problema, respuesta, terminos, creado) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (clave, origen, ref, problema, respuesta, texto, time.time()),
+                    ).lastrowid
+                    conn.executemany(
+                        "INSERT INTO terminos (termino, docs) VALUES (?, 1) "
+                        "ON CONFLICT (termino) DO UPDATE SET docs = docs + 1",
+                        [(t,) for t in set(terminos)],
+                    )
+                conn.execute("INSERT INTO indice (rowid, terminos) VALUES (?, ?)", (num, texto))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return clave
+
+    def _frecuencias(self, terminos: List[str]) -> List[Tuple[int, str]]:
+        """(documentos que lo contienen, término) de los términos indexados, de más raro a más común."""
+        unicos = list(dict.fromkeys(terminos))[:MAX_TERMINOS_TEXTO]
+        if not unicos:
+            return []
+        filas = self._conn().execute(
+            f"SELECT termino, docs FROM terminos WHERE termino IN ({', '.join('?' * len(unicos))})", unicos
+        ).fetchall()
+        return sorted((fila["docs"], fila["termino"]) for fila in filas)
+
+    def _intentos(self, terminos: List[str]) -> List[Tuple[str, bool]]:
+        """Expresiones FTS5 a probar en orden, y si cada una se puede ordenar por BM25.
+
+        bm25() se calcula para cada documento que casa, así que su coste crece
+        con los documentos encontrados, no con el tamaño del índice: cada
+        expresión se elige para que case con unos SIMILAR_MAX_POSTINGS como mucho.
+        """
+        frecuencias = self._frecuencias(terminos)[:SIMILAR_MAX_TERMS]
+        if not frecuencias:
+            return []
+        raros, acumulado = [], 0
+        for docs, termino in frecuencias:
+            if acumulado + docs > SIMILAR_MAX_POSTINGS:
+                break
+            raros.append(f'"{termino}"')
+            acumulado += docs
+        if raros:
+            return [(" OR ".join(raros), True)]
+        # Solo hay términos frecuentes: intersección de los más raros hasta que
+        # la estimación (términos independientes) quepa en el presupuesto
+        total = self._conn().execute("SELECT COALESCE(MAX(num), 0) FROM documentos").fetchone()[0]
+        comunes, estimado = [], float(total)
+        for docs, termino in frecuencias:
+            comunes.append(f'"{termino}"')
+            estimado *= docs / max(total, 1)
+            if estimado <= SIMILAR_MAX_POSTINGS:
+                break
+        intentos = [(" AND ".join(comunes), estimado <= SIMILAR_MAX_POSTINGS)]
+        # Si la intersección sale vacía se relaja quitando términos, ya sin BM25
+        # (se recorren solo los primeros candidatos y se ordenan por similitud)
+        for k in range(len(comunes) - 1, 0, -1):
+            intentos.append((" AND ".join(comunes[:k]), False))
+        return intentos
+
+    def buscar(self, texto: str, limite: int = 5, origen: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Documentos más parecidos a ``texto`` (BM25), con su similitud 0-1."""
+        with ALMACEN_DURACION.medir(operacion="similares_buscar"):
+            return self._buscar(normalizar(texto), limite, origen)
+
+    def _buscar(self, terminos: List[str], limite: int, origen: Optional[str]) -> List[Dict[str, Any]]:
+        filtro, parametros = ("AND d.origen = ?", (origen,)) if origen else ("", ())
+        filas = []
+        for expresion, con_bm25 in self._intentos(terminos):
+            if con_bm25:
+                consulta = (
+                    "SELECT d.*, bm25(indice) AS puntuacion FROM indice JOIN documentos d ON d.num = indice.rowid "
+                    f"WHERE indice MATCH ? {filtro} ORDER BY puntuacion LIMIT ?"
+                )
+                tope = max(limite, CANDIDATOS)
+            else:
+                consulta = (
+                    "SELECT d.*, NULL AS puntuacion FROM indice JOIN documentos d ON d.num = indice.rowid "
+                    f"WHERE indice MATCH ? {filtro} LIMIT ?"
+                )
+                tope = max(limite, CANDIDATOS) * 5
+            filas = self._conn().execute(consulta, (expresion, *parametros, tope)).fetchall()
+            if filas:
+                break
+        resultados = [
+            {
+                "id": fila["num"],
+                "origen": fila["origen"],
+                "ref": fila["ref"],
+                "problema": fila["problema"],
+                "respuesta": fila["respuesta"],
+                "similitud": round(similitud(terminos, fila["terminos"].split()), 3),
+                # bm25() es negativo (más negativo = mejor): se expone en positivo
+                "puntuacion": None if fila["puntuacion"] is None else round(-fila["puntuacion"], 3),
+                "creado": fila["creado"],
+            }
+            for fila in filas
+        ]
+        resultados.sort(key=lambda r: (r["similitud"], r["puntuacion"] or 0), reverse=True)
+        return resultados[:limite]
+
+    def previo(self, origen: str, texto: str, umbral: float = SIMILAR_THRESHOLD) -> Optional[Dict[str, Any]]:
+        """El documento más parecido cuya respuesta se puede reutilizar para ``texto``.
+
+        Además de la similitud global, los identificadores y las negaciones
+        deben coincidir y cada campo debe alcanzar el umbral: "línea 2" frente
+        a "línea 7" o "no arranca" frente a "arranca" no son el mismo problema.
+        """
+        distintivos = identificadores(normalizar(texto))
+        for resultado in self.buscar(texto, 5, origen):
+            if resultado["similitud"] < umbral:
+                break
+            if identificadores(normalizar(resultado["problema"])) != distintivos:
+                continue
+            if similitud_por_campos(texto, resultado["problema"]) >= umbral:
+                return resultado
+        return None
+
+    def contar(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM documentos").fetchone()[0]
+
+    def referencias(self, origen: str) -> set:
+        """``ref`` de los documentos ya indexados de ``origen``."""
+        filas = self._conn().execute("SELECT ref FROM documentos WHERE origen = ? AND ref IS NOT NULL", (origen,))
+        return {fila["ref"] for fila in filas}
+
+    def optimizar(self) -> None:
+        # Fusiona los segmentos del índice (útil tras una carga masiva)
+        self._conn().execute("INSERT INTO indice (indice) VALUES ('optimize')")
+
+
+_indice: Optional[IndiceSimilares] = None
+
+
+def obtener_indice() -> IndiceSimilares:
+    global _indice
+    if _indice is None:
+        _indice = IndiceSimilares()
+    return _indice
+
+
+def vista_publica(resultado: Dict[str, Any]) -> Dict[str, Any]:
+    return {**resultado, "respuesta": _recortar(resultado["respuesta"], FRAGMENTO)}
+
+
+def quiere_previo(request) -> bool:
+    """``?reutilizar=1`` pide una respuesta previa similar; ``?reutilizar=0`` la evita."""
+    valor = request.query_params.get("reutilizar")
+    if valor is None:
+        return SIMILAR_REUSE
+    return valor.lower() in ("1", "true", "si", "sí")
+
+
+async def indexar(origen: str, problema: str, respuesta: str, ref: Optional[str] = None) -> None:
+    try:
+        await asyncio.to_thread(obtener_indice().agregar, origen, problema, respuesta, ref)
+    except sqlite3.Error:
+        # El índice es auxiliar: un fallo al indexar no debe tumbar la respuesta ya generada
+        pass
+
+
+async def buscar_previo(origen: str, texto: str) -> Optional[Dict[str, Any]]:
+    try:
+        return await asyncio.to_thread(obtener_indice().previo, origen, texto)
+    except sqlite3.Error:
+        return None
+
+
+def texto_de_pasos(pasos: List[str]) -> str:
+    return "\n".join(re.sub(r"<[^>]+>", "", paso).strip() for paso in pasos)
+
+
+def reindexar(indice: IndiceSimilares) -> int:
+    """Carga en el índice los análisis del log de auditoría y las soluciones guardadas."""
+    import json
+
+    from .almacen import obtener_almacen
+    from .auditoria import leer_registros
+
+    campos = ("problema", "ubicacion", "como", "cuando", "quien", "quePaso")
+    n = 0
+    for registro in leer_registros():
+        # Las respuestas reutilizadas ("previo") ya están indexadas con su problema original
+        if registro.get("previo") is not None:
+            continue
+        if registro.get("respuesta") and all(c in registro for c in campos):
+            n += indice.agregar("analisis", "\n".join(str(registro[c]) for c in campos), registro["respuesta"]) is not None
+    # La descripción no se guarda: de las soluciones solo queda el título. Las ya
+    # indexadas al crearse (título y descripción) se saltan para no duplicarlas
+    indexadas = indice.referencias("solve")
+    conn = obtener_almacen()._conn()
+    for fila in conn.execute("SELECT p.title, s.data FROM problems p JOIN solutions s ON s.id = p.id"):
+        solucion = json.loads(fila["data"])
+        if solucion["id"] in indexadas:
+            continue
+        n += indice.agregar("solve", fila["title"], texto_de_pasos(solucion["content"]), solucion["id"]) is not None
+    indice.optimizar()
+    return n
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Índice de problemas similares.")
+    parser.add_argument("--reindexar", action="store_true", help="carga el log de auditoría y las soluciones guardadas")
+    parser.add_argument("--buscar", help="texto a buscar")
+    parser.add_argument("--limite", type=int, default=5)
+    args = parser.parse_args()
+    indice = obtener_indice()
+    if args.reindexar:
+        print(f"{reindexar(indice)} documentos indexados ({indice.contar()} en total)")
+    if args.buscar:
+        for resultado in indice.buscar(args.buscar, args.limite):
+            print(f"{resultado['similitud']:.3f}  {resultado['puntuacion']:8.3f}  [{resultado['origen']}] "
+                  f"{_recortar(' '.join(resultado['problema'].split()), 100)}")
@@ -0,0 +1,491 @@
+"""Cola de trabajos en segundo plano persistida en SQLite.
+
+Un análisis completo o un cálculo simbólico pesado puede superar el timeout
+de inactividad del balanceador (60 s). Con ``Prefer: respond-async`` (o
+``?async=1``) ``POST /solve`` y ``POST /analizar-problema`` encolan un
+trabajo y responden 202 con su id al momento. El cliente sigue el trabajo
+con ``GET /jobs/{id}`` (sondeo) o ``GET /jobs/{id}/events`` (SSE de
+progreso) y puede cancelarlo con ``POST /jobs/{id}/cancel``.
+
+Estados: queued -> running -> done | failed | cancelled.
+
+Los trabajadores son tareas asyncio que reclaman trabajos de la tabla con
+BEGIN IMMEDIATE, así varios procesos comparten la misma cola. JOBS_WORKERS
+fija cuántos corren en cada proceso web (0 = el proceso solo encola) y
+``trabajador.py`` levanta procesos dedicados: el procesamiento se escala
+aparte del front HTTP. Mientras corre, un trabajo renueva su latido; si su
+proceso muere, otro trabajador lo recupera cuando el latido caduca (hasta
+JOBS_MAX_ATTEMPTS intentos). Al apagar ordenadamente, los trabajos en curso
+vuelven a la cola. Con JOBS_QUEUE_MAX trabajos ya en cola, los nuevos se
+rechazan con 429.
+
+Cada superficie registra sus tipos con ``registrar_tipo(nombre, funcion)``;
+``funcion(entrada, progreso)`` es asíncrona, recibe el JSON encolado y
+devuelve el resultado (serializable a JSON). ``await progreso(0.5, "texto")``
+publica el avance.
+"""
+import asyncio
+import json
+import math
+import os
+import socket
+import sqlite3
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from uuid import uuid4
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from .metricas import TRABAJOS_DURACION, TRABAJOS_EN_CURSO, TRABAJOS_ESPERA, TRABAJOS_TERMINADOS
+
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", os.path.join("data", "trabajos.db"))
+JOBS_WORKERS = int(os.getenv("JOBS_WORKERS", "2"))
+JOBS_POLL_INTERVAL = float(os.getenv("JOBS_POLL_INTERVAL", "0.5"))
+JOBS_HEARTBEAT = float(os.getenv("JOBS_HEARTBEAT", "5"))
+# Un trabajo "running" sin latido durante este tiempo se da por huérfano
+JOBS_STALE = float(os.getenv("JOBS_STALE", str(6 * JOBS_HEARTBEAT)))
+JOBS_MAX_ATTEMPTS = int(os.getenv("JOBS_MAX_ATTEMPTS", "3"))
+# Trabajos en cola (entre todos los procesos) a partir de los cuales se rechazan los nuevos
+JOBS_QUEUE_MAX = int(os.getenv("JOBS_QUEUE_MAX", "1000"))
+# Los trabajos terminados se borran pasado este tiempo
+JOBS_TTL = float(os.getenv("JOBS_TTL", str(24 * 3600)))
+INTERVALO_PURGA = 300.0
+# Como mucho una escritura de progreso por trabajo en este intervalo (salvo cambio de etapa)
+INTERVALO_PROGRESO = 0.5
+
+ESTADOS_FINALES = ("done", "failed", "cancelled")
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS trabajos (
+    id TEXT PRIMARY KEY,
+    tipo TEXT NOT NULL,
+    estado TEXT NOT NULL,
+    entrada TEXT NOT NULL,
+    progreso REAL NOT NULL DEFAULT 0,
+    mensaje TEXT,
+    resultado TEXT,
+    error TEXT,
+    intentos INTEGER NOT NULL DEFAULT 0,
+    cancelar INTEGER NOT NULL DEFAULT 0,
+    dueno TEXT,
+    latido REAL,
+    creado REAL NOT NULL,
+    iniciado REAL,
+    terminado REAL
+);
+CREATE INDEX IF NOT EXISTS idx_trabajos_cola ON trabajos (estado, creado);
+"""
+
+Progreso = Callable[[float, Optional[str]], Awaitable[None]]
+FuncionTrabajo = Callable[[Dict[str, Any], Progreso], Awaitable[Any]]
+
+# tipo -> función; lo rellenan las superficies al importarse
+TIPOS: Dict[str, FuncionTrabajo] = {}
+
+
+def registrar_tipo(tipo: str, funcion: FuncionTrabajo) -> None:
+    TIPOS[tipo] = funcion
+
+
+class AlmacenTrabajos:
+    """Tabla de trabajos en SQLite con una conexión por hilo (igual que ``sesiones``)."""
+
+    def __init__(self, ruta: str = JOBS_DB_PATH, caducidad: float = JOBS_STALE, max_intentos: int = JOBS_MAX_ATTEMPTS):
+        self.ruta = ruta
+        self.caducidad = caducidad
+        self.max_intentos = max_intentos
+        directorio = os.path.dirname(ruta)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        self._local = threading.local()
+        self._ultima_purga = 0.0
+        conn = self._conn()
+        conn.executescript(ESQUEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.ruta, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _a_dict(fila: sqlite3.Row) -> Dict[str, Any]:
+        trabajo = dict(fila)
+        trabajo["entrada"] = json.loads(trabajo["entrada"])
+        trabajo["resultado"] = json.loads(trabajo["resultado"]) if trabajo["resultado"] is not None else None
+        trabajo["cancelar"] = bool(trabajo["cancelar"])
+        return trabajo
+
+    def encolar(self, tipo: str, entrada: Dict[str, Any], max_cola: int = JOBS_QUEUE_MAX) -> Optional[Dict[str, Any]]:
+        """Inserta el trabajo en cola; None si ya hay ``max_cola`` esperando."""
+        trabajo_id = uuid4().hex
+        # Conteo e inserción en una sola sentencia: dos procesos no pueden pasarse del límite a la vez
+        cursor = self._conn().execute(
+            "INSERT INTO trabajos (id, tipo, estado, entrada, creado) SELECT ?, ?, 'queued', ?, ? "
+            "WHERE (SELECT COUNT(*) FROM trabajos WHERE estado = 'queued') < ?",
+            (trabajo_id, tipo, json.dumps(entrada, ensure_ascii=False), time.time(), max_cola),
+        )
+        return self.obtener(trabajo_id) if cursor.rowcount else None
+
+    def obtener(self, trabajo_id: str) -> Optional[Dict[str, Any]]:
+        fila = self._conn().execute("SELECT * FROM trabajos WHERE id = ?", (trabajo_id,)).fetchone()
+        return self._a_dict(fila) if fila else None
+
+    def reclamar(self, tipos: List[str], dueno: str) -> Optional[Dict[str, Any]]:
+        """Pasa a running el trabajo en cola más antiguo de ``tipos`` (o None si no hay)."""
+        if not tipos:
+            return None
+        ahora = time.time()
+        limite = ahora - self.caducidad
+        conn = self._conn()
+        # Sondeo barato sin bloqueo de escritura: la cola suele estar vacía
+        hay_algo = conn.execute(
+            "SELECT 1 FROM trabajos WHERE estado = 'queued' OR (estado = 'running' AND latido < ?) LIMIT 1", (limite,)
+        ).fetchone()
+        if hay_algo is None:
+            return None
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Huérfanos de procesos caídos: vuelven a la cola, o terminan si se pidió
+            # cancelarlos o agotaron sus intentos
+            conn.execute(
+                "UPDATE trabajos SET estado = 'cancelled', terminado = ?, dueno = NULL "
+                "WHERE estado = 'running' AND latido < ? AND cancelar = 1",
+                (ahora, limite),
+            )
+            conn.execute(
+                "UPDATE trabajos SET estado = 'failed', terminado = ?, dueno = NULL, "
+                "error = 'El trabajador terminó inesperadamente demasiadas veces' "
+                "WHERE estado = 'running' AND latido < ? AND intentos >= ?",
+                (ahora, limite, self.max_intentos),
+            )
+            conn.execute(
+                "UPDATE trabajos SET estado = 'queued', dueno = NULL WHERE estado = 'running' AND latido < ?",
+                (limite,),
+            )
+            marcas = ",".join("?" * len(tipos))
+            fila = conn.execute(
+                f"SELECT id FROM trabajos WHERE estado = 'queued' AND tipo IN ({marcas}) ORDER BY creado LIMIT 1",
+                tipos,
+            ).fetchone()
+            if fila is not None:
+                conn.execute(
+                    "UPDATE trabajos SET estado = 'running', dueno = ?, latido = ?, "
+                    "iniciado = COALESCE(iniciado, ?), intentos = intentos + 1 WHERE id = ?",
+                    (dueno, ahora, ahora, fila["id"]),
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return self.obtener(fila["id"]) if fila is not None else None
+
+    def latir(self, trabajo_id: str, dueno: str, progreso: Optional[float] = None, mensaje: Optional[str] = None) -> bool:
+        """Renueva el latido (y el progreso); devuelve True si se pidió cancelar."""
+        conn = self._conn()
+        conn.execute(
+            "UPDATE trabajos SET latido = ?, progreso = COALESCE(?, progreso), mensaje = COALESCE(?, mensaje) "
+            "WHERE id = ? AND dueno = ?",
+            (time.time(), progreso, mensaje, trabajo_id, dueno),
+        )
+        fila = conn.execute("SELECT cancelar FROM trabajos WHERE id = ?", (trabajo_id,)).fetchone()
+        return bool(fila and fila["cancelar"])
+
+    def terminar(self, trabajo_id: str, dueno: str, estado: str, resultado: Any = None, error: Optional[str] = None) -> None:
+        self._conn().execute(
+            "UPDATE trabajos SET estado = ?, resultado = ?, error = ?, terminado = ?, dueno = NULL, "
+            "progreso = CASE WHEN ? = 'done' THEN 1 ELSE progreso END WHERE id = ? AND dueno = ?",
+            (
+                estado,
+                json.dumps(resultado, ensure_ascii=False) if resultado is not None else None,
+                error,
+                time.time(),
+                estado,
+                trabajo_id,
+                dueno,
+            ),
+        )
+
+    def devolver(self, trabajo_id: str, dueno: str) -> None:
+        # Apagado ordenado: el intento no cuenta
+        self._conn().execute(
+            "UPDATE trabajos SET estado = 'queued', dueno = NULL, intentos = intentos - 1 "
+            "WHERE id = ? AND dueno = ? AND estado = 'running'",
+            (trabajo_id, dueno),
+        )
+
+    def cancelar(self, trabajo_id: str) -> Optional[Dict[str, Any]]:
+        """En cola: se cancela ya. En curso: se marca y su trabajador lo interrumpe."""
+        conn = self._conn()
+        conn.execute(
+            "UPDATE trabajos SET estado = 'cancelled', terminado = ? WHERE id = ? AND estado = 'queued'",
+            (time.time(), trabajo_id),
+        )
+        conn.execute("UPDATE trabajos SET cancelar = 1 WHERE id = ? AND estado = 'running'", (trabajo_id,))
+        return self.obtener(trabajo_id)
+
+    def contar(self) -> Dict[str, int]:
+        filas = self._conn().execute("SELECT estado, COUNT(*) AS n FROM trabajos GROUP BY estado").fetchall()
+        return {f["estado"]: f["n"] for f in filas}
+
+    def purgar(self, ahora: Optional[float] = None) -> int:
+        ahora = ahora or time.time()
+        if ahora - self._ultima_purga < INTERVALO_PURGA:
+            return 0
+        self._ultima_purga = ahora
+        cursor = self._conn().execute(
+            "DELETE FROM trabajos WHERE estado IN ('done', 'failed', 'cancelled') AND terminado < ?",
+            (ahora - JOBS_TTL,),
+        )
+        return cursor.rowcount
+
+
+def vista_publica(trabajo: Dict[str, Any]) -> Dict[str, Any]:
+    """Lo que ve el cliente: sin la entrada ni los datos internos del reparto."""
+    return {
+        "id": trabajo["id"],
+        "tipo": trabajo["tipo"],
+        "estado": trabajo["estado"],
+        "progreso": trabajo["progreso"],
+        "mensaje": trabajo["mensaje"],
+        "resultado": trabajo["resultado"],
+        "error": trabajo["error"],
+        "intentos": trabajo["intentos"],
+        "cancelacion_pedida": trabajo["cancelar"],
+        "creado": trabajo["creado"],
+        "iniciado": trabajo["iniciado"],
+        "terminado": trabajo["terminado"],
+    }
+
+
+class GestorTrabajos:
+    """Trabajadores de este proceso sobre la cola compartida."""
+
+    def __init__(self, almacen: Optional[AlmacenTrabajos] = None):
+        self.almacen = almacen or AlmacenTrabajos()
+        self.id = f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:6]}"
+        self._bucles: List[asyncio.Task] = []
+        self._en_curso: Dict[str, asyncio.Task] = {}
+        self._aviso: Optional[asyncio.Event] = None
+
+    def arrancar(self, trabajadores: int = JOBS_WORKERS) -> None:
+        if self._bucles or trabajadores <= 0:
+            return
+        self._aviso = asyncio.Event()
+        self._bucles = [asyncio.create_task(self._bucle()) for _ in range(trabajadores)]
+
+    async def detener(self) -> None:
+        # Cancelar los bucles devuelve a la cola los trabajos que tenían en curso
+        for bucle in self._bucles:
+            bucle.cancel()
+        await asyncio.gather(*self._bucles, return_exceptions=True)
+        self._bucles = []
+
+    def avisar(self) -> None:
+        """Despierta a un trabajador local sin esperar al siguiente sondeo."""
+        if self._aviso is not None:
+            self._aviso.set()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "estados": self.almacen.contar(),
+            "trabajadores_locales": len(self._bucles),
+            "en_curso_locales": len(self._en_curso),
+            "tipos": sorted(TIPOS),
+        }
+
+    def cancelar_local(self, trabajo_id: str) -> None:
+        tarea = self._en_curso.get(trabajo_id)
+        if tarea is not None:
+            tarea.cancel()
+
+    async def _bucle(self) -> None:
+        while True:
+            await asyncio.to_thread(self.almacen.purgar)
+            trabajo = await self._reclamar()
+            if trabajo is None:
+                self._aviso.clear()
+                try:
+                    await asyncio.wait_for(self._aviso.wait(), JOBS_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._ejecutar(trabajo)
+
+    async def _reclamar(self) -> Optional[Dict[str, Any]]:
+        # El hilo termina aunque se cancele la espera: si llegó a reclamar un
+        # trabajo, se devuelve a la cola en vez de dejarlo en running sin dueño vivo
+        reclamo = asyncio.ensure_future(asyncio.to_thread(self.almacen.reclamar, list(TIPOS), self.id))
+        try:
+            return await asyncio.shield(reclamo)
+        except asyncio.CancelledError:
+            trabajo = await reclamo
+            if trabajo is not None:
+                await asyncio.to_thread(self.almacen.devolver, trabajo["id"], self.id)
+            raise
+
+    async def _ejecutar(self, trabajo: Dict[str, Any]) -> None:
+        trabajo_id, tipo = trabajo["id"], trabajo["tipo"]
+        TRABAJOS_ESPERA.observar(time.time() - trabajo["creado"], tipo=tipo)
+        ultima_escritura, ultimo_mensaje = 0.0, None
+
+        async def progreso(fraccion: float, mensaje: Optional[str] = None) -> None:
+            nonlocal ultima_escritura, ultimo_mensaje
+            ahora = time.monotonic()
+            # Los cambios de etapa (mensaje nuevo) se escriben siempre; el resto, con límite de ritmo
+            if mensaje != ultimo_mensaje or ahora - ultima_escritura >= INTERVALO_PROGRESO:
+                ultima_escritura, ultimo_mensaje = ahora, mensaje
+                await asyncio.to_thread(self.almacen.latir, trabajo_id, self.id, min(max(fraccion, 0.0), 1.0), mensaje)
+
+        tarea = asyncio.create_task(TIPOS[tipo](trabajo["entrada"], progreso))
+        self._en_curso[trabajo_id] = tarea
+        TRABAJOS_EN_CURSO.inc()
+        inicio = time.perf_counter()
+        estado = "failed"
+        try:
+            while not tarea.done():
+                await asyncio.wait({tarea}, timeout=JOBS_HEARTBEAT)
+                if not tarea.done() and await asyncio.to_thread(self.almacen.latir, trabajo_id, self.id):
+                    # Cancelación pedida desde otro proceso
+                    tarea.cancel()
+                    await asyncio.wait({tarea})
+            if tarea.cancelled():
+                estado = "cancelled"
+                await asyncio.to_thread(self.almacen.terminar, trabajo_id, self.id, estado, None, "Cancelado por el usuario")
+            elif tarea.exception() is not None:
+                await asyncio.to_thread(self.almacen.terminar, trabajo_id, self.id, estado, None, str(tarea.exception()))
+            else:
+                estado = "done"
+                await asyncio.to_thread(self.almacen.terminar, trabajo_id, self.id, estado, tarea.result())
+        except asyncio.CancelledError:
+            # Apagado del proceso: se interrumpe el trabajo y vuelve a la cola para otro trabajador
+            tarea.cancel()
+            await asyncio.wait({tarea})
+            estado = "requeued"
+            await asyncio.to_thread(self.almacen.devolver, trabajo_id, self.id)
+            raise
+        finally:
+            del self._en_curso[trabajo_id]
+            TRABAJOS_EN_CURSO.dec()
+            TRABAJOS_DURACION.observar(time.perf_counter() - inicio, tipo=tipo, estado=estado)
+            if estado != "requeued":
+                TRABAJOS_TERMINADOS.inc(tipo=tipo, estado=estado)
+
+
+_gestor: Optional[GestorTrabajos] = None
+
+
+def obtener_gestor() -> GestorTrabajos:
+    global _gestor
+    if _gestor is None:
+        _gestor = GestorTrabajos()
+    return _gestor
+
+
+# --- API HTTP ---
+
+def quiere_trabajo(request: Request) -> bool:
+    """El cliente pide respuesta asíncrona: ``Prefer: respond-async`` o ``?async=1``."""
+    return "respond-async" in request.headers.get("prefer", "").lower() or request.query_params.get("async") in ("1", "true")
+
+
+async def encolar_trabajo(tipo: str, entrada: Dict[str, Any]) -> JSONResponse:
+    """Encola y responde 202 con el id y dónde seguir el trabajo (429 si la cola está llena)."""
+    gestor = obtener_gestor()
+    trabajo = await asyncio.to_thread(gestor.almacen.encolar, tipo, entrada)
+    if trabajo is None:
+        raise HTTPException(
+            status_code=429,
+            detail="Demasiados trabajos en cola. Reintenta más tarde.",
+            headers={"Retry-After": str(math.ceil(JOBS_HEARTBEAT))},
+        )
+    gestor.avisar()
+    url = f"/jobs/{trabajo['id']}"
+    return JSONResponse(
+        status_code=202,
+        content={"job_id": trabajo["id"], "estado": trabajo["estado"], "url": url, "eventos": f"{url}/events"},
+        headers={"Location": url, "Preference-Applied": "respond-async"},
+    )
+
+
+router = APIRouter()
+
+
+@router.on_event("startup")
+def arrancar_trabajadores():
+    # Con JOBS_WORKERS=0 este proceso solo encola (los ejecuta trabajador.py)
+    obtener_gestor().arrancar()
+
+
+@router.on_event("shutdown")
+async def detener_trabajadores():
+    await obtener_gestor().detener()
+
+
+async def trabajo_o_404(trabajo_id: str) -> Dict[str, Any]:
+    trabajo = await asyncio.to_thread(obtener_gestor().almacen.obtener, trabajo_id)
+    if trabajo is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    return trabajo
+
+
+@router.get("/jobs/stats")
+async def estadisticas_trabajos():
+    return await asyncio.to_thread(obtener_gestor().stats)
+
+
+@router.get("/jobs/{trabajo_id}")
+async def consultar_trabajo(trabajo_id: str):
+    return vista_publica(await trabajo_o_404(trabajo_id))
+
+
+def _evento_sse(datos: dict, evento: str) -> str:
+    return f"event: {evento}\ndata: {json.dumps(datos, ensure_ascii=False)}\n\n"
+
+
+async def eventos_trabajo(trabajo_id: str, trabajo: Dict[str, Any]):
+    """Un evento ``progreso`` por cada cambio y ``fin`` con el trabajo completo al terminar.
+
+    Sondea la tabla (el trabajo puede correr en otro proceso); la consulta es
+    por clave primaria y no cuesta nada frente a la duración del trabajo.
+    """
+    almacen = obtener_gestor().almacen
+    anterior = None
+    while True:
+        actual = (trabajo["estado"], trabajo["progreso"], trabajo["mensaje"])
+        if trabajo["estado"] in ESTADOS_FINALES:
+            yield _evento_sse(vista_publica(trabajo), "fin")
+            return
+        if actual != anterior:
+            anterior = actual
+            yield _evento_sse({"estado": actual[0], "progreso": actual[1], "mensaje": actual[2]}, "progreso")
+        await asyncio.sleep(JOBS_POLL_INTERVAL)
+        trabajo = await asyncio.to_thread(almacen.obtener, trabajo_id)
+
+
+@router.get("/jobs/{trabajo_id}/events")
+async def seguir_trabajo(trabajo_id: str):
+    trabajo = await trabajo_o_404(trabajo_id)
+    return StreamingResponse(
+        eventos_trabajo(trabajo_id, trabajo),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.post("/jobs/{trabajo_id}/cancel")
+async def cancelar_trabajo(trabajo_id: str):
+    gestor = obtener_gestor()
+    trabajo = await trabajo_o_404(trabajo_id)
+    if trabajo["estado"] in ESTADOS_FINALES:
+        raise HTTPException(status_code=409, detail=f"El trabajo ya terminó ({trabajo['estado']})")
+    trabajo = await asyncio.to_thread(gestor.almacen.cancelar, trabajo_id)
+    # Si corre en este proceso se interrumpe ya; si no, al siguiente latido de su trabajador
+    gestor.cancelar_local(trabajo_id)
+    return JSONResponse(status_code=202, content=vista_publica(trabajo))
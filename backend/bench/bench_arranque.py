@@ -0,0 +1,122 @@
+"""Benchmark de arranque en frío del servidor unificado.
+
+Mide, en procesos nuevos (como un dyno recién escalado):
+  - importación: tiempo de ``import servidor`` + ``create_app()`` y qué
+    dependencias pesadas quedan cargadas (deberían ser ninguna);
+  - primera petición: desde lanzar ``lanzador.py`` hasta la primera respuesta
+    200 de ``GET /`` y hasta la primera de una ruta real de cada superficie.
+
+Uso (desde backend/):  python bench/bench_arranque.py --repeticiones 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stub_llm import puerto_libre  # noqa: E402
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PESADOS = ["openai", "numpy", "sympy", "jinja2"]
+
+SCRIPT_IMPORTACION = f"""
+import json, sys, time
+t0 = time.perf_counter()
+import servidor
+t1 = time.perf_counter()
+servidor.create_app()
+t2 = time.perf_counter()
+print(json.dumps({{
+    "import": t1 - t0,
+    "create_app": t2 - t1,
+    "cargados": [m for m in {PESADOS!r} if m in sys.modules],
+}}))
+"""
+
+# Primera petición que toca cada superficie (y sus imports diferidos)
+PRIMERAS = [
+    ("GET", "/", None),
+    ("POST", "/pregunta/", {"nombre": "a", "email": "a@b.c", "pregunta": "¿?"}),
+    ("GET", "/plantilla/", None),
+    ("POST", "/paretoanalysis/", {"metodo": "pareto", "respuesta": "x", "causes": [{"name": "a", "frequency": 3}]}),
+    ("GET", "/problems?limit=1", None),
+]
+
+
+def medir_importacion(entorno) -> dict:
+    salida = subprocess.run(
+        [sys.executable, "-c", SCRIPT_IMPORTACION],
+        cwd=BACKEND_DIR, env=entorno, capture_output=True, text=True, check=True,
+    )
+    return json.loads(salida.stdout.strip().splitlines()[-1])
+
+
+def medir_primera_peticion(entorno, timeout: float = 30.0) -> dict:
+    puerto = puerto_libre()
+    entorno = {**entorno, "PORT": str(puerto), "HOST": "127.0.0.1", "WEB_CONCURRENCY": "1", "LOG_LEVEL": "warning"}
+    base = f"http://127.0.0.1:{puerto}"
+    inicio = time.perf_counter()
+    proceso = subprocess.Popen(
+        [sys.executable, os.path.join(BACKEND_DIR, "lanzador.py")],
+        cwd=BACKEND_DIR, env=entorno, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    tiempos = {}
+    try:
+        with httpx.Client(base_url=base, timeout=5) as http:
+            while True:
+                if time.perf_counter() - inicio > timeout:
+                    raise RuntimeError("el servidor no respondió a tiempo")
+                try:
+                    if http.get("/").status_code == 200:
+                        break
+                except httpx.TransportError:
+                    time.sleep(0.01)
+            tiempos["primera_respuesta"] = time.perf_counter() - inicio
+            for metodo, ruta, cuerpo in PRIMERAS[1:]:
+                t = time.perf_counter()
+                r = http.request(metodo, ruta, json=cuerpo)
+                r.raise_for_status()
+                tiempos[f"{metodo} {ruta}"] = time.perf_counter() - t
+    finally:
+        proceso.terminate()
+        proceso.wait(timeout=10)
+    return tiempos
+
+
+def resumir(muestras):
+    claves = [k for k in muestras[0] if isinstance(muestras[0][k], float)]
+    return {k: statistics.median(m[k] for m in muestras) for k in claves}
+
+
+def main(args):
+    entorno = dict(os.environ)
+    # Datos y logs del benchmark fuera del árbol del proyecto
+    entorno.setdefault("SOLVER_DB_PATH", os.path.join(args.tmp, "solver.db"))
+    entorno.setdefault("AUDIT_DIR", os.path.join(args.tmp, "logs"))
+    entorno.setdefault("LLM_CACHE_PATH", os.path.join(args.tmp, "cache.db"))
+
+    importaciones = [medir_importacion(entorno) for _ in range(args.repeticiones)]
+    print("importación (mediana):")
+    for clave, valor in resumir(importaciones).items():
+        print(f"  {clave:<12} {valor * 1000:8.1f} ms")
+    print(f"  dependencias pesadas cargadas al arrancar: {importaciones[-1]['cargados'] or 'ninguna'}")
+
+    arranques = [medir_primera_peticion(entorno) for _ in range(args.repeticiones)]
+    print("primera petición (mediana, desde lanzar el proceso / por ruta):")
+    for clave, valor in resumir(arranques).items():
+        print(f"  {clave:<28} {valor * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    import tempfile
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeticiones", type=int, default=3)
+    parser.add_argument("--tmp", default=tempfile.mkdtemp(prefix="bench_arranque_"))
+    main(parser.parse_args())
@@ -0,0 +1,171 @@
+"""Enrutador LLM (cobertura + circuit breakers) contra stubs locales.
+
+Dos stubs OpenAI-compatibles con la misma distribución de latencia y una
+cola lenta inyectada (``--tasa-lenta`` de las llamadas tarda ``--lenta`` s):
+
+  1. cola      latencia por petición con un solo backend frente al enrutador
+               (completas y tiempo hasta el primer fragmento en streaming)
+  2. caída     el backend preferido responde 500 a todo: el enrutador no debe
+               fallar ninguna petición y el circuito debe cortarle el tráfico
+  3. vuelta    se recupera el preferido: tras LLM_BREAKER_COOLDOWN una prueba
+               cierra el circuito y el tráfico vuelve a él
+
+Cada escenario de cola empieza con un calentamiento (``--calentamiento``
+peticiones sin medir) para que el p95 de cada backend ya esté estimado: las
+primeras peticiones de un proceso esperan LLM_HEDGE_DELAY antes de cubrir.
+Los stubs usan ``--semilla`` para repetir la misma secuencia de llamadas lentas.
+
+Termina con código 1 si el p99 del enrutador no baja de la mitad del de un
+solo backend, si falla alguna petición durante la caída, si con el circuito
+semiabierto pasa más de una llamada de prueba por espera, o si el circuito
+no se abre y se vuelve a cerrar.
+
+Uso (desde backend/):  python bench/bench_enrutador.py --peticiones 1000
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+os.environ.setdefault("LLM_BREAKER_COOLDOWN", "1")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stub_llm import StubEnHilo, crear_stub  # noqa: E402
+
+from app.enrutador import BackendLLM, EnrutadorLLM  # noqa: E402
+from app.llm import LLMError, ClienteLLM, construir_mensajes  # noqa: E402
+
+MENSAJES = construir_mensajes("La línea 3 se detiene: el motor se sobrecalienta en el turno de noche.")
+
+
+def percentiles(muestras):
+    ordenadas = sorted(muestras)
+    return {p: ordenadas[min(len(ordenadas) - 1, int(len(ordenadas) * p / 100))] for p in (50, 95, 99)}
+
+
+async def lanzar(cliente, peticiones: int, concurrencia: int, stream: bool = False):
+    """Latencias (respuesta completa o primer fragmento) y número de errores."""
+    tiempos, errores = [], 0
+    pendientes = iter(range(peticiones))
+
+    async def una():
+        inicio = time.perf_counter()
+        if stream:
+            primero = None
+            async for _ in cliente.completar_stream(MENSAJES):
+                # Lo que se cubre es la espera al primer fragmento; el resto se consume sin medir
+                primero = primero or time.perf_counter() - inicio
+            tiempos.append(primero)
+        else:
+            await cliente.completar(MENSAJES)
+            tiempos.append(time.perf_counter() - inicio)
+
+    async def trabajador():
+        nonlocal errores
+        for _ in pendientes:
+            try:
+                await una()
+            except LLMError:
+                errores += 1
+
+    await asyncio.gather(*(trabajador() for _ in range(concurrencia)))
+    return tiempos, errores
+
+
+def fila(nombre: str, tiempos, errores: int, extra: str = "") -> None:
+    p = percentiles(tiempos) if tiempos else {50: 0, 95: 0, 99: 0}
+    print(f"{nombre:<34} {p[50] * 1000:>8.0f} {p[95] * 1000:>8.0f} {p[99] * 1000:>8.0f} {errores:>7}  {extra}")
+
+
+async def main(args) -> int:
+    parametros = dict(jitter=args.latencia / 4, tasa_lenta=args.tasa_lenta, latencia_lenta=args.lenta)
+    fallos = []
+    with StubEnHilo(crear_stub(args.latencia, semilla=args.semilla, **parametros)) as stub_a, \
+            StubEnHilo(crear_stub(args.latencia, semilla=args.semilla + 1, **parametros)) as stub_b:
+        unico = ClienteLLM(api_key="stub", base_url=stub_a.base_url, modelo="stub-a")
+
+        def enrutador() -> EnrutadorLLM:
+            return EnrutadorLLM([
+                BackendLLM("a", ClienteLLM(api_key="stub", base_url=stub_a.base_url, modelo="stub-a", max_reintentos=0)),
+                BackendLLM("b", ClienteLLM(api_key="stub", base_url=stub_b.base_url, modelo="stub-b", max_reintentos=0)),
+            ])
+
+        print(f"latencia {args.latencia * 1000:.0f} ms, {args.tasa_lenta:.0%} de llamadas a {args.lenta * 1000:.0f} ms; "
+              f"{args.peticiones} peticiones, concurrencia {args.concurrencia}\n")
+        print(f"{'escenario':<34} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errores':>7}")
+
+        # 1. Cola de latencia
+        for stream in (False, True):
+            modo = "stream (1er fragmento)" if stream else "completo"
+            t_unico, e_unico = await lanzar(unico, args.peticiones, args.concurrencia, stream)
+            fila(f"un backend, {modo}", t_unico, e_unico)
+            router = enrutador()
+            await lanzar(router, args.calentamiento, args.concurrencia, stream)
+            llamadas = stub_a.app.state.llamadas + stub_b.app.state.llamadas
+            t_router, e_router = await lanzar(router, args.peticiones, args.concurrencia, stream)
+            extra = stub_a.app.state.llamadas + stub_b.app.state.llamadas - llamadas - args.peticiones
+            fila(f"enrutador, {modo}", t_router, e_router,
+                 f"coberturas {router.coberturas} (+{extra / args.peticiones:.1%} llamadas)")
+            if percentiles(t_router)[99] > percentiles(t_unico)[99] / 2:
+                fallos.append(f"p99 {modo}: el enrutador no reduce la cola")
+            await router.cerrar()
+
+        # 2. Caída del backend preferido
+        router = enrutador()
+        await lanzar(router, 50, args.concurrencia)
+        circuito = router.backends[0].circuito
+        en_semiabierto = 0
+        reservar = circuito.reservar
+
+        def contar_reserva() -> bool:
+            # Cada llamada lanzada a 'a' pasa por reservar(): con el circuito
+            # semiabierto solo debe pasar una (la prueba) por cada espera
+            nonlocal en_semiabierto
+            en_semiabierto += circuito.estado == "semiabierto"
+            return reservar()
+
+        circuito.reservar = contar_reserva
+        stub_a.app.state.tasa_error = 1.0
+        antes = stub_a.app.state.llamadas
+        inicio_caida = time.perf_counter()
+        t_caida, e_caida = await lanzar(router, args.peticiones, args.concurrencia)
+        a_caida = stub_a.app.state.llamadas - antes
+        esperas = int((time.perf_counter() - inicio_caida) / circuito.espera) + 1
+        fila("caída de 'a'", t_caida, e_caida,
+             f"llamadas a 'a': {a_caida} ({en_semiabierto} en semiabierto), circuito '{circuito.estado}'")
+        if en_semiabierto > esperas:
+            fallos.append(f"{en_semiabierto} llamadas a 'a' semiabierto en {esperas} esperas (una sola prueba por espera)")
+        if e_caida:
+            fallos.append(f"{e_caida} peticiones fallidas durante la caída")
+        if router.backends[0].circuito.estado == "cerrado":
+            fallos.append("el circuito de 'a' no se abrió")
+
+        # 3. Recuperación
+        stub_a.app.state.tasa_error = 0.0
+        await asyncio.sleep(router.backends[0].circuito.espera + 0.1)
+        antes = stub_a.app.state.llamadas
+        t_vuelta, e_vuelta = await lanzar(router, 100, args.concurrencia)
+        fila("vuelta de 'a'", t_vuelta, e_vuelta,
+             f"llamadas a 'a': {stub_a.app.state.llamadas - antes}, circuito '{router.backends[0].circuito.estado}'")
+        if router.backends[0].circuito.estado != "cerrado":
+            fallos.append("el circuito de 'a' no se cerró tras recuperarse")
+
+        await router.cerrar()
+        await unico.cerrar()
+
+    for fallo in fallos:
+        print(f"ERROR: {fallo}")
+    return 1 if fallos else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--peticiones", type=int, default=1000)
+    parser.add_argument("--calentamiento", type=int, default=100)
+    parser.add_argument("--semilla", type=int, default=7)
+    parser.add_argument("--concurrencia", type=int, default=16)
+    parser.add_argument("--latencia", type=float, default=0.1)
+    parser.add_argument("--tasa-lenta", type=float, default=0.05)
+    parser.add_argument("--lenta", type=float, default=2.0)
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,65 @@
+"""Benchmark de /analizar-problema contra un stub LLM local.
+
+Mide el throughput del endpoint a distintos niveles de concurrencia. Con el
+cliente asíncrono el throughput debe crecer con la concurrencia (hasta
+LLM_MAX_CONCURRENCY) en lugar de quedarse plano en ~1/latencia.
+
+Uso (desde backend/):  python bench/bench_llm.py --latency 0.2 --requests 64
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stub_llm import StubEnHilo, crear_stub  # noqa: E402
+
+PAYLOAD = {
+    "problema": "La línea 3 se detiene",
+    "ubicacion": "Planta norte",
+    "como": "Paro súbito del transportador",
+    "cuando": "Turno de noche",
+    "quien": "Operador de turno",
+    "quePaso": "El motor se sobrecalentó y saltó la protección",
+}
+
+
+async def medir(app, concurrencia: int, total: int) -> float:
+    import httpx
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as http:
+        pendientes = iter(range(total))
+
+        async def trabajador():
+            for _ in pendientes:
+                r = await http.post("/analizar-problema", json=PAYLOAD)
+                r.raise_for_status()
+
+        inicio = time.perf_counter()
+        await asyncio.gather(*(trabajador() for _ in range(concurrencia)))
+        return total / (time.perf_counter() - inicio)
+
+
+async def main(args):
+    from main import app
+
+    print(f"latencia stub={args.latency}s  peticiones por nivel={args.requests}")
+    for concurrencia in args.concurrency:
+        rps = await medir(app, concurrencia, args.requests)
+        print(f"concurrencia={concurrencia:>3}  throughput={rps:8.2f} req/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--requests", type=int, default=32)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    args = parser.parse_args()
+
+    with StubEnHilo(crear_stub(args.latency)) as stub:
+        os.environ["OPENAI_API_KEY"] = "stub"
+        os.environ["OPENAI_BASE_URL"] = stub.base_url
+        asyncio.run(main(args))
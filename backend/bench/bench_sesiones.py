@@ -0,0 +1,79 @@
+"""Tamaño de prompt por paso: sesión condensada frente a reenviar todo el historial.
+
+Simula una cadena larga de 5 Porqués (y otros pasos) sobre una sesión real
+(SQLite temporal) y mide en cada paso el tamaño del prompt que se mandaría
+al LLM y el coste de ``agregar_paso``. La cota del prompt (recientes +
+resumen) y la estabilidad del prefijo se comprueban en tests/test_sesiones.py.
+
+Uso (desde backend/):  python bench/bench_sesiones.py --pasos 200
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.llm import construir_mensajes  # noqa: E402
+from app.sesiones import (  # noqa: E402
+    AlmacenSesiones,
+    construir_mensajes_sesion,
+    contexto_problema,
+)
+
+PROBLEMA = {
+    "problema": "La línea 3 se detiene varias veces por turno",
+    "ubicacion": "Planta norte, transportador principal",
+    "como": "Paro súbito del motor con alarma de sobrecorriente",
+    "cuando": "Principalmente en el turno de noche",
+    "quien": "Operadores de turno y mantenimiento",
+    "quePaso": "El motor se sobrecalienta, salta la protección y la línea queda parada 20 minutos",
+}
+METODOS = ["5 porques", "5 porques", "5 porques", "ishikawa", "fmea"]
+TAREA = "Formula el siguiente '¿por qué?' de la cadena y propón una respuesta probable en una frase."
+
+
+def respuesta(n: int) -> str:
+    return (
+        f"Porque en el paso {n} se observó que la ventilación del motor estaba obstruida por polvo. "
+        "La limpieza preventiva no figura en el plan de mantenimiento del turno de noche, "
+        "y el operador no tiene un procedimiento para revisar la temperatura antes de arrancar."
+    )
+
+
+def caracteres(mensajes) -> int:
+    return sum(len(m["content"]) for m in mensajes)
+
+
+def main(args) -> None:
+    sesiones = AlmacenSesiones(ruta=os.path.join(tempfile.mkdtemp(prefix="bench_sesiones_"), "sesiones.db"))
+    sesion = sesiones.crear(PROBLEMA)
+    historial = []
+    filas = []
+    for n in range(1, args.pasos + 1):
+        metodo = METODOS[(n - 1) % len(METODOS)]
+        contenido = respuesta(n)
+        inicio = time.perf_counter()
+        sesion = sesiones.agregar_paso(sesion["id"], metodo, contenido)
+        agregar_ms = (time.perf_counter() - inicio) * 1000
+        historial.append(f"Paso {n} [{metodo}]:\n{contenido}")
+
+        con_sesion = caracteres(construir_mensajes_sesion(sesion, TAREA))
+        # Sin sesión: el cliente reenvía problema + todos los pasos en cada llamada
+        sin_sesion = caracteres(construir_mensajes("\n\n".join([contexto_problema(PROBLEMA), *historial, TAREA])))
+        filas.append((n, con_sesion, sin_sesion, agregar_ms))
+
+    print(f"{'paso':>5} {'sesión (chars)':>15} {'~tokens':>8} {'historial (chars)':>18} {'~tokens':>8} {'agregar_paso':>13}")
+    for n, con, sin, ms in filas:
+        if n in (1, 2, 3, 5, 10, 20, 50, 100, 200, 500, 1000) or n == args.pasos:
+            print(f"{n:>5} {con:>15} {con // 4:>8} {sin:>18} {sin // 4:>8} {ms:>10.2f} ms")
+
+    maximo = max(con for _, con, _, _ in filas)
+    print(f"\nmáximo con sesión: {maximo} chars; sin sesión: {filas[-1][2]} chars")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pasos", type=int, default=200)
+    main(parser.parse_args())
@@ -0,0 +1,130 @@
+"""Latencia del índice de problemas similares con un corpus sintético grande.
+
+Carga N problemas sintéticos (vocabulario de planta con distribución Zipf y
+códigos de equipo raros) en un índice temporal y mide:
+  - ``agregar``: coste de indexar un problema (lo que se añade a /solve y al análisis)
+  - ``buscar``: GET /problems/similar sobre problemas nuevos
+  - ``genérica``: lo mismo con consultas de solo palabras frecuentes (el peor caso)
+  - ``previo``: búsqueda de una respuesta reutilizable a partir de versiones
+    reescritas de problemas ya indexados (y cuántas se reconocen)
+
+Termina con código 1 si el p95 de alguna consulta supera --max-ms.
+
+Uso (desde backend/):  python bench/bench_similares.py --documentos 100000
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.similares import SIMILAR_THRESHOLD, IndiceSimilares  # noqa: E402
+
+EQUIPOS = """motor bomba transportador compresor válvula sensor variador caldera horno prensa
+robot cinta rodamiento reductor ventilador intercambiador tolva mezcladora envasadora etiquetadora
+encoder termopar PLC contactor fusible filtro manguera cilindro actuador servomotor""".split()
+SINTOMAS = """sobrecalentamiento vibración ruido fuga paro alarma sobrecorriente atasco desgaste
+rotura desalineación corrosión cortocircuito disparo presión temperatura humedad polvo lubricación
+retraso rechazo defecto merma contaminación oxidación holgura grieta deformación""".split()
+LUGARES = """planta norte sur línea almacén muelle laboratorio taller sala calderas exterior
+nave oficina expedición recepción zona carga""".split()
+CONTEXTO = """turno noche mañana tarde fin semana arranque parada mantenimiento operador supervisor
+técnico proveedor cliente auditoría lote producción cambio formato limpieza calibración inspección
+después antes varias veces día hora minutos semana mes principal secundario auxiliar nuevo viejo""".split()
+PLANTILLA = ["el", "la", "de", "en", "con", "por", "que", "se", "del", "los", "una"]
+
+
+def generador(semilla: int):
+    azar = random.Random(semilla)
+    comunes = EQUIPOS + SINTOMAS + LUGARES + CONTEXTO
+    pesos = [1 / (i + 1) for i in range(len(comunes))]
+    azar.shuffle(pesos)
+
+    def problema(codigos: bool = True) -> str:
+        palabras = azar.choices(comunes, weights=pesos, k=azar.randint(14, 30))
+        # Códigos de equipo/pieza: lo que distingue de verdad un problema de otro
+        if codigos:
+            palabras += [f"{azar.choice('ABCDEFGHKLMP')}{azar.randint(100, 9999)}" for _ in range(azar.randint(1, 3))]
+        palabras += azar.choices(PLANTILLA, k=8)
+        azar.shuffle(palabras)
+        return " ".join(palabras)
+
+    def reescribir(texto: str) -> str:
+        # Misma incidencia contada de otra forma: orden, palabras vacías y algún término distintos
+        palabras = texto.split()
+        azar.shuffle(palabras)
+        cambios = max(1, len(palabras) // 12)
+        for _ in range(cambios):
+            palabras[azar.randrange(len(palabras))] = azar.choice(PLANTILLA)
+        return " ".join(palabras)
+
+    return problema, reescribir
+
+
+def percentiles(muestras):
+    ordenadas = sorted(muestras)
+    return {p: ordenadas[min(len(ordenadas) - 1, int(len(ordenadas) * p / 100))] for p in (50, 95, 99)}
+
+
+def medir(funcion, argumentos):
+    tiempos = []
+    resultados = []
+    for arg in argumentos:
+        inicio = time.perf_counter()
+        resultados.append(funcion(arg))
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    return tiempos, resultados
+
+
+def main(args) -> int:
+    problema, reescribir = generador(args.semilla)
+    indice = IndiceSimilares(ruta=os.path.join(tempfile.mkdtemp(prefix="bench_similares_"), "similares.db"))
+
+    textos = [problema() for _ in range(args.documentos)]
+    inicio = time.perf_counter()
+    for i, texto in enumerate(textos):
+        indice.agregar("analisis", texto, f"Respuesta {i}: revisar el plan de mantenimiento.")
+    carga = time.perf_counter() - inicio
+    print(f"{args.documentos} documentos indexados en {carga:.1f} s ({carga / args.documentos * 1000:.2f} ms por documento)")
+    indice.optimizar()
+
+    nuevos = [problema() for _ in range(args.consultas)]
+    genericos = [problema(codigos=False) for _ in range(args.consultas)]
+    objetivos = random.Random(args.semilla + 1).sample(range(len(textos)), args.consultas)
+    reescritos = [reescribir(textos[i]) for i in objetivos]
+
+    t_agregar, _ = medir(lambda t: indice.agregar("analisis", t, "Respuesta nueva."), [problema() for _ in range(200)])
+    t_buscar, _ = medir(lambda t: indice.buscar(t, 5), nuevos)
+    t_generica, _ = medir(lambda t: indice.buscar(t, 5), genericos)
+    t_previo, previos = medir(lambda t: indice.previo("analisis", t), reescritos)
+    aciertos = sum(1 for p, i in zip(previos, objetivos) if p and p["id"] == i + 1)
+    falsos = sum(1 for p, i in zip(previos, objetivos) if p and p["id"] != i + 1)
+    _, ajenos = medir(lambda t: indice.previo("analisis", t), nuevos)
+
+    print(f"\n{'operación':<10} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'media':>8}")
+    for nombre, tiempos in (("agregar", t_agregar), ("buscar", t_buscar), ("genérica", t_generica), ("previo", t_previo)):
+        p = percentiles(tiempos)
+        print(f"{nombre:<10} {p[50]:>8.2f} {p[95]:>8.2f} {p[99]:>8.2f} {statistics.mean(tiempos):>8.2f}")
+    print(
+        f"\nprevio (umbral {SIMILAR_THRESHOLD}): {aciertos}/{len(reescritos)} reescrituras reconocidas, "
+        f"{falsos} con otro documento; {sum(1 for p in ajenos if p)}/{len(nuevos)} problemas nuevos con previo"
+    )
+
+    peor = max(percentiles(t)[95] for t in (t_buscar, t_generica, t_previo))
+    if peor > args.max_ms:
+        print(f"ERROR: p95 de consulta {peor:.2f} ms > {args.max_ms} ms")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documentos", type=int, default=100_000)
+    parser.add_argument("--consultas", type=int, default=500)
+    parser.add_argument("--semilla", type=int, default=7)
+    parser.add_argument("--max-ms", type=float, default=10.0)
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,408 @@
+"""Benchmark de carga con tráfico mixto contra el servidor unificado.
+
+Levanta un stub LLM local (latencia, jitter y ritmo de tokens configurables)
+y el servidor (``servidor:create_app``) en un subproceso o en este mismo
+proceso, y genera tráfico mezclado entre:
+
+    analizar     POST /analizar-problema (prompts repetidos: aciertos y fallos de caché)
+    solve        POST /solve (mitad problemas matemáticos, mitad generales)
+    problemas    GET  /problems?limit=20
+    metodologia  POST /paretoanalysis/ y /fmeaanalysis/ con filas aleatorias
+
+Dos modos de carga:
+    --concurrencia N   lazo cerrado: N clientes que envían en cuanto reciben
+    --tasa R           lazo abierto: R peticiones/s a intervalos fijos; la
+                       latencia se mide desde el instante programado, así los
+                       atascos del servidor no se esconden (coordinated omission)
+
+Salida JSON con throughput, p50/p95/p99, tasa de error y RSS pico. Con
+``--baseline`` se compara con un resultado guardado y el proceso sale con
+código 1 si algo empeora más de ``--tolerancia``.
+
+Uso (desde backend/):
+    python bench/carga.py --concurrencia 16 --duracion 20 --guardar-baseline /tmp/base.json
+    python bench/carga.py --concurrencia 16 --duracion 20 --baseline /tmp/base.json
+    python bench/carga.py --tasa 40 --duracion 30 --modo proceso --salida resultado.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stub_llm import StubEnHilo, crear_stub, puerto_libre  # noqa: E402
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MEZCLA_DEFECTO = "analizar=3,solve=2,problemas=3,metodologia=2"
+
+# --- Escenarios: cada uno devuelve (método, ruta, cuerpo JSON) ---
+
+LUGARES = ["Planta norte", "Almacén central", "Línea 3", "Laboratorio", "Oficina de compras"]
+CAUSAS = ["Mantenimiento", "Material defectuoso", "Error humano", "Calibración", "Proveedor", "Temperatura"]
+
+
+def _analizar(rnd: random.Random, args) -> Tuple[str, str, Any]:
+    n = rnd.randrange(args.prompts_distintos)
+    return "POST", "/analizar-problema", {
+        "problema": f"Incidencia recurrente #{n}",
+        "ubicacion": LUGARES[n % len(LUGARES)],
+        "como": "Paro súbito del equipo",
+        "cuando": f"Turno {n % 3 + 1}",
+        "quien": "Operador de turno",
+        "quePaso": f"El equipo {n} se detuvo tras una sobrecarga",
+    }
+
+
+def _solve(rnd: random.Random, args) -> Tuple[str, str, Any]:
+    if rnd.random() < 0.5:
+        k = rnd.randint(2, 6)
+        return "POST", "/solve", {"title": "Derivada", "description": f"Calcula la derivada de x^{k} + {k}*x", "type": "matematico"}
+    return "POST", "/solve", {"title": "Retraso en entregas", "description": "Los pedidos llegan tarde al cliente"}
+
+
+def _problemas(rnd: random.Random, args) -> Tuple[str, str, Any]:
+    return "GET", "/problems?limit=20", None
+
+
+def _metodologia(rnd: random.Random, args) -> Tuple[str, str, Any]:
+    if rnd.random() < 0.5:
+        causas = [{"name": rnd.choice(CAUSAS), "frequency": rnd.randint(1, 20)} for _ in range(50)]
+        return "POST", "/paretoanalysis/", {"metodo": "pareto", "respuesta": "", "causes": causas}
+    modos = [
+        {"mode": f"Fallo {i}", "severity": rnd.randint(1, 10), "occurrence": rnd.randint(1, 10), "detection": rnd.randint(1, 10)}
+        for i in range(50)
+    ]
+    return "POST", "/fmeaanalysis/", {"metodo": "fmea", "respuesta": "", "failureModes": modos}
+
+
+ESCENARIOS: Dict[str, Callable[[random.Random, Any], Tuple[str, str, Any]]] = {
+    "analizar": _analizar,
+    "solve": _solve,
+    "problemas": _problemas,
+    "metodologia": _metodologia,
+}
+
+
+def parsear_mezcla(texto: str) -> Dict[str, float]:
+    mezcla = {}
+    for parte in texto.split(","):
+        nombre, _, peso = parte.partition("=")
+        nombre = nombre.strip()
+        if nombre not in ESCENARIOS:
+            raise SystemExit(f"escenario desconocido: {nombre} (disponibles: {', '.join(ESCENARIOS)})")
+        mezcla[nombre] = float(peso or 1)
+    return mezcla
+
+
+# --- Estadísticas ---
+
+def percentil(ordenados: List[float], p: float) -> float:
+    if not ordenados:
+        return 0.0
+    k = (len(ordenados) - 1) * p
+    i = int(k)
+    j = min(i + 1, len(ordenados) - 1)
+    return ordenados[i] + (ordenados[j] - ordenados[i]) * (k - i)
+
+
+def resumir(latencias: List[float], errores: int, duracion: float) -> Dict[str, float]:
+    ordenadas = sorted(latencias)
+    total = len(ordenadas)
+    return {
+        "peticiones": total,
+        "errores": errores,
+        "tasa_error": round(errores / total, 4) if total else 0.0,
+        "throughput_rps": round(total / duracion, 2) if duracion else 0.0,
+        "p50_ms": round(percentil(ordenadas, 0.50) * 1000, 2),
+        "p95_ms": round(percentil(ordenadas, 0.95) * 1000, 2),
+        "p99_ms": round(percentil(ordenadas, 0.99) * 1000, 2),
+        "max_ms": round(ordenadas[-1] * 1000, 2) if ordenadas else 0.0,
+    }
+
+
+class Registro:
+    """Latencias y errores por escenario, descartando el calentamiento."""
+
+    def __init__(self, desde: float):
+        self.desde = desde
+        self.latencias: Dict[str, List[float]] = defaultdict(list)
+        self.errores: Dict[str, int] = defaultdict(int)
+        self.tipos_error: Dict[str, int] = defaultdict(int)
+
+    def anotar(self, escenario: str, programado: float, latencia: float, error: Optional[str]) -> None:
+        if programado < self.desde:
+            return
+        self.latencias[escenario].append(latencia)
+        if error:
+            self.errores[escenario] += 1
+            self.tipos_error[error] += 1
+
+    def resultado(self, duracion: float) -> Dict[str, Any]:
+        todas = [l for ls in self.latencias.values() for l in ls]
+        return {
+            "total": resumir(todas, sum(self.errores.values()), duracion),
+            "escenarios": {
+                nombre: resumir(self.latencias[nombre], self.errores[nombre], duracion)
+                for nombre in sorted(self.latencias)
+            },
+            "tipos_error": dict(self.tipos_error),
+        }
+
+
+# --- Generadores de carga ---
+
+async def carga_cerrada(enviar, concurrencia: int, fin: float) -> None:
+    async def cliente():
+        while time.perf_counter() < fin:
+            await enviar(time.perf_counter())
+
+    await asyncio.gather(*(cliente() for _ in range(concurrencia)))
+
+
+async def carga_abierta(enviar, tasa: float, fin: float, max_pendientes: int, poisson: bool, rnd: random.Random) -> int:
+    """Lanza peticiones a ritmo fijo sin esperar respuestas; devuelve las descartadas."""
+    pendientes = set()
+    descartadas = 0
+    siguiente = time.perf_counter()
+    while siguiente < fin:
+        espera = siguiente - time.perf_counter()
+        if espera > 0:
+            await asyncio.sleep(espera)
+        if len(pendientes) >= max_pendientes:
+            # El generador no puede mantener el ritmo: se cuenta como error, no se retrasa
+            descartadas += 1
+            await enviar(siguiente, descartada=True)
+        else:
+            tarea = asyncio.ensure_future(enviar(siguiente))
+            pendientes.add(tarea)
+            tarea.add_done_callback(pendientes.discard)
+        siguiente += rnd.expovariate(tasa) if poisson else 1 / tasa
+    if pendientes:
+        await asyncio.gather(*pendientes)
+    return descartadas
+
+
+async def ejecutar_carga(http: httpx.AsyncClient, args, mezcla: Dict[str, float]) -> Dict[str, Any]:
+    rnd = random.Random(args.semilla)
+    nombres, pesos = list(mezcla), list(mezcla.values())
+    inicio = time.perf_counter()
+    registro = Registro(desde=inicio + args.calentamiento)
+    fin = inicio + args.calentamiento + args.duracion
+
+    async def enviar(programado: float, descartada: bool = False) -> None:
+        escenario = rnd.choices(nombres, pesos)[0]
+        if descartada:
+            registro.anotar(escenario, programado, time.perf_counter() - programado, "descartada")
+            return
+        metodo, ruta, cuerpo = ESCENARIOS[escenario](rnd, args)
+        error = None
+        try:
+            # Cada usuario simulado tiene su propia API key (y su cubo en el control de admisión)
+            cabeceras = {"X-API-Key": f"bench-{rnd.randrange(args.usuarios)}"}
+            r = await http.request(metodo, ruta, json=cuerpo, headers=cabeceras)
+            if r.status_code >= 400:
+                error = f"http_{r.status_code}"
+        except httpx.HTTPError as e:
+            error = type(e).__name__
+        registro.anotar(escenario, programado, time.perf_counter() - programado, error)
+
+    if args.tasa:
+        await carga_abierta(enviar, args.tasa, fin, args.max_pendientes, args.poisson, rnd)
+    else:
+        await carga_cerrada(enviar, args.concurrencia, fin)
+    # En lazo abierto la duración medida es la ventana de llegadas, no la del último rezagado
+    return registro.resultado(args.duracion)
+
+
+# --- Servidor bajo prueba ---
+
+def _vmhwm_kb(pid: int) -> int:
+    """Pico de memoria residente de un proceso y sus hijos (Linux, /proc)."""
+    total = 0
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for linea in f:
+                if linea.startswith("VmHWM:"):
+                    total += int(linea.split()[1])
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            hijos = [int(h) for h in f.read().split()]
+    except OSError:
+        return total
+    return total + sum(_vmhwm_kb(h) for h in hijos)
+
+
+def preparar_entorno(args, stub_url: str) -> Dict[str, str]:
+    entorno = {
+        "OPENAI_API_KEY": "stub",
+        "OPENAI_BASE_URL": stub_url,
+        # Estado del benchmark en un directorio temporal: cada ejecución parte de cero
+        "SOLVER_DB_PATH": os.path.join(args.tmp, "solver.db"),
+        "AUDIT_DIR": os.path.join(args.tmp, "logs"),
+        "LLM_CACHE_PATH": os.path.join(args.tmp, "cache.db"),
+        # Las API keys de los usuarios simulados: solo las de esta lista tienen cubo propio
+        "ADMISSION_API_KEYS": ",".join(f"bench-{n}" for n in range(args.usuarios)),
+    }
+    if args.entorno:
+        entorno.update(dict(par.split("=", 1) for par in args.entorno))
+    return entorno
+
+
+async def en_subproceso(args, entorno, mezcla) -> Dict[str, Any]:
+    puerto = puerto_libre()
+    env = {
+        **os.environ, **entorno,
+        "PORT": str(puerto), "HOST": "127.0.0.1",
+        "WEB_CONCURRENCY": str(args.workers), "LOG_LEVEL": "warning",
+    }
+    proceso = subprocess.Popen(
+        [sys.executable, os.path.join(BACKEND_DIR, "lanzador.py")],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    limites = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{puerto}", timeout=args.timeout, limits=limites) as http:
+            limite = time.perf_counter() + 60
+            while True:
+                if proceso.poll() is not None or time.perf_counter() > limite:
+                    raise SystemExit("el servidor no arrancó")
+                try:
+                    if (await http.get("/")).status_code == 200:
+                        break
+                except httpx.TransportError:
+                    await asyncio.sleep(0.05)
+            resultado = await ejecutar_carga(http, args, mezcla)
+        resultado["rss_pico_mb"] = round(_vmhwm_kb(proceso.pid) / 1024, 1)
+    finally:
+        proceso.terminate()
+        proceso.wait(timeout=30)
+    return resultado
+
+
+async def en_proceso(args, entorno, mezcla) -> Dict[str, Any]:
+    os.environ.update(entorno)
+    sys.path.insert(0, BACKEND_DIR)
+    import servidor
+
+    app = servidor.create_app()
+    transporte = httpx.ASGITransport(app=app)
+    # El lifespan ejecuta los manejadores de cierre (vaciar auditoría, cerrar clientes)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transporte, base_url="http://bench", timeout=args.timeout) as http:
+            resultado = await ejecutar_carga(http, args, mezcla)
+    # Incluye al generador de carga y al stub, que comparten proceso
+    resultado["rss_pico_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    return resultado
+
+
+# --- Comparación con la baseline ---
+
+def comparar(actual: Dict[str, Any], base: Dict[str, Any], tolerancia: float, margen_ms: float) -> List[str]:
+    """Devuelve las regresiones (vacía si no hay)."""
+    regresiones = []
+    grupos = [("total", actual["total"], base.get("total", {}))]
+    grupos += [
+        (f"escenarios.{n}", m, base.get("escenarios", {}).get(n, {}))
+        for n, m in actual["escenarios"].items()
+    ]
+    for nombre, nuevo, viejo in grupos:
+        if not viejo:
+            continue
+        for clave in ("p95_ms", "p99_ms"):
+            if nuevo[clave] > viejo[clave] * (1 + tolerancia) and nuevo[clave] - viejo[clave] > margen_ms:
+                regresiones.append(f"{nombre}.{clave}: {viejo[clave]} -> {nuevo[clave]}")
+        if nuevo["throughput_rps"] < viejo["throughput_rps"] * (1 - tolerancia):
+            regresiones.append(f"{nombre}.throughput_rps: {viejo['throughput_rps']} -> {nuevo['throughput_rps']}")
+        if nuevo["tasa_error"] > viejo["tasa_error"] + 0.01:
+            regresiones.append(f"{nombre}.tasa_error: {viejo['tasa_error']} -> {nuevo['tasa_error']}")
+    if base.get("rss_pico_mb") and actual["rss_pico_mb"] > base["rss_pico_mb"] * (1 + tolerancia):
+        regresiones.append(f"rss_pico_mb: {base['rss_pico_mb']} -> {actual['rss_pico_mb']}")
+    return regresiones
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    carga = parser.add_mutually_exclusive_group()
+    carga.add_argument("--concurrencia", type=int, default=8)
+    carga.add_argument("--tasa", type=float, help="peticiones por segundo (lazo abierto)")
+    parser.add_argument("--poisson", action="store_true", help="llegadas exponenciales en vez de equiespaciadas")
+    parser.add_argument("--max-pendientes", type=int, default=1000)
+    parser.add_argument("--duracion", type=float, default=15.0)
+    parser.add_argument("--calentamiento", type=float, default=2.0)
+    parser.add_argument("--mezcla", default=MEZCLA_DEFECTO)
+    parser.add_argument("--prompts-distintos", type=int, default=200)
+    parser.add_argument("--usuarios", type=int, default=50, help="clientes distintos simulados")
+    parser.add_argument("--semilla", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--modo", choices=["subproceso", "proceso"], default="subproceso")
+    parser.add_argument("--workers", type=int, default=1, help="workers de uvicorn en modo subproceso")
+    parser.add_argument("--entorno", nargs="*", metavar="VAR=VALOR", help="variables extra para el servidor")
+    parser.add_argument("--stub-latencia", type=float, default=0.3)
+    parser.add_argument("--stub-jitter", type=float, default=0.1)
+    parser.add_argument("--stub-tokens-seg", type=float, default=0.0)
+    parser.add_argument("--stub-error", type=float, default=0.0)
+    parser.add_argument("--salida", help="fichero JSON de resultados (por defecto, stdout)")
+    parser.add_argument("--baseline", help="resultado previo con el que comparar")
+    parser.add_argument("--guardar-baseline", help="guarda este resultado como baseline")
+    parser.add_argument("--tolerancia", type=float, default=0.15)
+    parser.add_argument("--margen-ms", type=float, default=5.0, help="diferencia mínima de latencia para contar como regresión")
+    parser.add_argument("--tmp", default=None)
+    args = parser.parse_args()
+    args.tmp = args.tmp or tempfile.mkdtemp(prefix="bench_carga_")
+    mezcla = parsear_mezcla(args.mezcla)
+
+    stub = crear_stub(
+        args.stub_latencia, jitter=args.stub_jitter, tokens_por_seg=args.stub_tokens_seg, tasa_error=args.stub_error,
+    )
+    with StubEnHilo(stub) as servidor_stub:
+        entorno = preparar_entorno(args, servidor_stub.base_url)
+        ejecutar = en_subproceso if args.modo == "subproceso" else en_proceso
+        resultado = asyncio.run(ejecutar(args, entorno, mezcla))
+        resultado["llamadas_llm"] = stub.state.llamadas
+
+    resultado["config"] = {
+        "modo": args.modo,
+        "carga": {"tasa": args.tasa, "poisson": args.poisson} if args.tasa else {"concurrencia": args.concurrencia},
+        "duracion": args.duracion,
+        "mezcla": mezcla,
+        "usuarios": args.usuarios,
+        "workers": args.workers,
+        "stub": {"latencia": args.stub_latencia, "jitter": args.stub_jitter,
+                 "tokens_seg": args.stub_tokens_seg, "error": args.stub_error},
+    }
+
+    codigo = 0
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            base = json.load(f)
+        if base.get("config") != resultado["config"]:
+            print("aviso: la baseline se tomó con otra configuración", file=sys.stderr)
+        resultado["regresiones"] = comparar(resultado, base, args.tolerancia, args.margen_ms)
+        for regresion in resultado["regresiones"]:
+            print(f"REGRESIÓN {regresion}", file=sys.stderr)
+        codigo = 1 if resultado["regresiones"] else 0
+
+    texto = json.dumps(resultado, indent=2, ensure_ascii=False)
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            f.write(texto + "\n")
+    else:
+        print(texto)
+    if args.guardar_baseline:
+        with open(args.guardar_baseline, "w", encoding="utf-8") as f:
+            f.write(texto + "\n")
+    return codigo
+
+
+if __name__ == "__main__":
+    sys.exit(main())
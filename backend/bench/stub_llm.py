@@ -0,0 +1,173 @@
+"""Servidor LLM falso compatible con la API de OpenAI (solo para benchmarks).
+
+Responde ``POST /v1/chat/completions`` tras una latencia configurable, de modo
+que se pueda medir el backend sin gastar cuota ni depender de la red. Con
+``"stream": true`` envía el texto palabra a palabra como chunks SSE.
+
+Parámetros del stub:
+    latencia         espera antes del primer token (segundos)
+    jitter           variación uniforme ±jitter sobre la latencia
+    tokens_por_seg   ritmo de generación (0 = todo el texto de golpe)
+    tasa_error       fracción de llamadas que responden 500
+    tasa_lenta       fracción de llamadas que esperan ``latencia_lenta`` (cola de latencia)
+
+Los parámetros de latencia y error viven en ``stub.state`` y se pueden cambiar
+en caliente (p.ej. simular una caída con ``stub.state.tasa_error = 1``).
+
+El uso (``usage``) se calcula contando palabras, y se envía al final del
+stream si la petición trae ``stream_options.include_usage``.
+
+Uso directo:  python bench/stub_llm.py --port 8900 --latency 0.5 --jitter 0.1 --token-rate 50
+              [--error-rate 0.05] [--slow-rate 0.05 --slow-latency 5]
+"""
+import argparse
+import asyncio
+import json
+import random
+import socket
+import threading
+import time
+from typing import Optional
+from uuid import uuid4
+
+import uvicorn
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.requests import ClientDisconnect
+
+
+def _contar_tokens(mensajes) -> int:
+    return sum(len(str(m.get("content", "")).split()) for m in mensajes)
+
+
+def crear_stub(
+    latencia: float = 0.5,
+    texto: str = "Causa raíz simulada por el stub LLM.",
+    jitter: float = 0.0,
+    tokens_por_seg: float = 0.0,
+    tasa_error: float = 0.0,
+    tasa_lenta: float = 0.0,
+    latencia_lenta: float = 0.0,
+    semilla: Optional[int] = None,
+) -> FastAPI:
+    stub = FastAPI()
+    # Con semilla, la secuencia de llamadas lentas/erróneas es reproducible
+    azar = random.Random(semilla)
+    stub.state.llamadas = 0
+    stub.state.latencia = latencia
+    stub.state.jitter = jitter
+    stub.state.tasa_error = tasa_error
+    stub.state.tasa_lenta = tasa_lenta
+    stub.state.latencia_lenta = latencia_lenta
+    palabras = texto.split(" ")
+
+    def _uso(cuerpo) -> dict:
+        prompt = _contar_tokens(cuerpo.get("messages", []))
+        return {"prompt_tokens": prompt, "completion_tokens": len(palabras), "total_tokens": prompt + len(palabras)}
+
+    @stub.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        try:
+            cuerpo = await request.json()
+        except ClientDisconnect:
+            # El cliente canceló la llamada (p.ej. una cobertura que perdió la carrera)
+            return Response(status_code=499)
+        stub.state.llamadas += 1
+        estado = stub.state
+        if estado.tasa_lenta and azar.random() < estado.tasa_lenta:
+            await asyncio.sleep(estado.latencia_lenta)
+        else:
+            await asyncio.sleep(max(0.0, estado.latencia + azar.uniform(-estado.jitter, estado.jitter)))
+        if estado.tasa_error and azar.random() < estado.tasa_error:
+            return JSONResponse({"error": {"message": "error simulado", "type": "server_error"}}, status_code=500)
+        if cuerpo.get("stream"):
+            incluir_uso = bool((cuerpo.get("stream_options") or {}).get("include_usage"))
+            return StreamingResponse(
+                _chunks(cuerpo.get("model", "stub"), _uso(cuerpo) if incluir_uso else None),
+                media_type="text/event-stream",
+            )
+        if tokens_por_seg:
+            await asyncio.sleep(len(palabras) / tokens_por_seg)
+        return {
+            "id": f"chatcmpl-{uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": cuerpo.get("model", "stub"),
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": texto},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": _uso(cuerpo),
+        }
+
+    async def _chunks(modelo: str, uso):
+        id_ = f"chatcmpl-{uuid4().hex}"
+        base = {"id": id_, "object": "chat.completion.chunk", "created": int(time.time()), "model": modelo}
+        for i, palabra in enumerate(palabras):
+            if tokens_por_seg and i:
+                await asyncio.sleep(1 / tokens_por_seg)
+            chunk = {
+                **base,
+                "choices": [{"index": 0, "delta": {"content": palabra if i == 0 else " " + palabra}, "finish_reason": None}],
+            }
+            yield f"data: {json.dumps(chunk)}\n\n"
+        if uso is not None:
+            yield f"data: {json.dumps({**base, 'choices': [], 'usage': uso})}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return stub
+
+
+def puerto_libre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class StubEnHilo:
+    """Arranca el stub con uvicorn en un hilo en segundo plano."""
+
+    def __init__(self, app: FastAPI, port: int = 0):
+        self.app = app
+        self.port = port or puerto_libre()
+        config = uvicorn.Config(app, host="127.0.0.1", port=self.port, log_level="warning")
+        self._server = uvicorn.Server(config)
+        self._hilo = threading.Thread(target=self._server.run, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/v1"
+
+    def __enter__(self):
+        self._hilo.start()
+        while not self._server.started:
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc):
+        self._server.should_exit = True
+        self._hilo.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--token-rate", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--slow-rate", type=float, default=0.0)
+    parser.add_argument("--slow-latency", type=float, default=0.0)
+    args = parser.parse_args()
+    stub = crear_stub(
+        args.latency,
+        jitter=args.jitter,
+        tokens_por_seg=args.token_rate,
+        tasa_error=args.error_rate,
+        tasa_lenta=args.slow_rate,
+        latencia_lenta=args.slow_latency,
+    )
+    uvicorn.run(stub, host="127.0.0.1", port=args.port)
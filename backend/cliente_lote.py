@@ -0,0 +1,74 @@
+"""Cliente de línea de comandos para POST /solve/batch.
+
+Envía un fichero NDJSON (o un array JSON) de problemas en streaming y
+escribe los resultados NDJSON según llegan, sin cargar nada entero en memoria.
+Pensado para lanzarse desde cron:
+
+    python cliente_lote.py problemas.ndjson -o resultados.ndjson --url http://127.0.0.1:8000
+
+Código de salida 0 si todos los elementos se resolvieron, 1 si alguno falló.
+"""
+import argparse
+import json
+import sys
+
+import httpx
+
+CHUNK = 64 * 1024
+
+
+def leer_en_trozos(f):
+    while True:
+        trozo = f.read(CHUNK)
+        if not trozo:
+            return
+        yield trozo
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Resuelve un lote de problemas vía /solve/batch.")
+    parser.add_argument("entrada", help="Fichero NDJSON o array JSON ('-' para stdin)")
+    parser.add_argument("-o", "--salida", default="-", help="Fichero NDJSON de resultados ('-' para stdout)")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="URL base del backend")
+    parser.add_argument("--timeout", type=float, default=None, help="Timeout de lectura en segundos")
+    args = parser.parse_args()
+
+    entrada = sys.stdin.buffer if args.entrada == "-" else open(args.entrada, "rb")
+    salida = sys.stdout if args.salida == "-" else open(args.salida, "w", encoding="utf-8")
+    es_array = args.entrada.endswith(".json")
+    tipo = "application/json" if es_array else "application/x-ndjson"
+
+    ok = errores = 0
+    try:
+        with httpx.stream(
+            "POST",
+            args.url.rstrip("/") + "/solve/batch",
+            content=leer_en_trozos(entrada),
+            headers={"Content-Type": tipo},
+            timeout=httpx.Timeout(30, read=args.timeout),
+        ) as respuesta:
+            if respuesta.status_code != 200:
+                respuesta.read()
+                print(f"Error {respuesta.status_code}: {respuesta.text}", file=sys.stderr)
+                return 2
+            for linea in respuesta.iter_lines():
+                if not linea:
+                    continue
+                salida.write(linea + "\n")
+                salida.flush()
+                if json.loads(linea).get("ok"):
+                    ok += 1
+                else:
+                    errores += 1
+    finally:
+        if entrada is not sys.stdin.buffer:
+            entrada.close()
+        if salida is not sys.stdout:
+            salida.close()
+
+    print(f"{ok} resueltos, {errores} con error", file=sys.stderr)
+    return 1 if errores else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,37 @@
+"""Arranque de producción del servidor unificado.
+
+Levanta ``servidor:create_app`` con varios workers (uno por CPU salvo que se
+indique WEB_CONCURRENCY), sin el vigilante de ficheros de ``--reload``.
+
+Uso:  python backend/lanzador.py        (PORT, HOST, WEB_CONCURRENCY, LOG_LEVEL,
+                                         FORWARDED_ALLOW_IPS)
+"""
+import os
+
+import uvicorn
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def main() -> None:
+    workers = int(os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 1)))
+    uvicorn.run(
+        "servidor:create_app",
+        factory=True,
+        app_dir=BACKEND_DIR,
+        host=os.getenv("HOST", "0.0.0.0"),
+        port=int(os.getenv("PORT", "8000")),
+        workers=workers,
+        reload=False,
+        # X-Forwarded-For / X-Forwarded-Proto solo se respetan si llegan del proxy:
+        # FORWARDED_ALLOW_IPS con la IP (o red) del router del PaaS, nunca "*"
+        # si el servidor es accesible directamente (la IP del cliente sería falsificable)
+        proxy_headers=True,
+        forwarded_allow_ips=os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1"),
+        log_level=os.getenv("LOG_LEVEL", "info"),
+        timeout_graceful_shutdown=int(os.getenv("GRACEFUL_TIMEOUT", "20")),
+    )
+
+
+if __name__ == "__main__":
+    main()
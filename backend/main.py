@@ -1,32 +1,38 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import APIRouter, FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from datetime import datetime
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from typing import Optional
+import asyncio
+import json
 import os
+import weakref
 
-# Intentamos importar la nueva clase OpenAI (openai>=1.0.0)
-try:
-    from openai import OpenAI
-    openai_client_available = True
-except Exception:
-    # Si falla la importación, marcamos que no hay cliente moderno instalado
-    openai_client_available = False
-
-app = FastAPI()
-
-# Habilitar CORS (útil para desarrollo desde http://localhost:3000)
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["http://localhost:3000", "http://127.0.0.1:3000"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+from app.admision import (
+    ClienteDesconectado,
+    Rechazado,
+    esperar_turno,
+    identificar_cliente,
+    obtener_planificador,
+    prioridad_de,
+)
+from app.auditoria import obtener_escritor
+from app.cache import clave_cache, obtener_cache
+from app.metricas import MiddlewareMetricas, router as router_metricas
+from app.llm import (
+    LLMError,
+    cerrar_clientes,
+    comprobar_configuracion,
+    construir_mensajes,
+    es_reutilizable,
+    obtener_cliente,
+    obtener_cliente_mock,
 )
+from app.sesiones import SESSION_TASK_CHARS, TAREAS_POR_DEFECTO, construir_mensajes_sesion, obtener_sesiones
+from app.similares import buscar_previo, indexar, quiere_previo
+from app.trabajos import encolar_trabajo, quiere_trabajo, registrar_tipo, router as router_trabajos
 
-# Aseguramos que el directorio de logs exista
-LOG_DIR = "logs"
-LOG_FILE = os.path.join(LOG_DIR, "analisis_log.txt")
-os.makedirs(LOG_DIR, exist_ok=True)
+router = APIRouter()
 
 class ProblemaInput(BaseModel):
     problema: str
@@ -36,31 +42,46 @@ class ProblemaInput(BaseModel):
     quien: str
     quePaso: str
 
-def registrar_auditoria(entrada: ProblemaInput, respuesta: str):
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    log_entry = (
-        f"---\n"
-        f"Fecha y hora: {timestamp}\n"
-        f"Problema: {entrada.problema}\n"
-        f"Ubicación: {entrada.ubicacion}\n"
-        f"Cómo: {entrada.como}\n"
-        f"Cuándo: {entrada.cuando}\n"
-        f"Quién: {entrada.quien}\n"
-        f"Qué pasó: {entrada.quePaso}\n"
-        f"Respuesta generada:\n{respuesta}\n"
-    )
-    with open(LOG_FILE, "a", encoding="utf-8") as f:
-        f.write(log_entry)
+def registrar_auditoria(entrada: ProblemaInput, respuesta: str, previo: dict = None):
+    # Solo encola el registro: la escritura (JSONL por lotes, con rotación)
+    # la hace una tarea de fondo fuera del event loop
+    registro = {**entrada.model_dump(), "respuesta": respuesta}
+    if previo is not None:
+        # Respuesta reutilizada de otro problema: reindexar no debe tomarla como propia
+        registro["previo"] = previo["id"]
+    obtener_escritor().registrar(registro)
 
-# Prepara cliente OpenAI si existe clave y la librería moderna está disponible
+@router.on_event("shutdown")
+async def vaciar_auditoria():
+    # Garantiza que los registros pendientes llegan a disco antes de salir
+    await obtener_escritor().detener()
+
+# El cliente OpenAI asíncrono (pool HTTP compartido) se crea en el primer uso
 OPENAI_KEY = os.getenv("OPENAI_API_KEY")
-client = None
-if OPENAI_KEY and openai_client_available:
-    client = OpenAI(api_key=OPENAI_KEY)
 
-@app.post("/analizar-problema")
-async def analizar_problema(datos: ProblemaInput):
-    prompt = (
+@router.on_event("startup")
+def comprobar_llm():
+    # Un LLM_BACKENDS mal formado impide arrancar en vez de fallar en cada petición
+    comprobar_configuracion()
+
+@router.on_event("shutdown")
+async def cerrar_cliente_llm():
+    await cerrar_clientes()
+
+def texto_problema(datos: ProblemaInput) -> str:
+    return "\n".join([datos.problema, datos.ubicacion, datos.como, datos.cuando, datos.quien, datos.quePaso])
+
+async def indexar_analisis(datos: ProblemaInput, resultado: str):
+    # Solo las respuestas recién generadas por el LLM: las reutilizadas ya están en el
+    # índice, y las de un backend de respaldo o mock no valen como respuesta previa
+    if es_reutilizable(resultado):
+        await indexar("analisis", texto_problema(datos), resultado)
+
+def vista_previo(previo: dict) -> dict:
+    return {"id": previo["id"], "similitud": previo["similitud"], "problema": previo["problema"]}
+
+def construir_prompt(datos: ProblemaInput) -> str:
+    return (
         "Un usuario ha reportado un problema con los siguientes detalles:\n"
         f"- Problema: {datos.problema}\n"
         f"- Ubicación: {datos.ubicacion}\n"
@@ -72,6 +93,27 @@ async def analizar_problema(datos: ProblemaInput):
         "describe la causa raíz más probable y sugiere un enfoque de análisis estructurado."
     )
 
+async def pedir_turno(request: Request):
+    """Turno del planificador para llamar al LLM, o el error HTTP correspondiente."""
+    try:
+        return await obtener_planificador().adquirir(
+            identificar_cliente(request), prioridad_de(request), request.is_disconnected
+        )
+    except Rechazado as e:
+        raise HTTPException(
+            status_code=429,
+            detail=f"Demasiadas peticiones ({e.motivo}). Reintenta más tarde.",
+            headers={"Retry-After": e.cabecera_retry_after},
+        )
+    except ClienteDesconectado:
+        # 499 (convención de nginx): nadie va a leer esta respuesta
+        raise HTTPException(status_code=499, detail="El cliente cerró la conexión")
+
+@router.post("/analizar-problema")
+async def analizar_problema(datos: ProblemaInput, request: Request):
+    prompt = construir_prompt(datos)
+    client = obtener_cliente()
+
     # Si no tenemos cliente moderno disponible, indicamos el problema
     if not client:
         raise HTTPException(
@@ -83,46 +125,246 @@ async def analizar_problema(datos: ProblemaInput):
             ),
         )
 
+    cache = obtener_cache()
+    clave = clave_cache(prompt, client.modelo)
+    # Los aciertos de caché no gastan cuota: solo se pide turno si hay que llamar al LLM
+    resultado = await cache.obtener(clave)
+    if resultado is None and quiere_previo(request):
+        # Un problema casi idéntico ya analizado: se responde al instante sin gastar LLM
+        previo = await buscar_previo("analisis", texto_problema(datos))
+        if previo is not None:
+            registrar_auditoria(datos, previo["respuesta"], previo)
+            return {"analisis": previo["respuesta"], "previo": vista_previo(previo)}
+    if resultado is None and quiere_trabajo(request):
+        # Respuesta asíncrona: 202 con job_id; con acierto de caché se responde ya
+        return await encolar_trabajo("analizar", {"datos": datos.model_dump(), "cliente": identificar_cliente(request)})
+    if resultado is None:
+        async with await pedir_turno(request):
+            try:
+                # Llamada asíncrona (el event loop sigue atendiendo otras peticiones),
+                # cacheada por prompt normalizado y desduplicada entre peticiones idénticas.
+                # El disco ya se consultó arriba: aquí solo se mira la memoria
+                resultado = await cache.obtener_o_calcular(
+                    clave, lambda: client.completar(construir_mensajes(prompt)), disco=False
+                )
+            except LLMError as e:
+                raise HTTPException(status_code=500, detail=f"Error al generar el análisis: {str(e)}")
+        await indexar_analisis(datos, resultado)
+
+    # Registrar en el log
+    registrar_auditoria(datos, resultado)
+
+    return {"analisis": resultado}
+
+async def analizar_job(entrada, progreso):
+    """Trabajo en segundo plano de /analizar-problema (ver app/trabajos.py)."""
+    datos = ProblemaInput.model_validate(entrada["datos"])
+    client = obtener_cliente()
+    if not client:
+        raise LLMError("El cliente moderno de OpenAI no está disponible o no se encontró OPENAI_API_KEY.")
+    prompt = construir_prompt(datos)
+
+    async def en_espera(rechazo: Rechazado):
+        await progreso(0.05, f"Esperando turno del LLM ({rechazo.motivo})")
+
+    await progreso(0.05, "Esperando turno del LLM")
+    # Prioridad de lotes: la UI interactiva pasa antes; sin 429, se reintenta
+    async with await esperar_turno(entrada["cliente"], "batch", en_espera):
+        await progreso(0.2, "Generando el análisis")
+        resultado = await obtener_cache().obtener_o_calcular(
+            clave_cache(prompt, client.modelo), lambda: client.completar(construir_mensajes(prompt))
+        )
+    await indexar_analisis(datos, resultado)
+    registrar_auditoria(datos, resultado)
+    return {"analisis": resultado}
+
+registrar_tipo("analizar", analizar_job)
+
+def evento_sse(datos: dict, evento: str = None) -> str:
+    # Los datos van como JSON para que los saltos de línea del texto no rompan el framing SSE
+    cabecera = f"event: {evento}\n" if evento else ""
+    return f"{cabecera}data: {json.dumps(datos, ensure_ascii=False)}\n\n"
+
+async def generar_eventos(client, datos: ProblemaInput, resultado: str = None, previo: dict = None):
+    """Reenvía los tokens como eventos SSE y audita el texto completo al terminar.
+
+    Si el cliente se desconecta, Starlette cancela este generador y la
+    cancelación se propaga a la llamada upstream (que cierra su conexión).
+    ``resultado`` es el acierto de caché (o la respuesta ``previo`` reutilizada)
+    si el endpoint ya lo consultó.
+    """
+    prompt = construir_prompt(datos)
+    cache = obtener_cache()
+    clave = clave_cache(prompt, client.modelo)
+
+    if resultado is None:
+        # El endpoint ya consultó el disco; en memoria puede haber llegado mientras esperaba turno
+        resultado = await cache.obtener(clave, disco=False)
+    if resultado is not None:
+        # Acierto de caché: se envía la respuesta completa en un único evento
+        yield evento_sse({"delta": resultado})
+    else:
+        fragmentos = []
+        try:
+            async for delta in client.completar_stream(construir_mensajes(prompt)):
+                fragmentos.append(delta)
+                yield evento_sse({"delta": delta})
+        except LLMError as e:
+            yield evento_sse({"detail": f"Error al generar el análisis: {str(e)}"}, evento="error")
+            return
+        resultado = "".join(fragmentos)
+        # El enrutador marca cada fragmento con el backend que respondió
+        if fragmentos and es_reutilizable(fragmentos[0]):
+            await cache.guardar(clave, resultado)
+            await indexar_analisis(datos, resultado)
+
+    registrar_auditoria(datos, resultado, previo)
+    fin = {"analisis": resultado}
+    if previo is not None:
+        fin["previo"] = vista_previo(previo)
+    yield evento_sse(fin, evento="fin")
+
+def respuesta_sse(eventos) -> StreamingResponse:
+    return StreamingResponse(
+        eventos,
+        media_type="text/event-stream",
+        # Sin caché ni buffering en proxies (nginx), para no retrasar el primer byte
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+async def con_turno(turno, eventos):
     try:
-        # Usando la nueva interfaz: client.chat.completions.create(...)
-        response = client.chat.completions.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": "Eres un experto en resolución de problemas, metodologías 5 Porqués, Ishikawa, FMEA y mejora continua."},
-                {"role": "user", "content": prompt}
-            ],
+        async for evento in eventos:
+            yield evento
+    finally:
+        turno.liberar()
+
+@router.post("/analizar-problema/stream")
+async def analizar_problema_stream(datos: ProblemaInput, request: Request):
+    client = obtener_cliente()
+    if not client:
+        raise HTTPException(
+            status_code=500,
+            detail="El cliente moderno de OpenAI no está disponible o no se encontró OPENAI_API_KEY.",
         )
+    resultado = await obtener_cache().obtener(clave_cache(construir_prompt(datos), client.modelo))
+    if resultado is not None:
+        return respuesta_sse(generar_eventos(client, datos, resultado))
+    if quiere_previo(request):
+        previo = await buscar_previo("analisis", texto_problema(datos))
+        if previo is not None:
+            return respuesta_sse(generar_eventos(client, datos, previo["respuesta"], previo))
+    # El turno se pide antes de abrir el stream para poder responder 429
+    turno = await pedir_turno(request)
+    eventos = con_turno(turno, generar_eventos(client, datos))
+    # Si el stream nunca llega a iterarse (cliente caído antes del primer byte)
+    # el finally no se ejecuta: el turno se libera al recolectar el generador
+    weakref.finalize(eventos, turno.liberar)
+    return respuesta_sse(eventos)
 
-        # Extraer texto de la respuesta (compatibilidades con la estructura de retorno)
+# --- Sesiones de análisis guiado: el problema se envía una vez y cada paso se acumula ---
+
+class PasoSesion(BaseModel):
+    metodo: str
+    contenido: str
+
+class TareaSesion(BaseModel):
+    metodo: str = "5 porques"
+    tarea: Optional[str] = Field(None, max_length=SESSION_TASK_CHARS)
+
+async def sesion_o_404(sesion_id: str):
+    sesion = await asyncio.to_thread(obtener_sesiones().obtener, sesion_id)
+    if sesion is None:
+        raise HTTPException(status_code=404, detail="Sesión no encontrada o expirada")
+    return sesion
+
+@router.post("/sesiones")
+async def crear_sesion(datos: ProblemaInput):
+    sesion = await asyncio.to_thread(obtener_sesiones().crear, datos.model_dump())
+    return {"sesion_id": sesion["id"], "expira": sesion["expira"]}
+
+@router.get("/sesiones/{sesion_id}")
+async def consultar_sesion(sesion_id: str, historial: bool = False):
+    sesion = await sesion_o_404(sesion_id)
+    if historial:
+        sesion["historial"] = await asyncio.to_thread(obtener_sesiones().historial, sesion_id)
+    return sesion
+
+@router.post("/sesiones/{sesion_id}/pasos")
+async def agregar_paso_sesion(sesion_id: str, paso: PasoSesion):
+    sesion = await asyncio.to_thread(obtener_sesiones().agregar_paso, sesion_id, paso.metodo, paso.contenido)
+    if sesion is None:
+        raise HTTPException(status_code=404, detail="Sesión no encontrada o expirada")
+    return {"sesion_id": sesion_id, "paso": sesion["pasos"]}
+
+@router.post("/sesiones/{sesion_id}/analizar")
+async def analizar_sesion(sesion_id: str, datos: TareaSesion, request: Request):
+    """Paso con LLM: prompt = prefijo estable + resumen condensado + pasos recientes."""
+    client = obtener_cliente()
+    if not client:
+        raise HTTPException(
+            status_code=500,
+            detail="El cliente moderno de OpenAI no está disponible o no se encontró OPENAI_API_KEY.",
+        )
+    sesion = await sesion_o_404(sesion_id)
+    tarea = datos.tarea or TAREAS_POR_DEFECTO.get(datos.metodo, TAREAS_POR_DEFECTO["5 porques"])
+    mensajes = construir_mensajes_sesion(sesion, tarea)
+    async with await pedir_turno(request):
         try:
-            resultado = response.choices[0].message.content
-        except Exception:
-            # fallback a forma estilo diccionario si aplica
-            resultado = response["choices"][0]["message"]["content"]
+            resultado = await client.completar(mensajes)
+        except LLMError as e:
+            raise HTTPException(status_code=500, detail=f"Error al generar el análisis: {str(e)}")
+    sesion = await asyncio.to_thread(obtener_sesiones().agregar_paso, sesion_id, f"ia:{datos.metodo}", resultado)
+    return {
+        "analisis": resultado,
+        "paso": sesion["pasos"] if sesion else None,
+        "prompt_chars": sum(len(m["content"]) for m in mensajes),
+    }
 
-        # Registrar en el log
-        registrar_auditoria(datos, resultado)
+@router.get("/cache/stats")
+def estadisticas_cache():
+    return obtener_cache().stats()
 
-        return {"analisis": resultado}
+@router.get("/llm/stats")
+def estadisticas_llm():
+    # Con LLM_BACKENDS: latencias, coberturas y circuito de cada backend
+    estadisticas = getattr(obtener_cliente(), "stats", None)
+    return estadisticas() if estadisticas else {"backends": []}
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error al generar el análisis: {str(e)}")
+@router.get("/admision/stats")
+def estadisticas_admision():
+    return obtener_planificador().stats()
 
 # Ruta raíz simple
-@app.get("/")
+@router.get("/")
 def root():
     return {"mensaje": "Backend activo. Usa POST /analizar-problema para probar."}
 
 # Fallback: si no hay clave de OpenAI, devolvemos una respuesta mock simple
 if not OPENAI_KEY:
-    def generar_respuesta_mock(prompt: str) -> str:
-        return (
-            "Respuesta mock: análisis simulado. Si quieres la respuesta real, "
-            "configura la variable de entorno OPENAI_API_KEY con tu clave."
-        )
-
-    @app.post("/analizar-problema-mock")
+    @router.post("/analizar-problema-mock")
     async def analizar_problema_mock(datos: ProblemaInput):
-        resultado = generar_respuesta_mock(str(datos))
+        prompt = construir_prompt(datos)
+        resultado = await obtener_cliente_mock().completar(construir_mensajes(prompt))
         registrar_auditoria(datos, resultado)
         return {"analisis": resultado}
+
+    @router.post("/analizar-problema-mock/stream")
+    async def analizar_problema_mock_stream(datos: ProblemaInput):
+        return respuesta_sse(generar_eventos(obtener_cliente_mock(), datos))
+
+# App independiente (uvicorn main:app); el servidor unificado (servidor.py) monta solo el router
+app = FastAPI()
+
+# Habilitar CORS (útil para desarrollo desde http://localhost:3000)
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["http://localhost:3000", "http://127.0.0.1:3000"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+app.add_middleware(MiddlewareMetricas)
+app.include_router(router)
+app.include_router(router_trabajos)
+app.include_router(router_metricas)
@@ -0,0 +1,148 @@
+"""Servidor unificado: una sola app FastAPI que monta todas las superficies.
+
+Cada módulo ``main.py`` del proyecto expone un ``router`` (y sigue teniendo su
+``app`` independiente para desarrollo). ``create_app()`` los incluye en una
+única aplicación con un solo middleware CORS:
+
+    analisis     backend/main.py        /analizar-problema, /cache/stats ...
+    solver       backend/app/main.py    /solve, /problems, /problems/similar ...
+    metodologia  app/main.py            /fmeaanalysis/, /iniciar, /paso, /ws/analisis ...
+    preguntas    main.py                /pregunta/
+    plantilla    Templeted/main.py      /plantilla/
+
+Además expone ``/metrics`` (Prometheus) y ``/jobs`` (trabajos en segundo
+plano, ver app/trabajos.py) para todas ellas.
+
+Las dependencias pesadas (openai, numpy, sympy, jinja2) no se importan aquí:
+cada superficie las carga en la primera petición que las necesita.
+
+Uso (desde backend/):  uvicorn servidor:create_app --factory
+En producción:         python lanzador.py
+"""
+import importlib
+import importlib.machinery
+import importlib.util
+import os
+import sys
+from types import ModuleType
+from typing import Callable, Dict, List, Tuple
+
+from fastapi import APIRouter, FastAPI
+from fastapi.middleware.cors import CORSMiddleware
+
+from app.metricas import MiddlewareMetricas, router as router_metricas
+from app.sesiones import obtener_sesiones, sugerir_en_sesion
+from app.trabajos import router as router_trabajos
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+RAIZ = os.path.dirname(BACKEND_DIR)
+
+# Por defecto cualquier origen, como app/main.py y backend/app/main.py (ajústalo en producción)
+CORS_ORIGINS = os.getenv("CORS_ORIGINS", "*")
+# Lista separada por comas; vacío = todas las superficies
+APP_SURFACES = os.getenv("APP_SURFACES", "")
+
+
+def _cargar_fichero(alias: str, ruta: str) -> ModuleType:
+    # main.py de la raíz y Templeted/main.py comparten nombre con backend/main.py:
+    # se cargan por ruta con un alias propio
+    if alias in sys.modules:
+        return sys.modules[alias]
+    spec = importlib.util.spec_from_file_location(alias, ruta)
+    modulo = importlib.util.module_from_spec(spec)
+    sys.modules[alias] = modulo
+    spec.loader.exec_module(modulo)
+    return modulo
+
+
+def _cargar_paquete(alias: str, directorio: str, submodulo: str) -> ModuleType:
+    # La carpeta app/ de la raíz choca con el paquete backend/app: se registra
+    # como paquete "alias" para que sus imports relativos (.motor_analisis) funcionen
+    if alias not in sys.modules:
+        spec = importlib.machinery.ModuleSpec(alias, None, is_package=True)
+        spec.submodule_search_locations = [directorio]
+        sys.modules[alias] = importlib.util.module_from_spec(spec)
+    return importlib.import_module(f"{alias}.{submodulo}")
+
+
+def _en_path(directorio: str) -> None:
+    if directorio not in sys.path:
+        sys.path.insert(0, directorio)
+
+
+def _router_analisis() -> APIRouter:
+    _en_path(BACKEND_DIR)
+    return importlib.import_module("main").router
+
+
+def _router_solver() -> APIRouter:
+    _en_path(BACKEND_DIR)
+    return importlib.import_module("app.main").router
+
+
+def _router_metodologia() -> APIRouter:
+    return _cargar_paquete("metodologia", os.path.join(RAIZ, "app"), "main").router
+
+
+def _router_preguntas() -> APIRouter:
+    return _cargar_fichero("preguntas_main", os.path.join(RAIZ, "main.py")).router
+
+
+def _router_plantilla() -> APIRouter:
+    return _cargar_fichero("plantilla_main", os.path.join(RAIZ, "Templeted", "main.py")).router
+
+
+# nombre -> (cargador del router, prefijo)
+SUPERFICIES: Dict[str, Tuple[Callable[[], APIRouter], str]] = {
+    "analisis": (_router_analisis, ""),
+    "solver": (_router_solver, ""),
+    "metodologia": (_router_metodologia, ""),
+    "preguntas": (_router_preguntas, ""),
+    "plantilla": (_router_plantilla, "/plantilla"),
+}
+
+
+def _superficies_activas() -> List[str]:
+    pedidas = [s.strip() for s in APP_SURFACES.split(",") if s.strip()]
+    desconocidas = set(pedidas) - set(SUPERFICIES)
+    if desconocidas:
+        raise ValueError(f"APP_SURFACES contiene superficies desconocidas: {sorted(desconocidas)}")
+    return pedidas or list(SUPERFICIES)
+
+
+def create_app() -> FastAPI:
+    app = FastAPI(title="Solver App")
+    origenes = [o.strip() for o in CORS_ORIGINS.split(",") if o.strip()]
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=origenes,
+        # El comodín no es compatible con credenciales
+        allow_credentials="*" not in origenes,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    # El último middleware añadido envuelve a los demás: también mide los preflight de CORS
+    app.add_middleware(MiddlewareMetricas)
+
+    # Las superficies que no importan backend/app (la metodología de app/) acceden
+    # a las sesiones de análisis (y a sus pasos con LLM) a través del estado de la aplicación
+    app.state.sesiones = obtener_sesiones
+    app.state.sugerencias = sugerir_en_sesion
+
+    activas = _superficies_activas()
+
+    # Se registra antes que los routers: tapa las rutas "/" de cada superficie
+    @app.get("/")
+    def indice():
+        return {
+            "mensaje": "Solver App activa.",
+            "superficies": {nombre: SUPERFICIES[nombre][1] or "/" for nombre in activas},
+        }
+
+    for nombre in activas:
+        cargar, prefijo = SUPERFICIES[nombre]
+        app.include_router(cargar(), prefix=prefijo)
+    # /jobs es común a las superficies que encolan trabajos (solve, analisis)
+    app.include_router(router_trabajos)
+    app.include_router(router_metricas)
+    return app
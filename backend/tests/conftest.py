@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Los tests importan ``app`` como lo hacen servidor.py y los bench (desde backend/)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+
+from app.cache import CacheRespuestas
+from app.enrutador import BackendLLM, EnrutadorLLM, leer_backends
+from app.llm import ClienteMock, es_reutilizable
+
+
+class Cliente:
+    def __init__(self, modelo: str, latencia: float = 0.01, error: Exception = None):
+        self.modelo = modelo
+        self.latencia = latencia
+        self.error = error
+        self.llamadas = 0
+
+    async def completar(self, mensajes, timeout=None):
+        self.llamadas += 1
+        await asyncio.sleep(self.latencia)
+        if self.error is not None:
+            raise self.error
+        return f"respuesta de {self.modelo}"
+
+    async def completar_stream(self, mensajes, timeout=None):
+        yield await self.completar(mensajes, timeout)
+
+    async def cerrar(self):
+        pass
+
+
+def semiabierto(backend: BackendLLM) -> None:
+    backend.circuito.estado = "abierto"
+    backend.circuito.abierto_hasta = 0.0
+
+
+def test_una_sola_prueba_en_semiabierto():
+    a, b = Cliente("gpt-4"), Cliente("gpt-4")
+    router = EnrutadorLLM([BackendLLM("a", a), BackendLLM("b", b)])
+    semiabierto(router.backends[0])
+
+    async def escenario():
+        return await asyncio.gather(*(router.completar([]) for _ in range(10)))
+
+    asyncio.run(escenario())
+    assert (a.llamadas, b.llamadas) == (1, 9)
+    assert router.backends[0].circuito.estado == "cerrado"
+
+
+def test_prueba_cancelada_antes_de_arrancar_se_libera():
+    router = EnrutadorLLM([BackendLLM("a", Cliente("gpt-4", latencia=1))])
+    semiabierto(router.backends[0])
+
+    async def escenario():
+        tarea = asyncio.ensure_future(router.completar([]))
+        await asyncio.sleep(0)
+        tarea.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await tarea
+
+    asyncio.run(escenario())
+    assert router.backends[0].circuito.disponible()
+
+
+def test_respaldo_no_se_cachea():
+    router = EnrutadorLLM([
+        BackendLLM("a", Cliente("gpt-4", error=RuntimeError("caído"))),
+        BackendLLM("b", Cliente("gpt-4o-mini")),
+        BackendLLM("mock", ClienteMock()),
+    ])
+    cache = CacheRespuestas(ruta_disco="")
+
+    async def escenario():
+        texto = await cache.obtener_o_calcular("clave", lambda: router.completar([]))
+        return texto, await cache.obtener("clave")
+
+    texto, cacheado = asyncio.run(escenario())
+    assert texto == "respuesta de gpt-4o-mini" and texto.modelo == "gpt-4o-mini"
+    assert not es_reutilizable(texto)
+    assert cacheado is None
+
+
+def test_mock_nunca_es_reutilizable():
+    router = EnrutadorLLM([BackendLLM("mock", ClienteMock())])
+    assert not es_reutilizable(asyncio.run(router.completar([])))
+
+
+@pytest.mark.parametrize("texto", ["{", "{}", "[]", "[1]", '[{"tipo": "otro"}]', '[{"nombre": "x", "api_key_env": "NO_EXISTE_KEY"}]'])
+def test_config_invalida(texto):
+    with pytest.raises(ValueError):
+        leer_backends(texto)
@@ -0,0 +1,105 @@
+import asyncio
+import time
+
+import pytest
+
+from app.main import ProblemCreate, is_math_problem, solve_content
+from app.matematicas import (
+    ErrorSimbolico,
+    MotorMatematico,
+    PoolSimbolico,
+    TiempoAgotado,
+    _canonicalizar,
+    _parsear,
+    detectar_operacion,
+    extraer_expresion,
+    validar_expresion,
+)
+
+
+def problema(descripcion: str, tipo: str = "general") -> ProblemCreate:
+    return ProblemCreate(title="t", description=descripcion, type=tipo)
+
+
+def canonicalizar(enunciado: str):
+    expresion, variable = extraer_expresion(enunciado)
+    return _canonicalizar(detectar_operacion(enunciado), expresion, variable)
+
+
+def test_palabra_clave_completa():
+    assert not is_math_problem(problema("Alto consumo de aire comprimido en la linea 2"))
+    assert not is_math_problem(problema("Los resúmenes de turno llegan tarde"))
+    assert is_math_problem(problema("Calcula la integral de x^2 dx"))
+    assert is_math_problem(problema("Halla la derivada de sin(x)"))
+    assert is_math_problem(problema("sum of the first n squares"))
+
+
+def test_variable_indicada_con_para():
+    expresion, variable = extraer_expresion("Resuelve 2x + 3 = 7 para x")
+    assert (expresion, variable) == ("2x + 3 = 7", "x")
+
+
+def test_resuelve_ecuacion_con_variable():
+    pool = PoolSimbolico(procesos=1)
+    try:
+        pasos = asyncio.run(MotorMatematico(pool).resolver("Resuelve 2x + 3 = 7 para x"))
+    finally:
+        pool.cerrar()
+    assert "x = <code>2</code>" in pasos[-2]
+    assert "correcta" in pasos[-1]
+
+
+@pytest.mark.parametrize("enunciado", [
+    "Calcula la suma de 2 y 3",
+    "Deriva x^2 y simplifica",
+    "Calcula preview(x)",
+])
+def test_texto_no_es_producto_de_letras(enunciado):
+    with pytest.raises(ErrorSimbolico):
+        canonicalizar(enunciado)
+
+
+@pytest.mark.parametrize("expresion", ["preview(x)", "exec(x)", "Symbol(x)", "x.__class__"])
+def test_solo_nombres_permitidos(expresion):
+    with pytest.raises(ErrorSimbolico):
+        _parsear(expresion)
+
+
+@pytest.mark.parametrize("expresion, esperado", [
+    ("sen x", "sin(x)"),
+    ("e^x sin(x)", "exp(x)*sin(x)"),
+    ("raiz(x) + ln(x)", "sqrt(x) + log(x)"),
+    ("(x+1) (x-1)", "(x - 1)*(x + 1)"),
+    ("2x*y", "2*x*y"),
+])
+def test_expresiones_validas(expresion, esperado):
+    assert str(_parsear(expresion)) == esperado
+
+
+def test_texto_vuelve_a_los_pasos_generales():
+    pasos = asyncio.run(solve_content(problema("Calcula la suma de 2 y 3", tipo="matematico")))
+    assert pasos[0] == "<p>1) Interpretar la expresión y variables implicadas.</p>"
+
+
+def test_enunciado_largo_no_bloquea():
+    inicio = time.perf_counter()
+    with pytest.raises(ErrorSimbolico):
+        asyncio.run(MotorMatematico(PoolSimbolico(procesos=1)).resolver("integral de " + "1" * 20000))
+    with pytest.raises(ErrorSimbolico):
+        validar_expresion("x " * 100000)
+    assert time.perf_counter() - inicio < 1
+
+
+def test_trabajador_reemplazado_tras_timeout():
+    async def escenario():
+        pool = PoolSimbolico(procesos=1)
+        try:
+            with pytest.raises(TiempoAgotado):
+                # El primer trabajo paga el arranque del proceso: no cabe en 1 ms
+                await pool.ejecutar("canonicalizar", "simplificar", "x^2", None, timeout=0.001)
+            return await pool.ejecutar("canonicalizar", "simplificar", "x^2", None)
+        finally:
+            pool.cerrar()
+
+    operacion, variable, _ = asyncio.run(escenario())
+    assert (operacion, variable) == ("simplificar", "x")
@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+
+from app import sesiones as modulo_sesiones
+from app.llm import LLMError
+from app.sesiones import (
+    SESSION_RECENT_STEPS,
+    SESSION_STEP_CHARS,
+    SESSION_SUMMARY_CHARS,
+    SESSION_TASK_CHARS,
+    AlmacenSesiones,
+    construir_mensajes_sesion,
+    sugerir_en_sesion,
+)
+
+PROBLEMA = {
+    "problema": "La línea 3 se detiene varias veces por turno",
+    "ubicacion": "Planta norte, transportador principal",
+    "como": "Paro súbito del motor con alarma de sobrecorriente",
+    "cuando": "Principalmente en el turno de noche",
+    "quien": "Operadores de turno y mantenimiento",
+    "quePaso": "El motor se sobrecalienta, salta la protección y la línea queda parada 20 minutos",
+}
+METODOS = ["5 porques", "5 porques", "5 porques", "ishikawa", "fmea"]
+TAREA = "Formula el siguiente '¿por qué?' de la cadena y propón una respuesta probable en una frase."
+
+
+def respuesta(n: int, repeticiones: int = 1) -> str:
+    return (
+        f"Porque en el paso {n} se observó que la ventilación del motor estaba obstruida por polvo. "
+        "La limpieza preventiva no figura en el plan de mantenimiento del turno de noche. " * repeticiones
+    )
+
+
+def caracteres(mensajes) -> int:
+    return sum(len(m["content"]) for m in mensajes)
+
+
+@pytest.fixture
+def sesiones(tmp_path):
+    return AlmacenSesiones(ruta=str(tmp_path / "sesiones.db"))
+
+
+@pytest.mark.parametrize("repeticiones", [1, 50])
+def test_prompt_acotado_y_prefijo_estable(sesiones, repeticiones):
+    sesion = sesiones.crear(PROBLEMA)
+    inicial = construir_mensajes_sesion(sesion, TAREA)
+    # Prefijo fijo + resumen máximo + ventana de recientes + tarea (con holgura
+    # para cabeceras y numeración), independiente del número de pasos
+    cota = caracteres(inicial) + SESSION_SUMMARY_CHARS + SESSION_RECENT_STEPS * (SESSION_STEP_CHARS + 40) + 200
+
+    for n in range(1, 201):
+        sesion = sesiones.agregar_paso(sesion["id"], METODOS[(n - 1) % len(METODOS)], respuesta(n, repeticiones))
+        mensajes = construir_mensajes_sesion(sesion, TAREA)
+        assert caracteres(mensajes) <= cota, f"paso {n}"
+        # Sistema + problema no cambian entre pasos: el proveedor reutiliza su caché de prefijo
+        assert mensajes[:2] == inicial[:2], f"paso {n}"
+        assert mensajes[-1]["content"].endswith(f"Tarea: {TAREA}")
+
+    assert len(sesion["recientes"]) == SESSION_RECENT_STEPS
+    assert sesion["recientes"][-1]["numero"] == 200
+
+
+def primer_delta(sugerencia):
+    return asyncio.run(sugerencia.__anext__())
+
+
+def test_sugerir_sin_cliente_falla_como_el_endpoint(monkeypatch):
+    # Igual que /sesiones/{id}/analizar: sin clave no se cae en silencio al mock
+    monkeypatch.setattr(modulo_sesiones, "obtener_cliente", lambda: None)
+    with pytest.raises(LLMError):
+        primer_delta(sugerir_en_sesion("cualquiera"))
+
+
+def test_sugerir_limita_la_tarea():
+    with pytest.raises(ValueError):
+        primer_delta(sugerir_en_sesion("cualquiera", tarea="x" * (SESSION_TASK_CHARS + 1)))
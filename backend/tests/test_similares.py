@@ -0,0 +1,47 @@
+import pytest
+
+from app.similares import IndiceSimilares, normalizar
+
+CAMPOS = [
+    "La línea 2 se detiene varias veces por turno",
+    "Nave A, transportador principal",
+    "Paro súbito del motor con alarma de sobrecorriente",
+    "Principalmente en el turno de noche",
+    "Operadores de turno y mantenimiento",
+    "El motor se sobrecalienta y salta la protección",
+]
+
+
+def problema(**cambios) -> str:
+    campos = list(CAMPOS)
+    for posicion, texto in cambios.items():
+        campos[int(posicion[1:])] = texto
+    return "\n".join(campos)
+
+
+@pytest.fixture
+def indice(tmp_path):
+    indice = IndiceSimilares(ruta=str(tmp_path / "similares.db"))
+    indice.agregar("analisis", problema(), "Limpiar la ventilación del motor.")
+    return indice
+
+
+def test_normalizar_conserva_negaciones_e_identificadores():
+    assert normalizar("El motor no arranca en la Nave B") == ["motor", "no", "arranca", "nave", "b"]
+    # "A" al principio de frase es la preposición
+    assert normalizar("A las 3 se detiene") == ["3", "detiene"]
+
+
+def test_mismo_problema_reescrito_se_reutiliza(indice):
+    reescrito = problema(c0="Se detiene la línea 2 varias veces en cada turno")
+    assert indice.previo("analisis", reescrito) is not None
+
+
+@pytest.mark.parametrize("cambios", [
+    {"c5": "El motor no se sobrecalienta y no salta la protección"},
+    {"c0": "La línea 7 se detiene varias veces por turno", "c1": "Nave B, transportador principal"},
+    {"c1": "Nave B, transportador principal"},
+    {"c1": "Almacén exterior, muelle de carga"},
+])
+def test_problema_distinto_no_se_reutiliza(indice, cambios):
+    assert indice.previo("analisis", problema(**cambios)) is None
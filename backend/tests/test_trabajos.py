@@ -0,0 +1,110 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from app import trabajos
+from app.trabajos import AlmacenTrabajos, GestorTrabajos
+
+
+@pytest.fixture
+def almacen(tmp_path):
+    return AlmacenTrabajos(ruta=str(tmp_path / "trabajos.db"), caducidad=30, max_intentos=2)
+
+
+def caducar(almacen, trabajo_id):
+    # Simula un proceso caído: su último latido queda más atrás que la caducidad
+    almacen._conn().execute("UPDATE trabajos SET latido = ? WHERE id = ?", (time.time() - 60, trabajo_id))
+
+
+def test_reclamar_en_orden_y_una_sola_vez(almacen):
+    primero = almacen.encolar("solve", {"n": 1})
+    almacen.encolar("solve", {"n": 2})
+    almacen.encolar("otro", {"n": 3})
+
+    trabajo = almacen.reclamar(["solve"], "a")
+    assert trabajo["id"] == primero["id"]
+    assert (trabajo["estado"], trabajo["dueno"], trabajo["intentos"]) == ("running", "a", 1)
+    assert almacen.reclamar(["solve"], "b")["entrada"] == {"n": 2}
+    # Solo quedan trabajos de tipos que este trabajador no sabe ejecutar
+    assert almacen.reclamar(["solve"], "c") is None
+
+
+def test_latido_caducado_vuelve_a_la_cola_y_agota_intentos(almacen):
+    trabajo = almacen.encolar("solve", {})
+    almacen.reclamar(["solve"], "a")
+    caducar(almacen, trabajo["id"])
+
+    recuperado = almacen.reclamar(["solve"], "b")
+    assert (recuperado["id"], recuperado["dueno"], recuperado["intentos"]) == (trabajo["id"], "b", 2)
+    # El dueño anterior ya no puede escribir sobre el trabajo
+    almacen.terminar(trabajo["id"], "a", "done", {"x": 1})
+    assert almacen.obtener(trabajo["id"])["estado"] == "running"
+
+    caducar(almacen, trabajo["id"])
+    assert almacen.reclamar(["solve"], "c") is None
+    fallido = almacen.obtener(trabajo["id"])
+    assert fallido["estado"] == "failed" and fallido["dueno"] is None
+
+
+def test_cancelar(almacen):
+    en_cola = almacen.encolar("solve", {})
+    assert almacen.cancelar(en_cola["id"])["estado"] == "cancelled"
+
+    en_curso = almacen.encolar("solve", {})
+    almacen.reclamar(["solve"], "a")
+    marcado = almacen.cancelar(en_curso["id"])
+    assert (marcado["estado"], marcado["cancelar"]) == ("running", True)
+    assert almacen.latir(en_curso["id"], "a") is True
+
+    # Si su trabajador muere, el trabajo se cancela en vez de reintentarse
+    caducar(almacen, en_curso["id"])
+    assert almacen.reclamar(["solve"], "b") is None
+    assert almacen.obtener(en_curso["id"])["estado"] == "cancelled"
+
+
+def test_devolver_no_cuenta_el_intento(almacen):
+    trabajo = almacen.encolar("solve", {})
+    almacen.reclamar(["solve"], "a")
+    almacen.devolver(trabajo["id"], "a")
+    devuelto = almacen.obtener(trabajo["id"])
+    assert (devuelto["estado"], devuelto["dueno"], devuelto["intentos"]) == ("queued", None, 0)
+
+
+def test_cola_llena(almacen):
+    assert almacen.encolar("solve", {}, max_cola=2) is not None
+    assert almacen.encolar("solve", {}, max_cola=2) is not None
+    assert almacen.encolar("solve", {}, max_cola=2) is None
+    # Los trabajos en curso no ocupan cola
+    almacen.reclamar(["solve"], "a")
+    assert almacen.encolar("solve", {}, max_cola=2) is not None
+
+
+def test_detener_durante_el_reclamo_devuelve_el_trabajo(almacen, monkeypatch):
+    monkeypatch.setitem(trabajos.TIPOS, "solve", None)
+    trabajo = almacen.encolar("solve", {})
+    dentro, seguir = threading.Event(), threading.Event()
+    reclamar = almacen.reclamar
+
+    def reclamar_lento(tipos, dueno):
+        resultado = reclamar(tipos, dueno)
+        dentro.set()
+        seguir.wait(5)
+        return resultado
+
+    monkeypatch.setattr(almacen, "reclamar", reclamar_lento)
+
+    async def escenario():
+        gestor = GestorTrabajos(almacen)
+        gestor.arrancar(1)
+        await asyncio.to_thread(dentro.wait, 5)
+        # El apagado llega con el trabajo ya reclamado pero aún sin devolver al bucle
+        detener = asyncio.create_task(gestor.detener())
+        await asyncio.sleep(0.05)
+        seguir.set()
+        await detener
+
+    asyncio.run(escenario())
+    devuelto = almacen.obtener(trabajo["id"])
+    assert (devuelto["estado"], devuelto["dueno"], devuelto["intentos"]) == ("queued", None, 0)
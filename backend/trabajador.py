@@ -0,0 +1,85 @@
+"""Proceso dedicado a los trabajos en segundo plano (sin servidor HTTP).
+
+Importa las superficies que registran tipos de trabajo (``solve`` en
+app/main.py, ``analizar`` en main.py) y corre JOBS_WORKERS trabajadores por
+proceso sobre la cola SQLite compartida (app/trabajos.py). Así el
+procesamiento se escala aparte del front web: más procesos aquí (``--procesos``
+o más instancias ``worker`` en el Procfile) y, si se quiere, JOBS_WORKERS=0
+en los procesos web para que solo encolen.
+
+Con SIGTERM/SIGINT los trabajos en curso se interrumpen y vuelven a la cola.
+
+Uso:  python backend/trabajador.py [--trabajadores N] [--procesos M]
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import signal
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BACKEND_DIR)
+
+from app.trabajos import JOBS_WORKERS, TIPOS, obtener_gestor  # noqa: E402
+
+
+def registrar_tipos() -> None:
+    import main  # noqa: F401  (analizar)
+    import app.main  # noqa: F401  (solve)
+
+
+async def servir(trabajadores: int) -> None:
+    from app.auditoria import obtener_escritor
+    from app.llm import cerrar_clientes
+    from app.matematicas import cerrar_motor
+
+    parar = asyncio.Event()
+    bucle = asyncio.get_running_loop()
+    for senal in (signal.SIGTERM, signal.SIGINT):
+        bucle.add_signal_handler(senal, parar.set)
+
+    gestor = obtener_gestor()
+    gestor.arrancar(trabajadores)
+    print(f"[trabajador {os.getpid()}] {trabajadores} trabajadores, tipos: {sorted(TIPOS)}", flush=True)
+    await parar.wait()
+
+    await gestor.detener()
+    await obtener_escritor().detener()
+    await cerrar_clientes()
+    cerrar_motor()
+
+
+def proceso(trabajadores: int) -> None:
+    # Las rutas por defecto (data/, logs/) son relativas al directorio actual:
+    # se lanza desde el mismo directorio que el servidor web o con JOBS_DB_PATH absoluto
+    registrar_tipos()
+    asyncio.run(servir(trabajadores))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--trabajadores", type=int, default=max(1, JOBS_WORKERS), help="trabajos simultáneos por proceso")
+    parser.add_argument("--procesos", type=int, default=int(os.getenv("JOBS_PROCESSES", "1")))
+    args = parser.parse_args()
+
+    if args.procesos <= 1:
+        proceso(args.trabajadores)
+        return
+    # "spawn" como el pool simbólico: cada proceso arranca limpio. Ctrl+C/SIGTERM
+    # del grupo llega a todos y cada uno devuelve sus trabajos a la cola
+    ctx = multiprocessing.get_context("spawn")
+    hijos = [ctx.Process(target=proceso, args=(args.trabajadores,)) for _ in range(args.procesos)]
+    for hijo in hijos:
+        hijo.start()
+    signal.signal(signal.SIGTERM, lambda *_: [h.terminate() for h in hijos if h.is_alive()])
+    for hijo in hijos:
+        try:
+            hijo.join()
+        except KeyboardInterrupt:
+            # Ctrl+C también les llega a los hijos: se espera a que devuelvan sus trabajos
+            hijo.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,7 @@
-<<<<<<< HEAD
-from fastapi import FastAPI, HTTPException
+from fastapi import APIRouter, FastAPI, HTTPException
 from pydantic import BaseModel
 
-app = FastAPI()
+router = APIRouter()
 
 # Modelo de cliente para los datos que recibiremos
 class Cliente(BaseModel):
@@ -11,7 +10,7 @@ class Cliente(BaseModel):
     pregunta: str
 
 # Ruta para recibir las preguntas
-@app.post("/pregunta/")
+@router.post("/pregunta/")
 async def recibir_pregunta(cliente: Cliente):
     # Aquí se hace la interacción con el modelo LLM
     respuesta = obtener_respuesta_IA(cliente.pregunta)  # Función que conecta con tu IA
@@ -27,33 +26,7 @@ def guardar_en_base_datos(cliente: Cliente):
     # Aquí conectas tu base de datos para guardar la información
     # Por ejemplo, podrías guardar en una base de datos SQL, MongoDB, etc.
     pass
-=======
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-
-app = FastAPI()
-
-# Modelo de cliente para los datos que recibiremos
-class Cliente(BaseModel):
-    nombre: str
-    email: str
-    pregunta: str
-
-# Ruta para recibir las preguntas
-@app.post("/pregunta/")
-async def recibir_pregunta(cliente: Cliente):
-    # Aquí se hace la interacción con el modelo LLM
-    respuesta = obtener_respuesta_IA(cliente.pregunta)  # Función que conecta con tu IA
-    # Guardamos los datos en la base de datos (ejemplo simplificado)
-    guardar_en_base_datos(cliente)
-    return {"respuesta": respuesta}
-
-def obtener_respuesta_IA(pregunta: str):
-    # Aquí iría tu lógica para llamar al LLM, como OpenAI o un modelo local
-    return "Esta es la respuesta generada por la IA para: " + pregunta
-
-def guardar_en_base_datos(cliente: Cliente):
-    # Aquí conectas tu base de datos para guardar la información
-    # Por ejemplo, podrías guardar en una base de datos SQL, MongoDB, etc.
-    pass
->>>>>>> 238dc3016fbae2ad179df19d606791c34c6ca42d
+
+# App independiente (uvicorn main:app); el servidor unificado (backend/servidor.py) monta solo el router
+app = FastAPI()
+app.include_router(router)